@@ -0,0 +1,272 @@
+# app/admission.py
+"""
+Admission control for the API.
+
+Every HTTP request is put into a route class (public reads, authenticated reads,
+downloads and exports, writes, uploads, auth) and has to take a slot from that
+class's budget before it reaches the app. The slot is held until the response
+body is sent, which is why streamed downloads and exports have their own class:
+a few slow clients can only use up the download budget. When a class is saturated, requests queue up to a fixed depth
+and are then shed with a fast 503 + Retry-After, so a burst of uploads or logins
+can't starve the cheap catalog reads of worker threads.
+
+The auth endpoints that call out to Firebase are additionally protected by
+per-client-IP token buckets. Behind proxies, the client IP is the
+X-Forwarded-For entry added by the outermost of TRUSTED_PROXY_HOPS trusted
+proxies (default 1, the App Engine front end); entries before it are set by the
+client and ignored. With TRUSTED_PROXY_HOPS=0 the header isn't used at all.
+
+Budgets are configured with ADMISSION_LIMITS, e.g.
+    ADMISSION_LIMITS="public_read=16:64,auth_read=8:32,download=4:16,write=6:24,upload=2:8,auth=4:16"
+where each value is <concurrency>:<queue depth>.
+"""
+import asyncio
+import math
+import os
+import time
+
+from starlette.responses import JSONResponse
+
+PUBLIC_READ = "public_read"
+AUTH_READ = "auth_read"
+DOWNLOAD = "download"
+WRITE = "write"
+UPLOAD = "upload"
+AUTH = "auth"
+
+# The defaults add up to anyio's 40 worker threads, so every class always has
+# threads available for its own budget.
+DEFAULT_LIMITS = {
+    PUBLIC_READ: (16, 64),
+    AUTH_READ: (8, 32),
+    DOWNLOAD: (4, 16),
+    WRITE: (6, 24),
+    UPLOAD: (2, 8),
+    AUTH: (4, 16),
+}
+RETRY_AFTER_SECONDS = {
+    PUBLIC_READ: 1,
+    AUTH_READ: 1,
+    DOWNLOAD: 5,
+    WRITE: 2,
+    UPLOAD: 5,
+    AUTH: 5,
+}
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+RATE_LIMITED_PATHS = {"/api/auth/login", "/api/auth/forgot-password"}
+# Material downloads, roster and enrollment exports; /api/storage/ serves signed URLs
+DOWNLOAD_SUFFIXES = ("/download", "/students/export", "/export/enrollments")
+DOWNLOAD_PREFIXES = ("/api/storage/",)
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+# Monitoring must keep working while the API is shedding load
+UNLIMITED_PATHS = {"/metrics"}
+
+
+def parse_limits(value: str | None) -> dict[str, tuple[int, int]]:
+    limits = dict(DEFAULT_LIMITS)
+    if not value:
+        return limits
+    for item in value.split(","):
+        name, _, budget = item.strip().partition("=")
+        if name not in limits:
+            raise ValueError(f"Unknown admission route class '{name}' in ADMISSION_LIMITS")
+        concurrency, _, queue_depth = budget.partition(":")
+        limits[name] = (int(concurrency), int(queue_depth or 0))
+    return limits
+
+
+def classify(scope) -> str:
+    """Maps a request to its route class using only the method, path and headers."""
+    path = scope["path"]
+    method = scope["method"]
+    if path.startswith("/api/auth/"):
+        return AUTH
+    if method in READ_METHODS:
+        if path.rstrip("/").endswith(DOWNLOAD_SUFFIXES) or path.startswith(DOWNLOAD_PREFIXES):
+            return DOWNLOAD
+        for name, _ in scope["headers"]:
+            if name == b"authorization":
+                return AUTH_READ
+        return PUBLIC_READ
+    if method == "POST" and path.rstrip("/").endswith("/materials"):
+        return UPLOAD
+    return WRITE
+
+
+def client_ip(scope, trusted_hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """
+    The address the outermost trusted proxy saw the request come from. Each
+    proxy appends to X-Forwarded-For, so only the last `trusted_hops` entries
+    are trustworthy; anything before them is whatever the client sent.
+    """
+    forwarded = []
+    if trusted_hops > 0:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                forwarded += [entry.strip() for entry in value.decode("latin-1").split(",") if entry.strip()]
+    if forwarded:
+        return forwarded[max(len(forwarded) - trusted_hops, 0)]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RouteClassLimiter:
+    """
+    A concurrency budget with a bounded wait queue. Only touched from the event
+    loop thread, so the counters need no locking.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_depth: int, queue_timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+
+    async def acquire(self) -> bool:
+        if not self._slots.locked():
+            await self._slots.acquire()
+        else:
+            if self.queued >= self.queue_depth:
+                self.rejected += 1
+                return False
+            self.queued += 1
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                return False
+            finally:
+                self.queued -= 1
+                self.wait_seconds += time.perf_counter() - started
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_seconds_total": round(self.wait_seconds, 3),
+        }
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets: `rate` tokens per second, up to `burst` at once."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self.limited = 0
+
+    def take(self, key: str) -> float:
+        """Takes a token for `key`. Returns 0 if allowed, otherwise seconds until one is available."""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            self.limited += 1
+            return (1 - tokens) / self.rate
+        if len(self._buckets) >= self.max_keys and key not in self._buckets:
+            self._prune(now)
+        self._buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def _prune(self, now: float):
+        # Buckets that have refilled completely carry no state worth keeping
+        full_after = self.burst / self.rate
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < full_after}
+        if len(self._buckets) >= self.max_keys:
+            self._buckets.clear()
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app, limits: dict[str, tuple[int, int]] | None = None, queue_timeout: float = 5.0,
+                 auth_rate_per_minute: float = 10, auth_burst: int = 5):
+        self.app = app
+        limits = limits or DEFAULT_LIMITS
+        self.limiters = {
+            name: RouteClassLimiter(name, concurrency, queue_depth, queue_timeout)
+            for name, (concurrency, queue_depth) in limits.items()
+        }
+        self.auth_buckets = TokenBucketLimiter(rate=auth_rate_per_minute / 60, burst=auth_burst)
+        _registry.append(self)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "POST" and scope["path"].rstrip("/") in RATE_LIMITED_PATHS:
+            wait = self.auth_buckets.take(client_ip(scope))
+            if wait:
+                response = JSONResponse(
+                    {"detail": "Too many attempts. Please try again later."},
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+                await response(scope, receive, send)
+                return
+
+        if scope["path"] in UNLIMITED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify(scope)
+        limiter = self.limiters[route_class]
+        if not await limiter.acquire():
+            response = JSONResponse(
+                {"detail": "The server is busy. Please retry shortly."},
+                status_code=503,
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS[route_class])},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "classes": {name: limiter.snapshot() for name, limiter in self.limiters.items()},
+            "auth_rate_limited": self.auth_buckets.limited,
+        }
+
+
+_registry: list[AdmissionControlMiddleware] = []
+
+
+def snapshot() -> dict:
+    """Counters for the admission middleware installed in this process."""
+    if not _registry:
+        return {"enabled": False}
+    return {"enabled": True, **_registry[-1].snapshot()}
+
+
+def middleware_options() -> dict:
+    return {
+        "limits": parse_limits(os.getenv("ADMISSION_LIMITS")),
+        "queue_timeout": float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5")),
+        "auth_rate_per_minute": float(os.getenv("AUTH_RATE_LIMIT_PER_MINUTE", "10")),
+        "auth_burst": int(os.getenv("AUTH_RATE_LIMIT_BURST", "5")),
+    }
@@ -0,0 +1,295 @@
+# app/audit.py
+"""
+Audit trail of mutations (who created, enrolled, uploaded, deleted,
+reassigned or changed roles), kept out of the request's own transaction.
+
+crud functions call `record_on_commit` next to their events. Once the
+transaction commits, the event is appended to this process's spill segment
+on disk (one write(), no extra database round trip) and to an in-memory
+batch. A background thread inserts the batch with one multi-row INSERT every
+AUDIT_FLUSH_SECONDS, or sooner once AUDIT_BATCH_SIZE events are waiting, and
+then deletes the segment.
+
+The segment makes the trail survive crashes: a segment that is no longer
+locked by a live process (its owner crashed, or its flush failed) is read back
+and inserted by the next sweep, in any process sharing AUDIT_SPILL_DIR. Every
+event has a unique event_id, so a segment inserted twice doesn't duplicate
+rows. At most AUDIT_BUFFER_MAX events are held in memory; beyond that the
+flush reads them back from the segment. With AUDIT_FSYNC=true every write is
+also fsync'ed, which survives power loss at the cost of a disk flush per
+mutation.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import metrics, models, request_context
+from .database import SessionLocal, after_commit, dialect_insert
+
+AUDIT_SPILL_DIR = os.getenv("AUDIT_SPILL_DIR", "audit_spill")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+AUDIT_BUFFER_MAX = int(os.getenv("AUDIT_BUFFER_MAX", "20000"))
+AUDIT_FSYNC = os.getenv("AUDIT_FSYNC", "false").lower() == "true"
+RECOVER_SECONDS = 30
+
+audit_events = metrics.Counter(
+    "audit_events_total",
+    "Audit events by outcome: recorded (spilled to disk), flushed (inserted from memory) or recovered (inserted from a spill file).",
+    ("outcome",),
+)
+flush_failures = metrics.Counter("audit_flush_failures_total", "Audit inserts that failed and were left on disk for the next sweep.", ())
+
+
+class _Segment:
+    """The spill file being appended to, and the events written to it so far (unless there were too many)."""
+
+    def __init__(self, spill_dir: str):
+        self.pid = os.getpid()
+        self.path = os.path.join(spill_dir, f"audit-{self.pid}-{uuid.uuid4().hex}.log")
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o600)
+        # Held until the segment is flushed; an unlocked segment belongs to nobody
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        self.events: list[dict] = []
+        self.count = 0
+
+
+class AuditLog:
+    def __init__(self, spill_dir: str = AUDIT_SPILL_DIR):
+        self.spill_dir = spill_dir
+        self.last_error: str | None = None
+        self._segment: _Segment | None = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread_pid = None
+
+    def record(self, action: str, actor_id: int | None, course_id: int | None = None,
+               route: str | None = None, details: dict | None = None):
+        event = {
+            "event_id": uuid.uuid4().hex,
+            "occurred_at": datetime.now(timezone.utc).isoformat(),
+            "action": action,
+            "actor_id": actor_id,
+            "course_id": course_id,
+            "route": route,
+            "details": details or {},
+        }
+        line = (json.dumps(event, separators=(",", ":"), default=str) + "\n").encode()
+        with self._lock:
+            segment = self._current_segment()
+            os.write(segment.fd, line)
+            if AUDIT_FSYNC:
+                os.fsync(segment.fd)
+            segment.count += 1
+            if segment.events is not None:
+                if len(segment.events) < AUDIT_BUFFER_MAX:
+                    segment.events.append(event)
+                else:
+                    # Bounded memory: the flush reads this segment back from disk instead
+                    segment.events = None
+            pending = segment.count
+        audit_events.inc("recorded")
+        if self._thread_pid != os.getpid():
+            self.start()
+        if pending >= AUDIT_BATCH_SIZE:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Inserts the events recorded so far. Returns how many; on failure they stay on disk for the next sweep."""
+        with self._flush_lock:
+            with self._lock:
+                segment = self._segment
+                if segment is None or segment.pid != os.getpid():
+                    return 0
+                # Later events go to a new segment
+                self._segment = None
+            try:
+                events = segment.events if segment.events is not None else _read_segment(segment.path)
+                _insert(events)
+            except Exception as e:
+                self._failed(segment.path, e)
+                os.close(segment.fd)
+                return 0
+            os.unlink(segment.path)
+            os.close(segment.fd)
+            audit_events.inc("flushed", amount=len(events))
+            self.last_error = None
+            return len(events)
+
+    def recover(self) -> int:
+        """Inserts the events of spill segments no live process holds (crashed owners, failed flushes)."""
+        recovered = 0
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "audit-*.log"))):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                # Already flushed and removed by its owner between the listing and the lock
+                if os.fstat(fd).st_nlink == 0:
+                    continue
+                events = _read_segment(path)
+                _insert(events)
+                os.unlink(path)
+                recovered += len(events)
+            except Exception as e:
+                self._failed(path, e)
+            finally:
+                os.close(fd)
+        if recovered:
+            audit_events.inc("recovered", amount=recovered)
+            print(f"Audit log: recovered {recovered} event(s) from spill files.")
+        return recovered
+
+    def start(self):
+        """Starts the flush thread of this process (again after a fork)."""
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            first_start = self._thread_pid is None
+            self._thread_pid = os.getpid()
+            # A forked child must not append to (or flush) its parent's segment
+            if self._segment is not None and self._segment.pid != os.getpid():
+                self._segment = None
+            self._stopping.clear()
+        os.makedirs(self.spill_dir, exist_ok=True)
+        threading.Thread(target=self._run, name="audit-flush", daemon=True).start()
+        if first_start:
+            # Manage commands and workers exit without a lifespan shutdown
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Flushes what is buffered; the flush thread exits."""
+        self._stopping.set()
+        self._wake.set()
+        self.flush()
+
+    def status(self) -> dict:
+        with self._lock:
+            buffered = self._segment.count if self._segment is not None and self._segment.pid == os.getpid() else 0
+        return {
+            "buffered": buffered,
+            "spill_files": len(glob.glob(os.path.join(self.spill_dir, "audit-*.log"))),
+            "batch_size": AUDIT_BATCH_SIZE,
+            "flush_seconds": AUDIT_FLUSH_SECONDS,
+            "last_error": self.last_error,
+        }
+
+    def _current_segment(self) -> _Segment:
+        if self._segment is None or self._segment.pid != os.getpid():
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._segment = _Segment(self.spill_dir)
+        return self._segment
+
+    def _failed(self, path: str, error: Exception):
+        flush_failures.inc()
+        self.last_error = f"{type(error).__name__}: {error}"
+        print(f"Audit log: could not insert {path}, kept for retry: {error!r}")
+
+    def _run(self):
+        next_recovery = time.monotonic()
+        while not self._stopping.is_set():
+            if time.monotonic() >= next_recovery:
+                self.recover()
+                next_recovery = time.monotonic() + RECOVER_SECONDS
+            self._wake.wait(AUDIT_FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Audit log: flush failed: {e!r}")
+
+
+def _read_segment(path: str) -> list[dict]:
+    events = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # A line cut short by a crash mid-write
+                continue
+    return events
+
+
+def _insert(events: list[dict]):
+    if not events:
+        return
+    rows = [{**event, "occurred_at": datetime.fromisoformat(event["occurred_at"])} for event in events]
+    db = SessionLocal()
+    try:
+        table = models.AuditEvent.__table__
+        db.execute(dialect_insert(db, table).on_conflict_do_nothing(index_elements=[table.c.event_id]), rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+_log = AuditLog()
+
+
+def record_on_commit(db, action: str, course_id: int | None = None, **details):
+    """
+    Audits `action` once `db`'s transaction commits, attributed to the user the
+    current request acts as (None outside requests).
+    """
+    actor_id = request_context.current_principal_id()
+    route = request_context.current_route()
+    after_commit(db, lambda: _log.record(action, actor_id, course_id, route, details))
+
+
+def query_events(db: Session, actor_id: int | None = None, course_id: int | None = None, action: str | None = None,
+                 since: datetime | None = None, until: datetime | None = None, before_id: int | None = None,
+                 limit: int = 100) -> tuple[list[models.AuditEvent], int | None]:
+    """
+    One page of audit events, newest (highest id) first: (events, `before_id`
+    of the next page or None). Events only show up here once they are flushed.
+    """
+    events = models.AuditEvent
+    query = select(events)
+    if actor_id is not None:
+        query = query.where(events.actor_id == actor_id)
+    if course_id is not None:
+        query = query.where(events.course_id == course_id)
+    if action:
+        query = query.where(events.action == action)
+    if since is not None:
+        query = query.where(events.occurred_at >= since)
+    if until is not None:
+        query = query.where(events.occurred_at < until)
+    if before_id is not None:
+        query = query.where(events.id < before_id)
+    rows = db.scalars(query.order_by(events.id.desc()).limit(limit + 1)).all()
+    next_before_id = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_before_id
+
+
+def flush() -> int:
+    return _log.flush()
+
+
+def start():
+    _log.start()
+
+
+def stop():
+    _log.stop()
+
+
+def status() -> dict:
+    return _log.status()
@@ -0,0 +1,211 @@
+# app/blob_cache.py
+"""
+A size-bounded, least-recently-used cache of material blobs on local disk.
+
+Blob paths are never overwritten (every upload gets a fresh UUID path), so a
+cached copy stays valid until the blob is deleted. Each entry is stored as a
+data file plus a small JSON sidecar, which lets the index be rebuilt from the
+directory.
+
+Several worker processes (gunicorn workers, run-worker) can share one cache
+directory, and BLOB_CACHE_MAX_MB bounds the directory as a whole. A hit
+touches the data file's mtime, so recency is visible to every process. After
+each download the process takes an flock on the directory's .lock file,
+re-reads the directory and removes the least recently used entries until it
+fits, whichever process fetched them. Its in-memory index is then replaced by
+what it found. A process that still indexes an entry another one removed
+finds the data file gone on its next hit and fetches it again.
+
+Concurrent misses for the same blob are coalesced: one thread downloads it
+while the others wait for that download to finish.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import BinaryIO, NamedTuple
+
+from .storage import StorageBackend
+
+BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", "blob_cache")
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+
+class CachedBlob(NamedTuple):
+    path: str
+    size: int
+    etag: str
+    content_type: str
+
+
+class BlobTooLarge(Exception):
+    """The blob can't fit in the cache; the caller should stream it from storage instead."""
+
+    def __init__(self, info):
+        super().__init__(info.path)
+        self.info = info
+
+
+class _Fetch:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error: BaseException | None = None
+
+
+class BlobCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, CachedBlob] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._fetches: dict[str, _Fetch] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        os.makedirs(directory, exist_ok=True)
+        self._trim()
+
+    def open(self, backend: StorageBackend, path: str) -> tuple[BinaryIO, CachedBlob]:
+        """
+        Returns an open file with the blob's bytes and its metadata, downloading
+        the blob on a miss. Raises FileNotFoundError if the blob doesn't exist
+        in storage and BlobTooLarge if it is bigger than the whole cache.
+        """
+        key = hashlib.sha256(path.encode()).hexdigest()
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    try:
+                        f = open(self._data_path(key), "rb")
+                    except FileNotFoundError:
+                        # Evicted by another worker sharing the directory
+                        self._forget(key)
+                    else:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        self._touch(key)
+                        return f, entry
+                fetch = self._fetches.get(key)
+                leader = fetch is None
+                if leader:
+                    fetch = self._fetches[key] = _Fetch()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+            if not leader:
+                fetch.done.wait()
+                if fetch.error is not None:
+                    raise fetch.error
+                continue
+
+            try:
+                self._download(backend, key, path)
+            except BaseException as e:
+                fetch.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._fetches[key]
+                fetch.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+    def _download(self, backend: StorageBackend, key: str, path: str):
+        info = backend.stat(path)
+        if info is None:
+            raise FileNotFoundError(path)
+        if info.size > self.max_bytes:
+            raise BlobTooLarge(info)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".fetch-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in backend.open(path):
+                    out.write(chunk)
+            os.replace(tmp_path, self._data_path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        entry = CachedBlob(path=path, size=info.size, etag=info.etag, content_type=info.content_type)
+        with open(self._data_path(key) + ".json", "w") as f:
+            json.dump(entry._asdict(), f)
+        self._trim()
+
+    def _trim(self):
+        """
+        Evicts least recently used entries of the whole directory (all processes'
+        downloads) until it fits in max_bytes, then re-reads this process's index from it.
+        """
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            found = self._scan()
+            total = sum(entry.size for _, _, entry in found)
+            kept = []
+            for i, (_, key, entry) in enumerate(found):
+                # The newest entry always stays, even if it alone is close to the limit
+                if total > self.max_bytes and i < len(found) - 1:
+                    self._remove_files(key)
+                    total -= entry.size
+                else:
+                    kept.append((key, entry))
+        with self._lock:
+            self._entries = OrderedDict(kept)
+            self._size = total
+
+    def _scan(self) -> list[tuple[float, str, CachedBlob]]:
+        """(last used, key, entry) of every complete entry in the directory, least recently used first."""
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    entry = CachedBlob(**json.load(f))
+                last_used = os.stat(self._data_path(key)).st_mtime
+            except (OSError, ValueError, TypeError):
+                continue
+            found.append((last_used, key, entry))
+        found.sort()
+        return found
+
+    def _touch(self, key: str):
+        try:
+            os.utime(self._data_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _remove_files(self, key: str):
+        for file_path in (self._data_path(key), self._data_path(key) + ".json"):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+
+@lru_cache(maxsize=None)
+def get_cache() -> BlobCache:
+    return BlobCache(BLOB_CACHE_DIR, BLOB_CACHE_MAX_BYTES)
@@ -0,0 +1,295 @@
+# app/course_import.py
+"""
+Bulk course creation for term rollover: importing courses from a JSON or CSV
+file, and cloning existing courses together with their materials.
+
+Both go through `create_courses`, which works in chunks. Each chunk is one
+transaction made of a few multi-row statements: INSERT ... RETURNING for the
+courses, one INSERT for their stats rows and one for the copied materials.
+If a chunk fails, it is retried row by row, so a bad row only fails itself.
+The caller gets a report with one entry per input row.
+
+Cloned materials are copied inside the storage backend (a server-side copy in
+Cloud Storage, a hardlink on local disk) instead of being downloaded and
+uploaded again. Every copy gets its own path: course_materials.file_path is
+unique, and deleting one course must not remove the other's files.
+"""
+import csv
+import io
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import ValidationError
+from sqlalchemy import insert, or_, select
+from sqlalchemy.orm import Session
+
+from . import audit, crud, events, jobs, models, schemas, storage, terms
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "200"))
+MAX_IMPORT_ROWS = int(os.getenv("MAX_IMPORT_ROWS", "5000"))
+MAX_IMPORT_BYTES = 10 * 1024 * 1024
+MATERIAL_COPY_CONCURRENCY = int(os.getenv("MATERIAL_COPY_CONCURRENCY", "8"))
+COURSE_CREATORS = (models.UserRole.admin, models.UserRole.instructor)
+
+
+def parse_rows(data: bytes, file_format: str) -> list[dict]:
+    """
+    Raw rows from a JSON array of objects (or {"courses": [...]}) or a CSV file
+    with a header row. Raises ValueError if the file can't be read.
+    """
+    text = data.decode("utf-8-sig")
+    if file_format == "json":
+        rows = json.loads(text)
+        if isinstance(rows, dict):
+            rows = rows.get("courses")
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("Expected a JSON array of course objects")
+    else:
+        rows = [
+            {key.strip(): (value.strip() or None) if isinstance(value, str) else value
+             for key, value in row.items() if key}
+            for row in csv.DictReader(io.StringIO(text))
+        ]
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ValueError(f"At most {MAX_IMPORT_ROWS} rows can be imported at once")
+    return rows
+
+
+def resolve_rows(db: Session, rows: list[dict], default_owner_id: int) -> tuple[list[dict], list[dict]]:
+    """
+    Validates raw rows and resolves their owners (`owner_id` or `owner_email`,
+    defaulting to the importing user), terms (`term_id` or `term`, a term code)
+    and `clone_from` courses, with one query each for the whole file. Returns
+    (specs for create_courses, error entries).
+    """
+    emails = {row["owner_email"] for row in rows if row.get("owner_email")}
+    owner_ids = ({_int(row.get("owner_id")) for row in rows} | {default_owner_id}) - {None}
+    owners = db.execute(
+        select(models.User.id, models.User.email, models.User.role)
+        .where(or_(models.User.email.in_(emails), models.User.id.in_(owner_ids)))
+    ).all()
+    owners_by_email = {owner.email: owner for owner in owners}
+    owners_by_id = {owner.id: owner for owner in owners}
+    source_ids = {_int(row.get("clone_from")) for row in rows} - {None}
+    existing_sources = set(db.scalars(select(models.Course.id).where(models.Course.id.in_(source_ids)))) if source_ids else set()
+    term_codes = {row["term"] for row in rows if row.get("term")}
+    term_ids = {_int(row.get("term_id")) for row in rows} - {None}
+    found_terms = db.execute(
+        select(models.Term.id, models.Term.code, models.Term.status)
+        .where(or_(models.Term.code.in_(term_codes), models.Term.id.in_(term_ids)))
+    ).all() if term_codes or term_ids else []
+    terms_by_code = {term.code: term for term in found_terms}
+    terms_by_id = {term.id: term for term in found_terms}
+
+    specs, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        try:
+            course = schemas.CourseCreate.model_validate(
+                {field: row.get(field) for field in ("title", "description", "capacity")}
+            )
+        except ValidationError as e:
+            errors.append(_error(number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())))
+            continue
+
+        if row.get("owner_id") not in (None, ""):
+            owner = owners_by_id.get(_int(row["owner_id"]))
+        elif row.get("owner_email"):
+            owner = owners_by_email.get(row["owner_email"])
+        else:
+            owner = owners_by_id.get(default_owner_id)
+        if owner is None:
+            errors.append(_error(number, "Owner not found"))
+            continue
+        if owner.role not in COURSE_CREATORS:
+            errors.append(_error(number, "Owner must be an instructor or admin"))
+            continue
+
+        clone_from = None
+        if row.get("clone_from") not in (None, ""):
+            clone_from = _int(row["clone_from"])
+            if clone_from not in existing_sources:
+                errors.append(_error(number, "Course to clone from not found"))
+                continue
+        if row.get("term_id") not in (None, "") or row.get("term"):
+            term = terms_by_id.get(_int(row["term_id"])) if row.get("term_id") not in (None, "") else terms_by_code.get(row["term"])
+            if term is None:
+                errors.append(_error(number, "Term not found"))
+                continue
+            if term.status not in terms.OPEN_STATUSES:
+                errors.append(_error(number, f"Term {term.code} is {term.status.value}"))
+                continue
+            course.term_id = term.id
+        specs.append({"row": number, "course": course, "owner_id": owner.id, "clone_from": clone_from})
+    return specs, errors
+
+
+def create_courses(db: Session, specs: list[dict], batch_size: int = IMPORT_BATCH_SIZE) -> list[dict]:
+    """Creates the courses described by `specs` (see resolve_rows), one transaction per chunk. Returns a report entry per spec."""
+    report = []
+    for i in range(0, len(specs), batch_size):
+        chunk = specs[i:i + batch_size]
+        try:
+            report.extend(_create_chunk(db, chunk))
+        except Exception as e:
+            if len(chunk) == 1:
+                print(f"Course import: row {chunk[0]['row']} failed: {e!r}")
+                report.append(_error(chunk[0]["row"], "Could not create this course"))
+                continue
+            # Find the offending rows; the others still go in
+            report.extend(create_courses(db, chunk, batch_size=1))
+    return report
+
+
+def import_courses(db: Session, data: bytes, file_format: str, default_owner_id: int,
+                   batch_size: int = IMPORT_BATCH_SIZE, dry_run: bool = False) -> dict:
+    """Parses, validates and creates the courses in an import file. Returns the report, ordered by row."""
+    specs, errors = resolve_rows(db, parse_rows(data, file_format), default_owner_id)
+    if dry_run:
+        created = [{"row": spec["row"], "status": "valid", "course_id": None, "materials_copied": 0, "materials_failed": []}
+                   for spec in specs]
+    else:
+        created = create_courses(db, specs, batch_size)
+    rows = sorted(errors + created, key=lambda entry: entry["row"])
+    return {
+        "dry_run": dry_run,
+        "created": sum(entry["status"] == "created" for entry in rows),
+        "failed": sum(entry["status"] == "error" for entry in rows),
+        "rows": rows,
+    }
+
+
+def clone_course(db: Session, source: models.Course, owner_id: int, title: str | None = None,
+                 include_materials: bool = True, term_id: int | None = None) -> dict:
+    """
+    Copies `source` (and, unless told otherwise, its materials) into `term_id`,
+    by default the source's term. Returns the report entry of the new course.
+    """
+    term_id = term_id if term_id is not None else source.term_id
+    terms.check_open(db, term_id)
+    spec = {
+        "row": 1,
+        "course": schemas.CourseCreate(
+            title=title or source.title, description=source.description, capacity=source.capacity, term_id=term_id,
+        ),
+        "owner_id": owner_id,
+        "clone_from": source.id if include_materials else None,
+    }
+    return create_courses(db, [spec])[0]
+
+
+def _create_chunk(db: Session, chunk: list[dict]) -> list[dict]:
+    copied_paths = []
+    try:
+        course_ids = db.scalars(
+            insert(models.Course).returning(models.Course.id, sort_by_parameter_order=True),
+            [{**spec["course"].model_dump(), "owner_id": spec["owner_id"]} for spec in chunk],
+        ).all()
+        materials = _clone_materials(db, chunk, course_ids, copied_paths)
+        db.execute(insert(models.CourseStats), [
+            {"course_id": course_id, "enrollment_count": 0, "material_count": len(materials[course_id]["rows"])}
+            for course_id in course_ids
+        ])
+        material_rows = [row for course_id in course_ids for row in materials[course_id]["rows"]]
+        if material_rows:
+            material_ids = db.scalars(
+                insert(models.CourseMaterial).returning(models.CourseMaterial.id, sort_by_parameter_order=True),
+                material_rows,
+            ).all()
+            sources = [source for course_id in course_ids for source in materials[course_id]["sources"]]
+            for material_id, source in zip(material_ids, sources):
+                # Same bytes: an ingested source's text is copied instead of extracted again
+                copy_from = source.id if source.ingest_status == "done" else None
+                jobs.enqueue(db, "ingest_material", {"material_id": material_id, "copy_from": copy_from},
+                             dedupe_key=f"ingest:{material_id}")
+        for spec, course_id in zip(chunk, course_ids):
+            events.publish_on_commit(db, "course.created", course_id, title=spec["course"].title,
+                                     capacity=spec["course"].capacity, cloned_from=spec["clone_from"])
+            audit.record_on_commit(db, "course.created", course_id, title=spec["course"].title, owner_id=spec["owner_id"],
+                                   cloned_from=spec["clone_from"], materials_copied=len(materials[course_id]["rows"]))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        if copied_paths:
+            jobs.enqueue(db, "delete_blobs", {"paths": copied_paths})
+            db.commit()
+        raise
+
+    return [
+        {
+            "row": spec["row"],
+            "status": "created",
+            "course_id": course_id,
+            "materials_copied": len(materials[course_id]["rows"]),
+            "materials_failed": materials[course_id]["failed"],
+        }
+        for spec, course_id in zip(chunk, course_ids)
+    ]
+
+
+def _clone_materials(db: Session, chunk: list[dict], course_ids: list[int], copied_paths: list[str]) -> dict:
+    """
+    Copies the materials of each spec's `clone_from` course to its new course.
+    Returns {new course id: {"rows": material rows to insert, "failed": source material ids not copied}}.
+    Materials whose file is missing are skipped rather than failing the course.
+    """
+    materials = {course_id: {"rows": [], "sources": [], "failed": []} for course_id in course_ids}
+    targets = {}
+    for spec, course_id in zip(chunk, course_ids):
+        if spec["clone_from"] is not None:
+            targets.setdefault(spec["clone_from"], []).append(course_id)
+    if not targets:
+        return materials
+
+    copies = []
+    for source in db.execute(
+        select(models.CourseMaterial.id, models.CourseMaterial.course_id, models.CourseMaterial.title,
+               models.CourseMaterial.file_path, models.CourseMaterial.content_type, models.CourseMaterial.size_bytes,
+               models.CourseMaterial.checksum, models.CourseMaterial.page_count, models.CourseMaterial.ingest_status)
+        .where(models.CourseMaterial.course_id.in_(targets), models.CourseMaterial.deleted_at.is_(None))
+        .order_by(models.CourseMaterial.id)
+    ):
+        extension = source.file_path.rsplit(".", 1)[-1] if "." in source.file_path.rsplit("/", 1)[-1] else "bin"
+        for course_id in targets[source.course_id]:
+            copies.append((course_id, source, f"courses/{course_id}/materials/{uuid.uuid4()}.{extension}"))
+    if not copies:
+        return materials
+
+    backend = storage.get_storage()
+    now = crud.utcnow()
+
+    def copy(item):
+        _, source, path = item
+        try:
+            backend.copy(source.file_path, path)
+            return True
+        except Exception as e:
+            print(f"Course import: could not copy {source.file_path} to {path}: {e!r}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=min(MATERIAL_COPY_CONCURRENCY, len(copies))) as pool:
+        results = list(pool.map(copy, copies))
+    for (course_id, source, path), copied in zip(copies, results):
+        if not copied:
+            materials[course_id]["failed"].append(source.id)
+            continue
+        copied_paths.append(path)
+        materials[course_id]["rows"].append({
+            "course_id": course_id, "title": source.title, "file_path": path, "content_type": source.content_type,
+            "updated_at": now, "size_bytes": source.size_bytes, "checksum": source.checksum,
+            "page_count": source.page_count, "ingest_status": "pending",
+        })
+        materials[course_id]["sources"].append(source)
+    return materials
+
+
+def _int(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _error(row: int, message: str) -> dict:
+    return {"row": row, "status": "error", "course_id": None, "materials_copied": 0, "materials_failed": [], "error": message}
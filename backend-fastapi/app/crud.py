@@ -1,6 +1,13 @@
+import base64
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, exists, func, insert, or_, select, true, union_all, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, joinedload
 from fastapi import HTTPException, status
-from . import models, schemas
+from . import audit, events, jobs, models, role_claims, schemas, terms
+from .database import dialect_insert
+from .role_claims import Principal
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
@@ -16,135 +23,501 @@ def get_user_by_firebase_uid(db: Session, firebase_uid: str):
     ).filter(models.User.firebase_uid == firebase_uid).first()
 
 def create_db_user(db: Session, firebase_uid: str, email: str):
-    db_user = models.User(email=email, firebase_uid=firebase_uid, role=models.UserRole.student)
-    db.add(db_user)
+    """
+    Inserts a student user in a single statement.
+    Returns the new row, or None if the email or Firebase UID is already registered.
+    """
+    users = models.User.__table__
+    stmt = (
+        dialect_insert(db, users)
+        .values(email=email, firebase_uid=firebase_uid, role=models.UserRole.student)
+        .on_conflict_do_nothing()
+        .returning(*users.c)
+    )
+    row = db.execute(stmt).mappings().first()
     db.commit()
-    db.refresh(db_user)
-    return db_user
+    return dict(row) if row else None
+
+def upsert_users(db: Session, accounts: list[tuple[str, str]]) -> dict:
+    """
+    Batch-upserts (firebase_uid, email) pairs as students; existing users keep their role
+    but pick up email changes. Accounts whose email already belongs to a different
+    Firebase UID are skipped. Does not commit.
+    """
+    by_uid = {uid: email for uid, email in accounts if uid and email}
+    if not by_uid:
+        return {"upserted": 0, "skipped": 0}
+
+    taken = dict(db.execute(
+        select(models.User.email, models.User.firebase_uid).where(models.User.email.in_(by_uid.values()))
+    ).all())
+    rows, seen_emails = [], set()
+    for uid, email in by_uid.items():
+        if taken.get(email, uid) != uid or email in seen_emails:
+            continue
+        seen_emails.add(email)
+        rows.append({"firebase_uid": uid, "email": email, "role": models.UserRole.student})
+
+    if rows:
+        users = models.User.__table__
+        stmt = dialect_insert(db, users).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[users.c.firebase_uid],
+            set_={"email": stmt.excluded.email},
+            where=users.c.email != stmt.excluded.email,
+        )
+        db.execute(stmt)
+    return {"upserted": len(rows), "skipped": len(accounts) - len(rows)}
 
 
 def get_course(db: Session, course_id: int):
     return db.query(models.Course).filter(models.Course.id == course_id).first()
 
-def get_courses(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Course).offset(skip).limit(limit).all()
+def get_courses(db: Session, skip: int = 0, limit: int = 100, term_id: int | None = None):
+    """The courses of one term, or by default those of open terms and courses without a term."""
+    return db.query(models.Course).filter(terms.listed(term_id)).offset(skip).limit(limit).all()
 
-def create_course(db: Session, course: schemas.CourseCreate, owner_id: int):
-    db_course = models.Course(**course.model_dump(), owner_id=owner_id)
-    db.add(db_course)
+def create_course(db: Session, course: schemas.CourseCreate, owner_id: int) -> dict:
+    """Inserts the course and its stats row. Returns the new course (with stats) without reading it back."""
+    terms.check_open(db, course.term_id)
+    row = db.execute(
+        insert(models.Course).values(**course.model_dump(), owner_id=owner_id).returning(*models.Course.__table__.c)
+    ).first()
+    db.execute(insert(models.CourseStats).values(course_id=row.id, enrollment_count=0, material_count=0))
+    events.publish_on_commit(db, "course.created", row.id, title=row.title, capacity=row.capacity)
+    audit.record_on_commit(db, "course.created", row.id, title=row.title, owner_id=owner_id)
     db.commit()
-    db.refresh(db_course)
-    return db_course
+    return _course_dict(row._mapping, 0, 0)
 
-def update_course(db: Session, course_id: int, course_update: schemas.CourseCreate):
-    db_course = get_course(db, course_id)
-    if not db_course:
-        return None
-    for key, value in course_update.model_dump(exclude_unset=True).items():
-        setattr(db_course, key, value)
-    db.add(db_course)
+def update_course(db: Session, course_id: int, course_update: schemas.CourseCreate, actor: Principal | None = None) -> dict:
+    """
+    A single UPDATE ... RETURNING, restricted to courses `actor` may modify (the
+    owner or an admin; None skips the check). Raises 404/403 if nothing matched.
+    Moving a course to another term moves its enrollments along; courses of
+    closed or archived terms can't be moved.
+    """
+    changes = course_update.model_dump(exclude_unset=True)
+    if "term_id" in changes:
+        terms.check_open(db, db.scalar(select(models.Course.term_id).where(models.Course.id == course_id)))
+        terms.check_open(db, changes["term_id"])
+    row = db.execute(
+        update(models.Course)
+        .where(models.Course.id == course_id, _may_modify_course(actor))
+        .values(**(changes or {"title": models.Course.title}))
+        .returning(*_course_with_stats_columns())
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        _raise_course_access_error(db, course_id, "update")
+    if "term_id" in changes:
+        enrollments = models.enrollment_table
+        db.execute(
+            update(enrollments)
+            .where(enrollments.c.course_id == course_id)
+            .values(term_id=terms.partition_key(changes["term_id"]))
+        )
+    events.publish_on_commit(db, "course.updated", course_id, changes=changes)
+    audit.record_on_commit(db, "course.updated", course_id, changes=changes)
     db.commit()
-    db.refresh(db_course)
-    return db_course
+    return _course_dict(row._mapping)
 
-def delete_course(db: Session, course_id: int):
-    db_course = get_course(db, course_id)
-    if not db_course:
-        return None
-    db.delete(db_course)
+def delete_course(db: Session, course_id: int, actor: Principal | None = None) -> dict:
+    """
+    Deletes the course and its materials, enrollments and stats with one DELETE ...
+    RETURNING each, all restricted to courses `actor` may modify. Returns the deleted course.
+    """
+    allowed = exists().where(models.Course.id == course_id, _may_modify_course(actor))
+    db.execute(delete(models.MaterialText).where(models.MaterialText.course_id == course_id, allowed))
+    # The material files are removed by a background job once this commits
+    file_paths = db.scalars(
+        delete(models.CourseMaterial)
+        .where(models.CourseMaterial.course_id == course_id, allowed)
+        .returning(models.CourseMaterial.file_path)
+        .execution_options(synchronize_session=False)
+    ).all()
+    for enrollments in (models.enrollment_table, models.enrollment_archive_table):
+        db.execute(delete(enrollments).where(enrollments.c.course_id == course_id, allowed))
+    stats = db.execute(
+        delete(models.CourseStats)
+        .where(models.CourseStats.course_id == course_id, allowed)
+        .returning(models.CourseStats.enrollment_count, models.CourseStats.material_count)
+        .execution_options(synchronize_session=False)
+    ).first()
+    row = db.execute(
+        delete(models.Course)
+        .where(models.Course.id == course_id, _may_modify_course(actor))
+        .returning(*models.Course.__table__.c)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        db.rollback()
+        _raise_course_access_error(db, course_id, "delete")
+    if file_paths:
+        jobs.enqueue(db, "delete_blobs", {"paths": file_paths})
+    events.publish_on_commit(db, "course.deleted", course_id)
+    audit.record_on_commit(db, "course.deleted", course_id, title=row.title, owner_id=row.owner_id, materials=len(file_paths))
     db.commit()
-    return db_course
+    return _course_dict(row._mapping, *(stats or (None, None)))
 
 def create_enrollment(db: Session, course_id: int, user_id: int):
-    course = get_course(db, course_id)
-    if not course:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
-    
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-
-    if course.capacity is not None:
-        enrolled_count = db.query(models.enrollment_table).filter_by(course_id=course.id).count()
-        
-        if enrolled_count >= course.capacity:
+    """
+    Takes a seat with a conditional UPDATE of the course's counter (the row lock
+    it takes serializes concurrent enrollments, so the last seat can't be taken
+    twice), then inserts the enrollment. The usual case is two statements and a commit.
+    Only courses of open terms (or without a term) take enrollments.
+    """
+    for _ in range(2):
+        capacity = select(models.Course.capacity).where(models.Course.id == course_id).scalar_subquery()
+        term_id = select(models.Course.term_id).where(models.Course.id == course_id).scalar_subquery()
+        seat = db.execute(
+            update(models.CourseStats)
+            .where(
+                models.CourseStats.course_id == course_id,
+                or_(capacity.is_(None), models.CourseStats.enrollment_count < capacity),
+                terms.enrollable(course_id),
+            )
+            .values(enrollment_count=models.CourseStats.enrollment_count + 1)
+            .returning(models.CourseStats.enrollment_count, capacity, term_id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if seat is not None:
+            break
+        course = db.execute(
+            select(models.Course.id, models.CourseStats.course_id, terms.enrollable(course_id))
+            .outerjoin(models.CourseStats, models.CourseStats.course_id == models.Course.id)
+            .where(models.Course.id == course_id)
+        ).first()
+        if course is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
+        if not course[2]:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Enrollment in this course's term is closed")
+        if course[1] is not None:
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT, # 409 Conflict is a good status code for this
                 detail="Course capacity has been reached. Cannot enroll."
             )
+        # Courses created before the stats table existed: seed their row, then try again
+        _bump_course_stats(db, course_id)
+        db.flush()
+    else:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Course capacity has been reached. Cannot enroll.")
 
-    if course in user.enrolled_courses:
+    enrollments = models.enrollment_table
+    try:
+        enrolled = db.execute(
+            dialect_insert(db, enrollments)
+            .values(user_id=user_id, course_id=course_id, term_id=terms.partition_key(seat[2]))
+            .on_conflict_do_nothing()
+            .returning(enrollments.c.course_id)
+        ).first()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    if enrolled is None:
+        # Gives the seat back
+        db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already enrolled in this course")
 
-    # If all checks pass, enroll the user
-    user.enrolled_courses.append(course)
+    enrollment_count, course_capacity, _ = seat
+    events.publish_on_commit(db, "enrollment.created", course_id, enrollment_count=enrollment_count, capacity=course_capacity)
+    audit.record_on_commit(db, "enrollment.created", course_id, user_id=user_id)
     db.commit()
     
     return {"message": "Successfully enrolled in course"}
 
-def assign_instructor_to_course(db: Session, course_id: int, instructor_id: int):
-    db_course = get_course(db, course_id)
-    if not db_course:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
-
-    db_instructor = db.query(models.User).filter(models.User.id == instructor_id).first()
-    if not db_instructor:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Instructor user not found")
-    
-    if db_instructor.role not in [models.UserRole.instructor, models.UserRole.admin]:
+def assign_instructor_to_course(db: Session, course_id: int, instructor_id: int) -> dict:
+    """A single UPDATE ... RETURNING that only matches if the new owner is an instructor or admin."""
+    eligible = exists().where(
+        models.User.id == instructor_id,
+        models.User.role.in_([models.UserRole.instructor, models.UserRole.admin]),
+    )
+    row = db.execute(
+        update(models.Course)
+        .where(models.Course.id == course_id, eligible)
+        .values(owner_id=instructor_id)
+        .returning(*_course_with_stats_columns())
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        # Only the failure path pays for finding out why
+        if db.scalar(select(models.Course.id).where(models.Course.id == course_id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
+        if db.scalar(select(models.User.id).where(models.User.id == instructor_id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Instructor user not found")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User is not an instructor or admin")
 
-    db_course.owner_id = instructor_id
-    db.add(db_course)
+    events.publish_on_commit(db, "course.instructor_changed", course_id, owner_id=instructor_id)
+    audit.record_on_commit(db, "course.instructor_changed", course_id, owner_id=instructor_id)
     db.commit()
-    db.refresh(db_course)
-    return db_course
+    return _course_dict(row._mapping)
 
 def get_students_for_course(db: Session, course_id: int):
+    """The course's students, from enrollments_archive if its term is archived."""
     db_course = get_course(db, course_id)
     if not db_course:
         return None
-    return db_course.enrolled_students
+    enrollments = terms.enrollments_for(db_course)
+    return db.scalars(
+        select(models.User)
+        .join(enrollments, enrollments.c.user_id == models.User.id)
+        .where(enrollments.c.term_id == terms.partition_key(db_course.term_id), enrollments.c.course_id == course_id)
+        .order_by(models.User.id)
+    ).all()
 
-def create_course_material(db: Session, course_id: int, title: str, file_path: str, content_type: str) -> models.CourseMaterial:
+def create_course_material(db: Session, course_id: int, title: str, file_path: str, content_type: str) -> dict:
     """
     Creates a new record for a course material in the database.
     """
-    db_material = models.CourseMaterial(
-        course_id=course_id,
-        title=title,
-        file_path=file_path,
-        content_type=content_type
-    )
-    db.add(db_material)
+    row = db.execute(
+        insert(models.CourseMaterial)
+        .values(course_id=course_id, title=title, file_path=file_path, content_type=content_type, updated_at=utcnow(),
+                ingest_status="pending")
+        .returning(*models.CourseMaterial.__table__.c)
+    ).first()
+    _, material_count = _bump_course_stats(db, course_id, materials=1)
+    # Size, checksum, page count and searchable text are extracted in the background (app/ingestion.py)
+    jobs.enqueue(db, "ingest_material", {"material_id": row.id}, dedupe_key=f"ingest:{row.id}")
+    events.publish_on_commit(db, "material.created", course_id, material_id=row.id, material_count=material_count)
+    audit.record_on_commit(db, "material.created", course_id, material_id=row.id, title=title, content_type=content_type)
     db.commit()
-    db.refresh(db_material)
-    return db_material
+    return dict(row._mapping)
 
 def get_materials_for_course(db: Session, course_id: int) -> list[models.CourseMaterial]:
     """
     Retrieves all material records associated with a specific course.
     """
-    return db.query(models.CourseMaterial).filter(models.CourseMaterial.course_id == course_id).all()
+    return db.query(models.CourseMaterial).filter(
+        models.CourseMaterial.course_id == course_id, models.CourseMaterial.deleted_at.is_(None)
+    ).all()
 
 def get_material(db: Session, material_id: int) -> models.CourseMaterial | None:
     """
     Retrieves a single course material by its ID.
     """
-    return db.query(models.CourseMaterial).filter(models.CourseMaterial.id == material_id).first()
+    return db.query(models.CourseMaterial).filter(
+        models.CourseMaterial.id == material_id, models.CourseMaterial.deleted_at.is_(None)
+    ).first()
 
-def delete_material(db: Session, material_id: int) -> models.CourseMaterial | None:
+def delete_material(db: Session, material_id: int) -> dict | None:
     """
-    Deletes a course material record from the database.
+    Deletes a course material: its file is removed, and the row stays as a
+    tombstone (deleted_at set) for clients syncing material changes.
     """
-    db_material = get_material(db, material_id)
-    if db_material:
-        db.delete(db_material)
-        db.commit()
-    return db_material
+    now = utcnow()
+    row = db.execute(
+        update(models.CourseMaterial)
+        .where(models.CourseMaterial.id == material_id, models.CourseMaterial.deleted_at.is_(None))
+        .values(deleted_at=now, updated_at=now)
+        .returning(*models.CourseMaterial.__table__.c)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None
+    _, material_count = _bump_course_stats(db, row.course_id, materials=-1)
+    db.execute(delete(models.MaterialText).where(models.MaterialText.material_id == material_id))
+    jobs.enqueue(db, "delete_blobs", {"paths": [row.file_path]})
+    events.publish_on_commit(db, "material.deleted", row.course_id, material_id=material_id, material_count=material_count)
+    audit.record_on_commit(db, "material.deleted", row.course_id, material_id=material_id, title=row.title)
+    db.commit()
+    return dict(row._mapping)
 
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     """
     Retrieves a list of all users from the database.
     """
-    return db.query(models.User).offset(skip).limit(limit).all()
\ No newline at end of file
+    return db.query(models.User).offset(skip).limit(limit).all()
+
+def search_users(db: Session, role: models.UserRole | None = None, email_prefix: str | None = None,
+                 cursor: str | None = None, limit: int = 50):
+    """
+    One page of the user directory in email order: (rows of id, email and role,
+    cursor of the next page or None). The prefix is matched case-insensitively.
+    Pages are keyed on the (unique) email, so a role filter is served by
+    ix_users_role_email and a prefix by the trigram index on Postgres.
+    """
+    users = models.User
+    query = select(users.id, users.email, users.role)
+    if role is not None:
+        query = query.where(users.role == role)
+    if email_prefix:
+        query = query.where(users.email.istartswith(email_prefix, autoescape=True))
+    if cursor:
+        query = query.where(users.email > _decode_user_cursor(cursor))
+    rows = db.execute(query.order_by(users.email).limit(limit + 1)).all()
+    next_cursor = _encode_user_cursor(rows[limit - 1].email) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def _encode_user_cursor(email: str) -> str:
+    return base64.urlsafe_b64encode(email.encode()).rstrip(b"=").decode()
+
+def _decode_user_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def update_user_role(db: Session, user_id: int, role: models.UserRole):
+    """
+    Changes a user's role and bumps their role_version, which invalidates the
+    role claims in their current ID tokens. Returns None if the user doesn't exist.
+    """
+    row = db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.role != role)
+        .values(role=role, role_version=models.User.role_version + 1, role_changed_at=func.now())
+        .returning(models.User.id, models.User.firebase_uid, models.User.role_version)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is not None:
+        role_claims.on_role_changed(db, *row)
+        audit.record_on_commit(db, "user.role_changed", user_id=user_id, role=role.value)
+    db.commit()
+    return db.get(models.User, user_id, populate_existing=True)
+
+def sync_role_claims(db: Session, batch_size: int = 1000) -> int:
+    """Queues a claims sync for every user, e.g. after enabling claims on an existing database."""
+    user_ids = list(db.scalars(select(models.User.id).order_by(models.User.id)))
+    for i in range(0, len(user_ids), batch_size):
+        for user_id in user_ids[i:i + batch_size]:
+            role_claims.sync_later(db, user_id)
+        db.commit()
+    return len(user_ids)
+
+def utcnow() -> datetime:
+    """Timestamps written by the application (rather than the database's now()) have microseconds on every backend."""
+    return datetime.now(timezone.utc)
+
+def _may_modify_course(actor: Principal | None):
+    """WHERE clause for courses `actor` may change: all for admins (and internal callers), else their own."""
+    if actor is None or actor.role == models.UserRole.admin:
+        return true()
+    return models.Course.owner_id == actor.id
+
+def _raise_course_access_error(db: Session, course_id: int, action: str):
+    """Called after a guarded write matched nothing, to tell a missing course from a forbidden one."""
+    if db.scalar(select(models.Course.id).where(models.Course.id == course_id)) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Not authorized to {action} this course")
+
+def _course_with_stats_columns() -> tuple:
+    """The course's columns plus its counters, for RETURNING (correlated subqueries work there on Postgres and SQLite)."""
+    stats = models.CourseStats
+    return (
+        *models.Course.__table__.c,
+        select(stats.enrollment_count).where(stats.course_id == models.Course.id).correlate(models.Course).scalar_subquery().label("enrollment_count"),
+        select(stats.material_count).where(stats.course_id == models.Course.id).correlate(models.Course).scalar_subquery().label("material_count"),
+    )
+
+def _course_dict(row, enrollment_count: int | None = None, material_count: int | None = None) -> dict:
+    """Shapes a RETURNING row like schemas.Course."""
+    course = {column.name: row[column.name] for column in models.Course.__table__.c}
+    if "enrollment_count" in row:
+        enrollment_count, material_count = row["enrollment_count"], row["material_count"]
+    stats = None
+    if enrollment_count is not None:
+        stats = {
+            "enrollment_count": enrollment_count,
+            "material_count": material_count,
+            "fill_ratio": models.fill_ratio(enrollment_count, course["capacity"]),
+        }
+    return {**course, "stats": stats}
+
+def _bump_course_stats(db: Session, course_id: int, enrollments: int = 0, materials: int = 0) -> tuple[int, int]:
+    """
+    Applies a relative change to a course's counters inside the caller's transaction
+    and returns the new (enrollment_count, material_count).
+    Courses created before the stats table existed get their row seeded from the source tables.
+    """
+    row = db.execute(
+        update(models.CourseStats)
+        .where(models.CourseStats.course_id == course_id)
+        .values(
+            enrollment_count=models.CourseStats.enrollment_count + enrollments,
+            material_count=models.CourseStats.material_count + materials,
+        )
+        .returning(models.CourseStats.enrollment_count, models.CourseStats.material_count)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is not None:
+        return tuple(row)
+    db.flush()
+    enrollment_count, material_count = _count_course_rows(db, course_id)
+    db.add(models.CourseStats(course_id=course_id, enrollment_count=enrollment_count, material_count=material_count))
+    return enrollment_count, material_count
+
+def _enrollment_counts(course_id: int | None = None):
+    """
+    (course_id, n) per course, counting enrollments in both `enrollments` and
+    `enrollments_archive`: a course's enrollment_count keeps its archived
+    students, so rosters and stats agree after its term is archived. This
+    doesn't hold capacity back, since archived terms take no enrollments
+    (and their courses can't move to an open term).
+    """
+    parts = [select(table.c.course_id) for table in (models.enrollment_table, models.enrollment_archive_table)]
+    if course_id is not None:
+        parts = [part.where(part.selected_columns.course_id == course_id) for part in parts]
+    enrollments = union_all(*parts).subquery()
+    return (
+        select(enrollments.c.course_id, func.count().label("n"))
+        .group_by(enrollments.c.course_id)
+        .subquery()
+    )
+
+def _count_course_rows(db: Session, course_id: int) -> tuple[int, int]:
+    enrollment_count = db.scalar(select(_enrollment_counts(course_id).c.n)) or 0
+    material_count = db.query(models.CourseMaterial).filter(
+        models.CourseMaterial.course_id == course_id, models.CourseMaterial.deleted_at.is_(None)
+    ).count()
+    return enrollment_count, material_count
+
+def rebuild_course_stats(db: Session, fix: bool = True) -> list[dict]:
+    """
+    Recomputes every course's counters from `enrollments` (and `enrollments_archive`)
+    and `course_materials` and compares them with the stored summary rows.
+    Returns one entry per drifted course; with fix=True the rows are corrected and committed.
+    """
+    enrollment_counts = _enrollment_counts()
+    material_counts = (
+        select(models.CourseMaterial.course_id, func.count().label("n"))
+        .where(models.CourseMaterial.deleted_at.is_(None))
+        .group_by(models.CourseMaterial.course_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(
+            models.Course.id,
+            func.coalesce(enrollment_counts.c.n, 0),
+            func.coalesce(material_counts.c.n, 0),
+            models.CourseStats.enrollment_count,
+            models.CourseStats.material_count,
+        )
+        .outerjoin(enrollment_counts, enrollment_counts.c.course_id == models.Course.id)
+        .outerjoin(material_counts, material_counts.c.course_id == models.Course.id)
+        .outerjoin(models.CourseStats, models.CourseStats.course_id == models.Course.id)
+        .order_by(models.Course.id)
+    ).all()
+
+    drift = []
+    for course_id, enrollment_count, material_count, stored_enrollments, stored_materials in rows:
+        if (stored_enrollments, stored_materials) == (enrollment_count, material_count):
+            continue
+        drift.append({
+            "course_id": course_id,
+            "missing": stored_enrollments is None,
+            "enrollment_count": (stored_enrollments, enrollment_count),
+            "material_count": (stored_materials, material_count),
+        })
+        if not fix:
+            continue
+        if stored_enrollments is None:
+            db.add(models.CourseStats(course_id=course_id, enrollment_count=enrollment_count, material_count=material_count))
+        else:
+            db.execute(
+                update(models.CourseStats)
+                .where(models.CourseStats.course_id == course_id)
+                .values(enrollment_count=enrollment_count, material_count=material_count)
+                .execution_options(synchronize_session=False)
+            )
+    if fix and drift:
+        db.commit()
+    return drift
\ No newline at end of file
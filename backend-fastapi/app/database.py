@@ -1,10 +1,17 @@
 
 import os
-from sqlalchemy import create_engine
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from . import metrics, request_context
+
 # Load environment variables from .env file for local development
 load_dotenv()
 
@@ -22,13 +29,174 @@ else:
     SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=metrics.InstrumentedQueuePool)
+
+
+def _new_pool_after_fork():
+    # A forked worker (gunicorn --preload) must not use the parent's pooled connections.
+    # close=False: the parent still owns them, closing would end its sessions.
+    engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_new_pool_after_fork)
+
+# Statements slower than this are recorded in the slow query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+# On Postgres, also record the plan (EXPLAIN without ANALYZE) of each slow statement shape
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() in ("1", "true", "yes")
+MAX_EXPLAINED_SHAPES = 500
+_EXPLAINABLE = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+_IN_LIST = re.compile(r"\(\s*(?:%\(\w+\)s|\?|:\w+|%s)(?:\s*,\s*(?:%\(\w+\)s|\?|:\w+|%s))+\s*\)")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class SlowQueryLog:
+    """A ring buffer of recent slow statements plus the plans captured for each statement shape."""
+
+    def __init__(self, size: int):
+        self._entries = deque(maxlen=size)
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, entry: dict):
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+
+    def has_plan(self, statement: str) -> bool:
+        return statement in self._plans
+
+    def add_plan(self, statement: str, plan: str):
+        with self._lock:
+            self._plans[statement] = plan
+            while len(self._plans) > MAX_EXPLAINED_SHAPES:
+                self._plans.popitem(last=False)
+
+    def entries(self, limit: int | None = None) -> list[dict]:
+        with self._lock:
+            entries = list(self._entries)
+            plans = dict(self._plans)
+        entries.reverse()
+        return [{**entry, "plan": plans.get(entry["statement"])} for entry in entries[:limit]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._plans.clear()
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_LOG_SIZE)
+
+
+def normalize_sql(statement: str) -> str:
+    """Collapses literals, IN lists and whitespace so that statements differing only in values group together."""
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _IN_LIST.sub("(?, ...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def _parameters_shape(parameters, executemany: bool):
+    """Parameter names and types, never their values (they may contain emails, tokens...)."""
+    if executemany:
+        parameters = list(parameters)
+        return {"rows": len(parameters), "each": _parameters_shape(parameters[0], False) if parameters else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return None
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _record_slow_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+    if elapsed_ms < SLOW_QUERY_MS:
+        return
+    normalized = normalize_sql(statement)
+    slow_query_log.record({
+        "at": time.time(),
+        "duration_ms": round(elapsed_ms, 2),
+        "statement": normalized,
+        "parameters": _parameters_shape(parameters, executemany),
+        "rowcount": cursor.rowcount,
+        "route": request_context.current_route(),
+    })
+    if SLOW_QUERY_EXPLAIN and not executemany and conn.dialect.name == "postgresql" and not slow_query_log.has_plan(normalized):
+        _capture_plan(conn, statement, parameters, normalized)
+
+
+def _capture_plan(conn, statement, parameters, normalized):
+    # A separate DBAPI cursor on the same connection (and transaction), so the
+    # plan sees the same data, and the EXPLAIN doesn't go through these hooks again.
+    # The savepoint keeps a failing EXPLAIN from aborting the caller's transaction.
+    if normalized.split(" ", 1)[0].upper() not in _EXPLAINABLE:
+        return
+    with conn.connection.dbapi_connection.cursor() as cursor:
+        try:
+            cursor.execute("SAVEPOINT slow_query_explain")
+            cursor.execute("EXPLAIN (ANALYZE off) " + statement, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+            try:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            except Exception:
+                pass
+    slow_query_log.add_plan(normalized, plan)
+
+
+@event.listens_for(engine, "handle_error")
+def _discard_query_timer(exception_context):
+    # after_cursor_execute isn't called for a failed statement
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+def after_commit(db, callback):
+    """
+    Runs `callback()` once the session's current transaction commits.
+    Dropped if the transaction rolls back instead.
+    """
+    db.info.setdefault("after_commit", []).append(callback)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _run_after_commit(session):
+    for callback in session.info.pop("after_commit", []):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error in after-commit callback: {e}")
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _discard_after_commit(session, transaction):
+    # Runs after after_commit, so anything left belongs to a rolled back transaction
+    if transaction.parent is None:
+        session.info.pop("after_commit", None)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def dialect_insert(db, table):
+    """A dialect-specific INSERT, so callers can use ON CONFLICT on both Postgres and SQLite."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
\ No newline at end of file
@@ -0,0 +1,337 @@
+# app/events.py
+"""
+Push notifications for course changes.
+
+crud functions call `publish_on_commit` with a small delta event; once the
+transaction commits, the event goes to the configured broker, which delivers it
+to the hub of every instance. The hub fans it out to the WebSocket clients
+subscribed to that course (or to "*", the whole catalog).
+
+Each client has a bounded queue. If a client falls behind, its queue is
+replaced with a single "resync" event telling it to refetch, and a client that
+keeps overflowing is disconnected, so a slow consumer never holds up the others.
+
+System events (course_id None, e.g. role changes) aren't sent to WebSocket
+clients; they go to the listeners registered with `add_listener`.
+
+Brokers (EVENTS_BROKER):
+- "inprocess" (default): delivers within this process only.
+- "unix": Unix datagram sockets in EVENTS_SOCKET_DIR, for the worker processes
+  of one multi-process server (see gunicorn.conf.py, which selects it).
+- "postgres": LISTEN/NOTIFY on the application database, for multiple instances.
+"""
+import asyncio
+import glob
+import json
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable
+
+from .database import SQLALCHEMY_DATABASE_URL, after_commit
+
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "inprocess")
+EVENTS_SOCKET_DIR = os.getenv("EVENTS_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "lms-events"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+MAX_OVERFLOWS = 3
+ALL_COURSES = "*"
+
+
+class Broker(ABC):
+    """Carries events between instances. `deliver` may be called from any thread."""
+
+    @abstractmethod
+    def start(self, deliver: Callable[[dict], None]):
+        """Starts receiving; every event published by any instance is passed to `deliver`."""
+
+    @abstractmethod
+    def publish(self, event: dict):
+        """Sends the event to every instance, this one included."""
+
+    def stop(self):
+        pass
+
+
+class InProcessBroker(Broker):
+    def __init__(self):
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, event):
+        if self._deliver is not None:
+            self._deliver(event)
+
+
+class PostgresBroker(Broker):
+    """Publishes with NOTIFY and receives on a dedicated LISTEN connection."""
+
+    def __init__(self, dsn: str, channel: str = "lms_events"):
+        self.dsn = dsn.replace("postgresql+psycopg2://", "postgresql://")
+        self.channel = channel
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, deliver):
+        self._thread = threading.Thread(target=self._listen, args=(deliver,), name="events-listener", daemon=True)
+        self._thread.start()
+
+    def publish(self, event):
+        import psycopg2
+        payload = json.dumps(event, separators=(",", ":"))
+        with self._publish_lock:
+            try:
+                if self._publish_conn is None or self._publish_conn.closed:
+                    self._publish_conn = psycopg2.connect(self.dsn)
+                    self._publish_conn.autocommit = True
+                with self._publish_conn.cursor() as cur:
+                    cur.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+            except psycopg2.Error as e:
+                print(f"Failed to publish event: {e}")
+                self._publish_conn = None
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def _listen(self, deliver):
+        import psycopg2
+        while not self._stop_event.is_set():
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        deliver(json.loads(conn.notifies.pop(0).payload))
+            except psycopg2.Error as e:
+                print(f"Event listener connection lost, reconnecting: {e}")
+                self._stop_event.wait(2)
+
+
+class UnixSocketBroker(Broker):
+    """
+    Every process binds a datagram socket named after its pid in `directory`;
+    publishing sends the event to all of them (this process included, like
+    NOTIFY). Sockets of processes that exited are removed by the next publish.
+    """
+
+    MAX_EVENT_BYTES = 60 * 1024
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = None
+        self._receiver = None
+        self._sender = None
+        self._send_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, deliver):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self.path = os.path.join(self.directory, f"events-{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            # Left behind by an earlier process with the same pid
+            os.unlink(self.path)
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        self._receiver.settimeout(1.0)
+        self._thread = threading.Thread(target=self._receive, args=(self._receiver, deliver), name="events-listener", daemon=True)
+        self._thread.start()
+
+    def publish(self, event):
+        payload = json.dumps(event, separators=(",", ":")).encode()
+        if len(payload) > self.MAX_EVENT_BYTES:
+            print(f"Event {event.get('type')} is too large for the unix broker ({len(payload)} bytes); dropped.")
+            return
+        with self._send_lock:
+            if self._sender is None:
+                self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                # A receiver whose queue is full gets a moment to drain it
+                self._sender.settimeout(1.0)
+            for path in glob.glob(os.path.join(self.directory, "events-*.sock")):
+                try:
+                    self._sender.sendto(payload, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Nobody is bound to it anymore: its process has exited
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                except OSError as e:
+                    print(f"Failed to publish event to {path}: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        if self._receiver is not None:
+            self._receiver.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _receive(self, receiver: socket.socket, deliver):
+        while not self._stop_event.is_set():
+            try:
+                data = receiver.recv(self.MAX_EVENT_BYTES + 1)
+            except socket.timeout:
+                continue
+            try:
+                deliver(json.loads(data))
+            except ValueError as e:
+                print(f"Ignoring malformed event on {self.path}: {e}")
+
+
+class Subscriber:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.course_ids: set = set()
+        self.overflows = 0
+        self.disconnect = asyncio.Event()
+
+    def offer(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflows += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if self.overflows >= MAX_OVERFLOWS:
+                self.disconnect.set()
+            else:
+                self.queue.put_nowait({"type": "resync", "reason": "too many pending events"})
+
+    def delivered(self):
+        # A consumer that drains its queue is healthy again
+        if self.queue.empty():
+            self.overflows = 0
+
+
+class Hub:
+    """Per-process fan-out to subscribers. Only touched from the event loop thread."""
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._subscriptions: dict[object, set[Subscriber]] = {}
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def stop(self):
+        self._loop = None
+
+    def deliver(self, event: dict):
+        """Thread-safe entry point used by brokers."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._fan_out, event)
+
+    def subscribe(self, subscriber: Subscriber, course_ids):
+        for course_id in course_ids:
+            subscriber.course_ids.add(course_id)
+            self._subscriptions.setdefault(course_id, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber, course_ids=None):
+        for course_id in list(subscriber.course_ids if course_ids is None else course_ids):
+            subscriber.course_ids.discard(course_id)
+            subscribers = self._subscriptions.get(course_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscriptions[course_id]
+
+    def stats(self) -> dict:
+        subscribers = set().union(*self._subscriptions.values()) if self._subscriptions else set()
+        return {
+            "subscribers": len(subscribers),
+            "subscribed_courses": len(self._subscriptions),
+            "published": self.published,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+    def _fan_out(self, event: dict):
+        self.published += 1
+        for listener in _listeners.get(event.get("type"), []):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Error in event listener for {event.get('type')}: {e}")
+        if event.get("course_id") is None:
+            return
+        targets = self._subscriptions.get(event.get("course_id"), set()) | self._subscriptions.get(ALL_COURSES, set())
+        for subscriber in targets:
+            subscriber.offer(event)
+            if subscriber.disconnect.is_set():
+                self.dropped_subscribers += 1
+                self.unsubscribe(subscriber)
+
+
+hub = Hub()
+_broker: Broker | None = None
+_listeners: dict[str, list[Callable[[dict], None]]] = {}
+
+
+def get_broker() -> Broker:
+    global _broker
+    if _broker is None:
+        if EVENTS_BROKER == "inprocess":
+            _broker = InProcessBroker()
+        elif EVENTS_BROKER == "unix":
+            _broker = UnixSocketBroker(EVENTS_SOCKET_DIR)
+        elif EVENTS_BROKER == "postgres":
+            _broker = PostgresBroker(SQLALCHEMY_DATABASE_URL)
+        else:
+            raise ValueError(f"Unknown EVENTS_BROKER '{EVENTS_BROKER}'; expected 'inprocess', 'unix' or 'postgres'.")
+    return _broker
+
+
+def _forget_broker_after_fork():
+    # A broker started before the fork has its listener thread (and connection) in the parent only
+    global _broker
+    _broker = None
+
+
+os.register_at_fork(after_in_child=_forget_broker_after_fork)
+
+
+def start(loop: asyncio.AbstractEventLoop):
+    hub.start(loop)
+    get_broker().start(hub.deliver)
+
+
+def stop():
+    get_broker().stop()
+    hub.stop()
+
+
+def add_listener(event_type: str, listener: Callable[[dict], None]):
+    """Calls `listener(event)` on the event loop for every event of `event_type` from any instance."""
+    _listeners.setdefault(event_type, []).append(listener)
+
+
+def publish(event_type: str, course_id: int | None, **data):
+    get_broker().publish({"type": event_type, "course_id": course_id, "ts": time.time(), **data})
+
+
+def publish_on_commit(db, event_type: str, course_id: int, **data):
+    """Publishes the event once `db`'s transaction commits (and never if it rolls back)."""
+    after_commit(db, lambda: publish(event_type, course_id, **data))
+
+
+def publish_system_on_commit(db, event_type: str, **data):
+    """Like `publish_on_commit`, for events that concern no course and only reach listeners."""
+    publish_on_commit(db, event_type, None, **data)
@@ -0,0 +1,335 @@
+# app/extract.py
+"""
+Metadata and text extraction for course material files: size, SHA-256
+checksum, page count and plain text.
+
+Runs in the ingestion process pool (see app/ingestion.py), so it imports
+nothing from the app and uses only the standard library. Supported formats:
+
+- PDF: text drawn with Tj/TJ from (Flate-compressed) content streams, and the
+  number of /Type /Page objects. Text in hex strings (fonts with custom
+  encodings, most CJK) and scanned pages is not recovered.
+- Office Open XML: slides of .pptx, .docx, shared strings of .xlsx. Page
+  counts come from docProps/app.xml (slides for .pptx).
+- text/* (HTML without its tags).
+
+Other files only get a size and checksum. Extraction is best effort and
+bounded: at most EXTRACT_MAX_TEXT_CHARS characters are kept, and no more than
+EXTRACT_MAX_INFLATE_MB are decompressed per file, so a zip or stream bomb
+can't exhaust the worker's memory.
+"""
+import hashlib
+import html.parser
+import os
+import re
+import signal
+import zipfile
+import zlib
+from xml.etree import ElementTree
+
+EXTRACT_MAX_TEXT_CHARS = int(os.getenv("EXTRACT_MAX_TEXT_CHARS", "1000000"))
+EXTRACT_MAX_INFLATE_MB = int(os.getenv("EXTRACT_MAX_INFLATE_MB", "200"))
+CHUNK_SIZE = 1024 * 1024
+
+OOXML_TYPES = {
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": "pptx",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+}
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+class _Budget:
+    """Bytes that may still be decompressed for the current file."""
+
+    def __init__(self):
+        self.remaining = EXTRACT_MAX_INFLATE_MB * 1024 * 1024
+
+    def take(self, n: int) -> bool:
+        self.remaining -= n
+        return self.remaining >= 0
+
+
+def extract_file(path: str, content_type: str | None, timeout: float | None = None) -> dict:
+    """
+    Returns {"size_bytes", "checksum", "page_count", "text"} for the file at
+    `path`. Raises ExtractionTimeout after `timeout` seconds (only in a
+    process's main thread, which is where pool workers run their tasks).
+    """
+    if timeout:
+        previous = signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        size, checksum, head = _checksum(path)
+        kind = _kind(content_type, head)
+        page_count, text = None, ""
+        if kind == "pdf":
+            page_count, text = _pdf(path)
+        elif kind in ("pptx", "docx", "xlsx", "zip"):
+            page_count, text = _ooxml(path)
+        elif kind in ("text", "html"):
+            text = _text(path, kind == "html")
+        return {"size_bytes": size, "checksum": checksum, "page_count": page_count, "text": _clean(text)}
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+def _on_timeout(signum, frame):
+    raise ExtractionTimeout("Extraction took too long")
+
+
+def _checksum(path: str) -> tuple[int, str, bytes]:
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            if not head:
+                head = chunk[:8]
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest(), head
+
+
+def _kind(content_type: str | None, head: bytes) -> str | None:
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if head.startswith(b"%PDF") or content_type == "application/pdf":
+        return "pdf"
+    if content_type in OOXML_TYPES:
+        return OOXML_TYPES[content_type]
+    if head.startswith(b"PK\x03\x04"):
+        # Office files are often uploaded as application/octet-stream
+        return "zip"
+    if content_type in ("text/html", "application/xhtml+xml"):
+        return "html"
+    if content_type.startswith("text/") or content_type in ("application/json", "application/xml"):
+        return "text"
+    return None
+
+
+# --- PDF ---------------------------------------------------------------------
+
+_STREAM = re.compile(rb"<<(.{0,2048}?)>>\s*stream\r?\n", re.S)
+_PAGE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+# A literal string (one level of nested parentheses) or a TJ array, followed by its operator
+_TEXT_OP = re.compile(rb"\(((?:[^()\\]|\\.|\((?:[^()\\]|\\.)*\))*)\)\s*(?:Tj|'|\")|\[((?:[^\]\\]|\\.)*)\]\s*TJ", re.S)
+_ARRAY_STRING = re.compile(rb"\(((?:[^()\\]|\\.)*)\)|(-?\d+(?:\.\d+)?)")
+_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f", b"(": b"(", b")": b")", b"\\": b"\\"}
+
+
+def _pdf(path: str) -> tuple[int | None, str]:
+    with open(path, "rb") as f:
+        data = f.read()
+    budget = _Budget()
+    pages = len(_PAGE.findall(data))
+    parts = []
+    length = 0
+    for match in _STREAM.finditer(data):
+        start = match.end()
+        end = data.find(b"endstream", start)
+        if end < 0:
+            break
+        dictionary, raw = match.group(1), data[start:end]
+        if b"/Filter" in dictionary:
+            if b"/FlateDecode" not in dictionary:
+                # Images (DCT, JPX, CCITT) and rarely used text encodings
+                continue
+            raw = _inflate(raw, budget)
+            if raw is None:
+                continue
+        if b"/Type/ObjStm" in dictionary.replace(b" ", b""):
+            # Compressed object streams hold the page objects of PDF 1.5+ files
+            pages += len(_PAGE.findall(raw))
+            continue
+        if b"/Subtype" in dictionary or b"/Length1" in dictionary:
+            # Images, fonts, and other non-content streams
+            continue
+        text = _pdf_text(raw)
+        if text:
+            parts.append(text)
+            length += len(text)
+            if length >= EXTRACT_MAX_TEXT_CHARS:
+                break
+    return pages or None, "\n".join(parts)
+
+
+def _inflate(raw: bytes, budget: _Budget) -> bytes | None:
+    decompressor = zlib.decompressobj()
+    try:
+        out = decompressor.decompress(raw, max(budget.remaining, 0) + 1)
+    except zlib.error:
+        return None
+    return out if budget.take(len(out)) else None
+
+
+def _pdf_text(content: bytes) -> str:
+    if b"BT" not in content:
+        return ""
+    words = []
+    for match in _TEXT_OP.finditer(content):
+        if match.group(1) is not None:
+            words.append(_pdf_string(match.group(1)))
+            continue
+        # TJ: strings with kerning adjustments; a large negative gap is a word space
+        piece = []
+        for string, adjustment in _ARRAY_STRING.findall(match.group(2)):
+            if adjustment:
+                if float(adjustment) < -200:
+                    piece.append(" ")
+            else:
+                piece.append(_pdf_string(string))
+        words.append("".join(piece))
+    return " ".join(word for word in words if word.strip())
+
+
+def _pdf_string(raw: bytes) -> str:
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        byte = raw[i:i + 1]
+        if byte != b"\\":
+            out += byte
+            i += 1
+            continue
+        following = raw[i + 1:i + 2]
+        if following in _ESCAPES:
+            out += _ESCAPES[following]
+            i += 2
+        elif following.isdigit():
+            octal = re.match(rb"[0-7]{1,3}", raw[i + 1:i + 4]).group()
+            out.append(int(octal, 8) & 0xFF)
+            i += 1 + len(octal)
+        else:
+            # A line continuation or an unknown escape
+            i += 2
+    if out.startswith(b"\xfe\xff"):
+        return out[2:].decode("utf-16-be", errors="replace")
+    return out.decode("latin-1")
+
+
+# --- Office Open XML ---------------------------------------------------------
+
+_SLIDE = re.compile(r"ppt/slides/slide(\d+)\.xml$")
+
+
+def _ooxml(path: str) -> tuple[int | None, str]:
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        return None, ""
+    with archive:
+        names = archive.namelist()
+        budget = _Budget()
+        slides = sorted((int(m.group(1)), name) for name in names if (m := _SLIDE.match(name)))
+        if slides:
+            parts = [_xml_text(archive, name, "t", budget) for _, name in slides]
+            return len(slides), "\n".join(parts)
+        page_count = _app_property(archive, names, "Pages", budget)
+        if "word/document.xml" in names:
+            return page_count, _xml_text(archive, "word/document.xml", "t", budget, paragraph="p")
+        if "xl/sharedStrings.xml" in names:
+            return None, _xml_text(archive, "xl/sharedStrings.xml", "t", budget, paragraph="si")
+    return None, ""
+
+
+def _xml_text(archive: zipfile.ZipFile, name: str, tag: str, budget: _Budget, paragraph: str | None = None) -> str:
+    """The text of every <tag> element (any namespace), with a line break after each <paragraph>."""
+    parts = []
+    length = 0
+    try:
+        with archive.open(name) as member:
+            for event, element in ElementTree.iterparse(_Limited(member, budget), events=("end",)):
+                local = element.tag.rsplit("}", 1)[-1]
+                if local == tag and element.text:
+                    parts.append(element.text)
+                    length += len(element.text)
+                elif local == paragraph:
+                    parts.append("\n")
+                    element.clear()
+                if length >= EXTRACT_MAX_TEXT_CHARS:
+                    break
+    except (ElementTree.ParseError, zipfile.BadZipFile, _BudgetExceeded):
+        pass
+    return "".join(parts) if paragraph else " ".join(parts)
+
+
+def _app_property(archive: zipfile.ZipFile, names: list[str], prop: str, budget: _Budget) -> int | None:
+    if "docProps/app.xml" not in names:
+        return None
+    try:
+        with archive.open("docProps/app.xml") as member:
+            for event, element in ElementTree.iterparse(_Limited(member, budget), events=("end",)):
+                if element.tag.rsplit("}", 1)[-1] == prop and (element.text or "").isdigit():
+                    return int(element.text)
+    except (ElementTree.ParseError, zipfile.BadZipFile, _BudgetExceeded):
+        pass
+    return None
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+class _Limited:
+    """A zip member that stops once the file's decompression budget is spent."""
+
+    def __init__(self, member, budget: _Budget):
+        self.member = member
+        self.budget = budget
+
+    def read(self, n: int = -1) -> bytes:
+        data = self.member.read(n if n > 0 else CHUNK_SIZE)
+        if not self.budget.take(len(data)):
+            raise _BudgetExceeded()
+        return data
+
+
+# --- Text and HTML -----------------------------------------------------------
+
+class _HTMLText(html.parser.HTMLParser):
+    SKIP = {"script", "style", "head"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skipping:
+            self._skipping -= 1
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def _text(path: str, is_html: bool) -> str:
+    with open(path, "rb") as f:
+        data = f.read(EXTRACT_MAX_TEXT_CHARS * 4)
+    text = data.decode("utf-8", errors="replace")
+    if not is_html:
+        return text
+    parser = _HTMLText()
+    parser.feed(text)
+    parser.close()
+    return " ".join(parser.parts)
+
+
+_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def _clean(text: str) -> str:
+    # NUL can't be stored in Postgres text columns
+    text = text.replace("\x00", "")
+    text = _BLANK_LINES.sub("\n", _WHITESPACE.sub(" ", text)).strip()
+    return text[:EXTRACT_MAX_TEXT_CHARS]
@@ -0,0 +1,168 @@
+# app/firebase.py
+"""
+Firebase Admin SDK initialization, and the outbound Firebase calls.
+
+Every call goes through one of the resilience.Dependency instances below, which
+give it a deadline, a bulkhead and a circuit breaker (see app/resilience.py).
+Storage calls live in storage.FirebaseStorage and use STORAGE.
+
+With FIREBASE_MODE=emulator, the auth calls are answered in process by
+app/firebase_emulator.py instead (still through the same Dependency wrappers,
+so fault injection and metrics work the same), and no credentials are needed.
+"""
+import hashlib
+import os
+import threading
+import time
+
+import firebase_admin
+import requests
+from firebase_admin import auth, credentials
+from dotenv import load_dotenv
+
+from . import firebase_emulator, resilience, storage
+
+FIREBASE_MODE = os.getenv("FIREBASE_MODE", "live")
+EMULATOR = FIREBASE_MODE == "emulator"
+# The module the auth calls go to
+_auth = firebase_emulator if EMULATOR else auth
+
+# verify_id_token (which fetches Google's signing certificates) and the user management API
+AUTH = resilience.Dependency("firebase_auth", timeout=5, max_concurrent=32)
+# The Identity Toolkit REST API behind password sign-in
+IDENTITY_TOOLKIT = resilience.Dependency("identity_toolkit", timeout=5, max_concurrent=16)
+STORAGE = resilience.Dependency("firebase_storage", timeout=15, max_concurrent=32)
+
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "10000"))
+SIGN_IN_URL = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword"
+SEND_OOB_CODE_URL = "https://identitytoolkit.googleapis.com/v1/accounts:sendOobCode"
+
+# sha256(ID token) -> decoded claims, for tokens verified while Firebase Auth was reachable
+_verified_tokens: dict[bytes, dict] = {}
+_verified_tokens_lock = threading.Lock()
+
+
+def init_app():
+    """Initializes the default Firebase Admin app from the environment (idempotent)."""
+    load_dotenv()
+    if EMULATOR:
+        if storage.STORAGE_BACKEND == "firebase":
+            raise ValueError("CRITICAL: FIREBASE_MODE=emulator can't use STORAGE_BACKEND=firebase; use local storage.")
+        print(f"Firebase emulator mode: auth is served in process (project {firebase_emulator.PROJECT_ID}).")
+        firebase_emulator.load_accounts()
+        return
+    try:
+        cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH", "serviceAccountKey.json")
+        storage_bucket = os.getenv("FIREBASE_STORAGE_BUCKET")
+        # The bucket is only needed when materials are stored in Firebase
+        if not storage_bucket and storage.STORAGE_BACKEND == "firebase":
+            raise ValueError("CRITICAL: FIREBASE_STORAGE_BUCKET environment variable is not set.")
+        cred = credentials.Certificate(cred_path)
+        options = {"httpTimeout": AUTH.timeout}
+        if storage_bucket:
+            options["storageBucket"] = storage_bucket
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(cred, options)
+            _app_args[:] = [cred, options]
+    except Exception as e:
+        print(f"CRITICAL: Error initializing Firebase Admin SDK: {e}")
+        raise e
+
+
+# The credential and options of the default app, to recreate it in forked workers
+_app_args: list = []
+
+
+def _new_app_after_fork():
+    """
+    The default app's clients (the auth HTTP session, the Storage client) keep
+    connections open; a forked worker gets its own instead of sharing the parent's.
+    """
+    if not _app_args or not firebase_admin._apps:
+        return
+    firebase_admin.delete_app(firebase_admin.get_app())
+    firebase_admin.initialize_app(*_app_args)
+
+
+os.register_at_fork(after_in_child=_new_app_after_fork)
+
+
+def verify_id_token(id_token: str) -> dict:
+    """
+    Verifies an ID token and returns its claims. While Firebase Auth is
+    unavailable, a token that was verified earlier (and hasn't expired) is
+    accepted from memory; other tokens raise DependencyUnavailable.
+    """
+    key = hashlib.sha256(id_token.encode()).digest()
+    try:
+        claims = AUTH.call("verify_id_token", _auth.verify_id_token, id_token)
+    except Exception as e:
+        if not resilience.is_unavailable(e):
+            raise
+        with _verified_tokens_lock:
+            cached = _verified_tokens.get(key)
+        if cached is None or cached.get("exp", 0) <= time.time():
+            if isinstance(e, resilience.DependencyUnavailable):
+                raise
+            raise resilience.DependencyUnavailable(AUTH.name, type(e).__name__) from e
+        resilience.fallbacks.inc(AUTH.name, "cached_token_claims")
+        return cached
+
+    with _verified_tokens_lock:
+        _verified_tokens.pop(key, None)
+        if len(_verified_tokens) >= VERIFIED_TOKEN_CACHE_SIZE:
+            del _verified_tokens[next(iter(_verified_tokens))]
+        _verified_tokens[key] = claims
+    return claims
+
+
+def set_custom_user_claims(uid: str, claims: dict):
+    AUTH.call("set_custom_user_claims", _auth.set_custom_user_claims, uid, claims)
+
+
+def generate_password_reset_link(email: str) -> str:
+    return AUTH.call("generate_password_reset_link", _auth.generate_password_reset_link, email)
+
+
+def send_password_reset_email(api_key: str, email: str) -> dict:
+    """
+    Has Firebase email a password reset link (using the project's email template).
+    Raises requests.HTTPError when Firebase rejects the request, e.g. EMAIL_NOT_FOUND.
+    """
+    if EMULATOR:
+        return IDENTITY_TOOLKIT.call("send_password_reset_email", firebase_emulator.send_password_reset_email, email)
+
+    def post():
+        response = requests.post(
+            SEND_OOB_CODE_URL, params={"key": api_key}, timeout=IDENTITY_TOOLKIT.timeout,
+            json={"requestType": "PASSWORD_RESET", "email": email},
+        )
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    response = IDENTITY_TOOLKIT.call("send_password_reset_email", post)
+    # Outside the call, so unknown emails don't count against the circuit breaker
+    response.raise_for_status()
+    return response.json()
+
+
+def list_users(page_token: str | None, max_results: int):
+    return AUTH.call("list_users", _auth.list_users, page_token=page_token, max_results=max_results)
+
+
+def sign_in_with_password(api_key: str, email: str, password: str) -> dict:
+    """Exchanges email and password for Firebase tokens. Raises requests.HTTPError when Firebase rejects them."""
+    if EMULATOR:
+        return IDENTITY_TOOLKIT.call("sign_in_with_password", firebase_emulator.sign_in_with_password, email, password)
+
+    def post():
+        response = requests.post(
+            SIGN_IN_URL, params={"key": api_key}, timeout=IDENTITY_TOOLKIT.timeout,
+            json={"email": email, "password": password, "returnSecureToken": True},
+        )
+        # Inside the call, so 5xx answers count against the circuit breaker
+        response.raise_for_status()
+        return response.json()
+
+    return IDENTITY_TOOLKIT.call("sign_in_with_password", post)
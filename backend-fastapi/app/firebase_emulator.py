@@ -0,0 +1,240 @@
+# app/firebase_emulator.py
+"""
+In-process stand-in for Firebase Authentication, used with FIREBASE_MODE=emulator
+so the service runs (and can be load tested) without Firebase credentials or
+network access.
+
+- ID tokens are JWTs signed (HS256) with FIREBASE_EMULATOR_SECRET. They carry
+  the claims of a real Firebase token (iss, aud, sub, email, exp, ...) plus the
+  account's custom claims. Every process that should accept them, including
+  `python -m app.manage mint-token`, needs the same secret.
+- Accounts and their custom claims live in the firebase_emulator_accounts
+  table of the app database, so every process sees the same accounts: a role
+  change made by one gunicorn worker and synced by `run-worker` reaches the
+  tokens the others issue. FIREBASE_EMULATOR_ACCOUNTS names a JSON file of
+  {"email", "password", "uid"} objects to add (or reset the passwords of) at
+  startup. With FIREBASE_EMULATOR_AUTO_SIGNUP (the default), signing in with an
+  unknown email creates the account; its uid is derived from the email, so
+  concurrent sign-ins in different processes create the same one.
+- Password reset emails are accepted for known accounts but not sent anywhere.
+
+The functions mirror the firebase_admin.auth calls made in app/firebase.py and
+raise the same exceptions. Material files use the local storage backend
+(the default in emulator mode), whose signed URLs this service checks itself.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import NamedTuple
+
+import requests
+from firebase_admin import auth
+from sqlalchemy import func, select, update
+
+from . import models
+from .database import SessionLocal, dialect_insert, engine
+
+PROJECT_ID = os.getenv("FIREBASE_EMULATOR_PROJECT_ID", "demo-lms")
+AUTO_SIGNUP = os.getenv("FIREBASE_EMULATOR_AUTO_SIGNUP", "true").lower() == "true"
+ACCOUNTS_FILE = os.getenv("FIREBASE_EMULATOR_ACCOUNTS")
+ID_TOKEN_SECONDS = 3600
+ISSUER = f"https://securetoken.google.com/{PROJECT_ID}"
+
+_secret = os.getenv("FIREBASE_EMULATOR_SECRET", "").encode()
+if not _secret and os.getenv("FIREBASE_MODE") == "emulator":
+    print("WARNING: FIREBASE_EMULATOR_SECRET is not set; tokens are only valid in this process until it restarts.")
+_secret = _secret or secrets.token_bytes(32)
+
+
+class Account(NamedTuple):
+    uid: str
+    email: str | None
+    password_hash: str | None
+    custom_claims: dict
+
+
+class ListUsersPage(NamedTuple):
+    users: list[Account]
+    next_page_token: str | None
+
+
+def load_accounts(path: str | None = ACCOUNTS_FILE):
+    """Creates the accounts table if needed and adds the accounts in the file."""
+    models.EmulatorAccount.__table__.create(bind=engine, checkfirst=True)
+    if not path:
+        return
+    with open(path) as f:
+        items = json.load(f)
+    for item in items:
+        create_account(item["email"], item.get("password"), item.get("uid"), replace=True)
+    print(f"Firebase emulator: loaded {len(items)} account(s) from {path}.")
+
+
+def create_account(email: str | None, password: str | None = None, uid: str | None = None,
+                   replace: bool = False) -> Account:
+    """
+    Adds the account. If the uid exists, its email and password are replaced
+    with replace=True and left alone otherwise; custom claims are kept.
+    """
+    uid = uid or uid_for_email(email)
+    password_hash = _hash_password(uid, password) if password else None
+    table = models.EmulatorAccount.__table__
+    db = SessionLocal()
+    try:
+        insert = dialect_insert(db, table).values(uid=uid, email=email, password_hash=password_hash, custom_claims={})
+        if replace:
+            insert = insert.on_conflict_do_update(
+                index_elements=[table.c.uid], set_={"email": email, "password_hash": password_hash},
+            )
+        else:
+            insert = insert.on_conflict_do_nothing(index_elements=[table.c.uid])
+        db.execute(insert)
+        db.commit()
+        return _account(db.get(models.EmulatorAccount, uid))
+    finally:
+        db.close()
+
+
+def uid_for_email(email: str) -> str:
+    return "emu-" + hashlib.sha256(email.lower().encode()).hexdigest()[:24]
+
+
+def mint_id_token(uid: str, email: str | None = None, claims: dict | None = None) -> str:
+    now = int(time.time())
+    payload = {
+        **(claims or {}),
+        "iss": ISSUER,
+        "aud": PROJECT_ID,
+        "sub": uid,
+        "user_id": uid,
+        "iat": now,
+        "auth_time": now,
+        "exp": now + ID_TOKEN_SECONDS,
+        "firebase": {"sign_in_provider": "password", "identities": {"email": [email]} if email else {}},
+    }
+    if email:
+        payload["email"] = email
+    signing_input = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode()) + "." + _b64(json.dumps(payload).encode())
+    return signing_input + "." + _b64(_sign(signing_input))
+
+
+def verify_id_token(id_token: str, check_revoked: bool = False) -> dict:
+    try:
+        signing_input, signature = id_token.rsplit(".", 1)
+        payload = json.loads(_unb64(signing_input.split(".", 1)[1]))
+        valid = hmac.compare_digest(_sign(signing_input), _unb64(signature))
+    except (ValueError, IndexError):
+        raise auth.InvalidIdTokenError("Malformed emulator ID token")
+    if not valid or payload.get("iss") != ISSUER or payload.get("aud") != PROJECT_ID:
+        raise auth.InvalidIdTokenError("Invalid emulator ID token")
+    if payload.get("exp", 0) <= time.time():
+        raise auth.ExpiredIdTokenError("Emulator ID token has expired", cause=None)
+    return {**payload, "uid": payload["sub"]}
+
+
+def sign_in_with_password(email: str, password: str) -> dict:
+    """Returns the same fields as the Identity Toolkit signInWithPassword response, or raises its HTTP 400 error."""
+    account = _find(func.lower(models.EmulatorAccount.email) == email.lower())
+    if account is None and AUTO_SIGNUP:
+        account = create_account(email, password)
+    if account is None or account.password_hash is None or not hmac.compare_digest(
+        account.password_hash, _hash_password(account.uid, password)
+    ):
+        _raise_http_error(400, "INVALID_LOGIN_CREDENTIALS")
+    return {
+        "kind": "identitytoolkit#VerifyPasswordResponse",
+        "localId": account.uid,
+        "email": account.email,
+        "idToken": mint_id_token(account.uid, account.email, account.custom_claims),
+        "refreshToken": secrets.token_urlsafe(32),
+        "expiresIn": str(ID_TOKEN_SECONDS),
+        "registered": True,
+    }
+
+
+def set_custom_user_claims(uid: str, custom_claims: dict | None):
+    db = SessionLocal()
+    try:
+        updated = db.execute(
+            update(models.EmulatorAccount)
+            .where(models.EmulatorAccount.uid == uid)
+            .values(custom_claims=dict(custom_claims or {}))
+        ).rowcount
+        db.commit()
+    finally:
+        db.close()
+    if not updated:
+        raise auth.UserNotFoundError(f"No user record found for the given identifier ({uid}).")
+
+
+def generate_password_reset_link(email: str) -> str:
+    if _find(func.lower(models.EmulatorAccount.email) == email.lower()) is None:
+        raise auth.UserNotFoundError(f"No user record found for the given email ({email}).")
+    return f"https://{PROJECT_ID}.firebaseapp.com/__/auth/action?mode=resetPassword&oobCode={secrets.token_urlsafe(24)}"
+
+
+def send_password_reset_email(email: str) -> dict:
+    """Answers like Identity Toolkit accounts:sendOobCode with requestType PASSWORD_RESET."""
+    if _find(func.lower(models.EmulatorAccount.email) == email.lower()) is None:
+        _raise_http_error(400, "EMAIL_NOT_FOUND", "accounts:sendOobCode")
+    return {"kind": "identitytoolkit#GetOobConfirmationCodeResponse", "email": email}
+
+
+def list_users(page_token: str | None = None, max_results: int = 1000) -> ListUsersPage:
+    """Accounts in uid order; the page token is the last uid of the previous page."""
+    query = select(models.EmulatorAccount).order_by(models.EmulatorAccount.uid).limit(max_results + 1)
+    if page_token is not None:
+        query = query.where(models.EmulatorAccount.uid > page_token)
+    db = SessionLocal()
+    try:
+        users = [_account(row) for row in db.scalars(query)]
+    finally:
+        db.close()
+    more = len(users) > max_results
+    users = users[:max_results]
+    return ListUsersPage(users, users[-1].uid if more else None)
+
+
+def _find(condition) -> Account | None:
+    db = SessionLocal()
+    try:
+        return _account(db.scalars(select(models.EmulatorAccount).where(condition)).first())
+    finally:
+        db.close()
+
+
+def _account(row: models.EmulatorAccount | None) -> Account | None:
+    if row is None:
+        return None
+    return Account(row.uid, row.email, row.password_hash, dict(row.custom_claims or {}))
+
+
+def _hash_password(uid: str, password: str) -> str:
+    # A single salted hash: this only guards test accounts, and a deliberately slow
+    # hash would put CPU load on the API that real Firebase doesn't
+    return hashlib.sha256(f"{uid}:{password}".encode()).hexdigest()
+
+
+def _raise_http_error(status_code: int, message: str, endpoint: str = "accounts:signInWithPassword"):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps({"error": {"code": status_code, "message": message}}).encode()
+    response.headers["Content-Type"] = "application/json"
+    response.url = f"emulator://identitytoolkit/{endpoint}"
+    raise requests.HTTPError(f"{status_code} {message}", response=response)
+
+
+def _sign(signing_input: str) -> bytes:
+    return hmac.new(_secret, signing_input.encode(), hashlib.sha256).digest()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
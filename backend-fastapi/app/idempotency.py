@@ -0,0 +1,230 @@
+# app/idempotency.py
+"""
+Idempotency-Key support for retried POSTs (course creation, enrollment, uploads).
+
+The first request with a given key claims it by inserting an `in_progress`
+row. When it finishes, IdempotencyMiddleware stores the response on that row,
+and retries with the same key within IDEMPOTENCY_TTL_HOURS get the stored
+response back (with an `Idempotent-Replayed: true` header) instead of running
+the endpoint again. A retry that arrives while the first request is still
+running waits for it, up to IDEMPOTENCY_WAIT_SECONDS.
+
+Keys are scoped per user, and bound to the request that first used them: its
+method, path, query and a SHA-256 of its body (of the form fields and file
+contents, for uploads). Reusing a key for a different request is answered
+with 422. Server errors (5xx) and exceptions are not recorded:
+the key is released so the client can retry for real.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Depends, Header, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from starlette.datastructures import UploadFile
+
+from . import jobs, models, security
+from .database import SessionLocal, dialect_insert
+
+IDEMPOTENCY_TTL = timedelta(hours=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+# An in-progress claim older than this belongs to a request that died with its instance
+STALE_CLAIM_AFTER = timedelta(minutes=5)
+POLL_INTERVAL = 0.1
+MAX_STORED_BODY = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class IdempotentReplay(Exception):
+    """Raised by the `idempotent` dependency to answer with a stored response."""
+
+    def __init__(self, record: models.IdempotencyKey):
+        self.status_code = record.response_status
+        self.body = record.response_body or ""
+        self.content_type = record.response_content_type
+
+
+async def replay_handler(request: Request, exc: IdempotentReplay):
+    return Response(content=exc.body, status_code=exc.status_code, media_type=exc.content_type,
+                    headers={"Idempotent-Replayed": "true"})
+
+
+async def idempotent(
+    request: Request,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key", max_length=255),
+    current_user: security.Principal = Depends(security.get_current_principal)
+):
+    """Route dependency: claims the request's Idempotency-Key, or replays / waits for its earlier use."""
+    if not idempotency_key:
+        return
+    signature = f"{request.method} {request.url.path}?{request.url.query} {await _body_digest(request)}"
+    request.state.idempotency_claim = await run_in_threadpool(claim, current_user.id, idempotency_key, signature)
+
+
+async def _body_digest(request: Request) -> str:
+    """SHA-256 of the request body. FastAPI has already read (and cached) it for the endpoint."""
+    digest = hashlib.sha256()
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith(("multipart/form-data", "application/x-www-form-urlencoded")):
+        digest.update(await request.body())
+        return digest.hexdigest()
+    # The raw stream was consumed by form parsing; hash the parsed fields instead
+    for name, value in (await request.form()).multi_items():
+        digest.update(b"%d:%s" % (len(name), name.encode()))
+        if isinstance(value, UploadFile):
+            digest.update(b"file:%s\0" % (value.filename or "").encode())
+            while chunk := await value.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+            await value.seek(0)
+        else:
+            digest.update(b"%d:%s" % (len(value.encode()), value.encode()))
+    return digest.hexdigest()
+
+
+def claim(user_id: int, key: str, signature: str) -> int:
+    """Returns the id of the claimed row, or raises IdempotentReplay / HTTPException."""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    db = SessionLocal()
+    try:
+        while True:
+            now = _now()
+            claimed = db.execute(
+                dialect_insert(db, models.IdempotencyKey.__table__)
+                .values(user_id=user_id, key=key, request=signature, status=models.IdempotencyStatus.in_progress,
+                        locked_at=now, expires_at=now + IDEMPOTENCY_TTL)
+                .on_conflict_do_nothing()
+                .returning(models.IdempotencyKey.id)
+            ).scalar()
+            db.commit()
+            if claimed is not None:
+                return claimed
+
+            record = db.scalars(
+                select(models.IdempotencyKey).where(models.IdempotencyKey.user_id == user_id, models.IdempotencyKey.key == key)
+            ).first()
+            if record is None:
+                continue
+            if _aware(record.expires_at) <= now:
+                _delete(db, record.id)
+                continue
+            if record.request != signature:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="This Idempotency-Key was already used for a different request."
+                )
+            if record.status == models.IdempotencyStatus.completed:
+                raise IdempotentReplay(record)
+            if _aware(record.locked_at) < now - STALE_CLAIM_AFTER and _take_over(db, record, now):
+                return record.id
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still being processed.",
+                    headers={"Retry-After": "1"},
+                )
+            db.rollback()
+            time.sleep(POLL_INTERVAL)
+    finally:
+        db.close()
+
+
+def complete(claim_id: int, status_code: int, body: bytes, content_type: str | None):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.IdempotencyKey)
+            .where(models.IdempotencyKey.id == claim_id)
+            .values(status=models.IdempotencyStatus.completed, response_status=status_code,
+                    response_body=body.decode("utf-8", "replace"), response_content_type=content_type, locked_at=None)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def release(claim_id: int):
+    db = SessionLocal()
+    try:
+        _delete(db, claim_id)
+    finally:
+        db.close()
+
+
+@jobs.housekeeping
+def purge_expired(db: Session) -> int:
+    result = db.execute(
+        delete(models.IdempotencyKey)
+        .where(models.IdempotencyKey.expires_at < _now())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+class IdempotencyMiddleware:
+    """Records the response of requests whose Idempotency-Key was claimed by the `idempotent` dependency."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(name == b"idempotency-key" for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        response = {"status": 500, "content_type": None, "body": bytearray(), "truncated": False}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-type":
+                        response["content_type"] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if len(response["body"]) + len(body) > MAX_STORED_BODY:
+                    response["truncated"] = True
+                else:
+                    response["body"] += body
+            await send(message)
+
+        succeeded = False
+        try:
+            await self.app(scope, receive, capture)
+            succeeded = True
+        finally:
+            claim_id = scope.get("state", {}).get("idempotency_claim")
+            if claim_id is not None:
+                if succeeded and response["status"] < 500 and not response["truncated"]:
+                    await run_in_threadpool(complete, claim_id, response["status"], bytes(response["body"]), response["content_type"])
+                else:
+                    await run_in_threadpool(release, claim_id)
+
+
+def _take_over(db: Session, record: models.IdempotencyKey, now: datetime) -> bool:
+    result = db.execute(
+        update(models.IdempotencyKey)
+        .where(models.IdempotencyKey.id == record.id, models.IdempotencyKey.locked_at == record.locked_at)
+        .values(locked_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def _delete(db: Session, claim_id: int):
+    db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.id == claim_id))
+    db.commit()
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
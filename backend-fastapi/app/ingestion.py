@@ -0,0 +1,368 @@
+# app/ingestion.py
+"""
+Material ingestion: after an upload, an `ingest_material` job records the
+file's size, SHA-256 checksum and page count on the material and stores its
+text in `material_texts`, where `search_materials` finds it.
+
+Extraction (app/extract.py) is CPU-bound and runs in a process pool of
+INGEST_PROCESSES workers, so it competes neither with the event loop nor with
+request threads for the GIL. The job worker thread only downloads the file
+(unless the storage backend keeps it on local disk), hands it to the pool and
+writes the result. At most INGEST_PROCESSES files are being extracted (and
+downloaded) per process at any time; further items wait for a free slot
+rather than queueing inside the pool.
+
+Each file gets INGEST_TIMEOUT_SECONDS. The worker interrupts itself when its
+time is up; a worker stuck where that can't reach it (inside a regex or zlib
+call) is killed after a grace period and the pool is replaced. Corrupt,
+oversized (INGEST_MAX_MB) and timed-out files are marked `failed` with the
+reason and not retried; `python -m app.manage ingest-materials
+--retry-failed` queues them again. Storage errors fail the job, which is
+retried with backoff.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, func, or_, select, text, update
+from sqlalchemy.orm import Session
+
+from . import events, extract, jobs, metrics, models, storage
+from .database import SessionLocal, dialect_insert
+
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(min(2, os.cpu_count() or 1))))
+INGEST_TIMEOUT_SECONDS = float(os.getenv("INGEST_TIMEOUT_SECONDS", "60"))
+INGEST_MAX_MB = int(os.getenv("INGEST_MAX_MB", "200"))
+# Extra time the parent gives a worker that didn't interrupt itself before killing it
+KILL_GRACE_SECONDS = 10
+# Pool workers are replaced after this many files, returning memory a large file left behind
+TASKS_PER_WORKER = 200
+ERROR_MAX_CHARS = 500
+
+ingestions = metrics.Counter(
+    "material_ingestions_total",
+    "Material ingestions by outcome: done, copied (text reused from a cloned material), failed, timeout or retry.",
+    ("outcome",),
+)
+
+_pool: ProcessPoolExecutor | None = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(INGEST_PROCESSES)
+
+
+class _Retry(Exception):
+    """A transient failure (storage, a replaced pool): the job is retried."""
+
+
+@jobs.handler("ingest_material", batch=True)
+def ingest_material(payloads: list[dict]):
+    ingest(payloads)
+
+
+def ingest(items: list[dict]) -> dict[str, int]:
+    """
+    Ingests the materials of `items` ({"material_id", "copy_from", "force"}
+    like the job payloads) and returns the number of materials per outcome.
+    Materials already done or failed are skipped unless `force` is set.
+    Raises if any of them hit a transient error, after saving the others.
+    """
+    counts: dict[str, int] = {}
+    db = SessionLocal()
+    try:
+        materials = models.CourseMaterial
+        rows = {
+            row.id: row
+            for row in db.execute(
+                select(materials.id, materials.course_id, materials.file_path, materials.content_type,
+                       materials.ingest_status)
+                .where(materials.id.in_({item["material_id"] for item in items}), materials.deleted_at.is_(None))
+            )
+        }
+        todo = []
+        for item in items:
+            row = rows.pop(item["material_id"], None)
+            if row is None or (row.ingest_status in ("done", "failed") and not item.get("force")):
+                _count(counts, "skipped")
+            elif item.get("copy_from") and _copy_text(db, row, item["copy_from"]):
+                _count(counts, "copied")
+            else:
+                todo.append(row)
+        db.commit()
+
+        if not todo:
+            return counts
+        with ThreadPoolExecutor(max_workers=min(INGEST_PROCESSES, len(todo)), thread_name_prefix="ingest") as threads:
+            results = list(threads.map(_extract, todo))
+
+        retry = None
+        for row, (outcome, value) in zip(todo, results):
+            _count(counts, outcome)
+            ingestions.inc(outcome)
+            if outcome == "retry":
+                retry = value
+            else:
+                _save(db, row, value if outcome == "done" else None, None if outcome == "done" else value)
+        db.commit()
+        if retry is not None:
+            raise retry
+        return counts
+    finally:
+        db.close()
+
+
+def backfill(db: Session, course_id: int | None = None, retry_failed: bool = False, force: bool = False) -> list[int]:
+    """
+    Ids of the materials that still need ingesting: never ingested or still
+    pending, plus failed ones with `retry_failed`, or every material with `force`.
+    """
+    materials = models.CourseMaterial
+    query = select(materials.id).where(materials.deleted_at.is_(None)).order_by(materials.id)
+    if course_id is not None:
+        query = query.where(materials.course_id == course_id)
+    if not force:
+        statuses = ["pending", "failed"] if retry_failed else ["pending"]
+        query = query.where(or_(materials.ingest_status.is_(None), materials.ingest_status.in_(statuses)))
+    return list(db.scalars(query))
+
+
+def enqueue(db: Session, material_ids: list[int], force: bool = False):
+    """Queues an ingestion job per material. Doesn't commit."""
+    if material_ids:
+        db.execute(
+            update(models.CourseMaterial)
+            .where(models.CourseMaterial.id.in_(material_ids))
+            .values(ingest_status="pending", ingest_error=None)
+            .execution_options(synchronize_session=False)
+        )
+    for material_id in material_ids:
+        jobs.enqueue(db, "ingest_material", {"material_id": material_id, "force": force},
+                     dedupe_key=f"ingest:{material_id}")
+
+
+def search_materials(db: Session, course_id: int, q: str, limit: int = 20) -> list[dict]:
+    """
+    The course's materials whose text matches `q`, best first: dicts of the
+    material row plus `snippet` (matches wrapped in **) and `rank`.
+
+    On Postgres, `q` is a web search query ("exact phrase", -excluded, or)
+    matched with English stemming and served by the full-text index. Elsewhere
+    every word of `q` has to appear (case-insensitive substring), and results
+    are ordered newest first with no rank.
+    """
+    materials = models.CourseMaterial
+    texts = models.MaterialText
+    query = (
+        select(materials)
+        .join(texts, texts.material_id == materials.id)
+        .where(texts.course_id == course_id, materials.deleted_at.is_(None))
+        .limit(limit)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        english = text("'english'")
+        tsquery = func.websearch_to_tsquery(english, q)
+        rank = func.ts_rank(func.to_tsvector(english, texts.content), tsquery)
+        snippet = func.ts_headline(
+            english, texts.content, tsquery, "StartSel=**, StopSel=**, MaxFragments=2, MaxWords=25, MinWords=10"
+        )
+        query = (
+            query.add_columns(snippet, rank)
+            .where(func.to_tsvector(english, texts.content).op("@@")(tsquery))
+            .order_by(rank.desc(), materials.id.desc())
+        )
+        return [{**_row(material), "snippet": text, "rank": score} for material, text, score in db.execute(query)]
+
+    terms = [term.lower() for term in q.split()][:10]
+    for term in terms:
+        query = query.where(func.lower(texts.content).contains(term, autoescape=True))
+    query = query.add_columns(texts.content).order_by(materials.id.desc())
+    return [{**_row(material), "snippet": _snippet(content, terms), "rank": None} for material, content in db.execute(query)]
+
+
+def _extract(row) -> tuple[str, object]:
+    """Returns ("done", extraction result), ("failed" or "timeout", reason) or ("retry", exception)."""
+    tmp_path = None
+    with _slots:
+        try:
+            try:
+                path, tmp_path, problem = _fetch(row)
+            except Exception as e:
+                # Storage outages, broken connections, ...
+                return "retry", _Retry(f"Material {row.id}: {e!r}")
+            if problem:
+                return "failed", problem
+            try:
+                return "done", _run_in_pool(path, row.content_type)
+            except (extract.ExtractionTimeout, FutureTimeout):
+                return "timeout", f"Extraction took longer than {INGEST_TIMEOUT_SECONDS:g}s"
+            except _Retry as e:
+                return "retry", e
+            except Exception as e:
+                # Raised while parsing: a malformed file, which won't get better with retries
+                return "failed", f"{type(e).__name__}: {e}"[:ERROR_MAX_CHARS]
+        finally:
+            if tmp_path is not None:
+                os.unlink(tmp_path)
+
+
+def _fetch(row) -> tuple[str | None, str | None, str | None]:
+    """(local path of the file, temporary copy to remove or None, reason it can't be ingested or None)."""
+    backend = storage.get_storage()
+    max_bytes = INGEST_MAX_MB * 1024 * 1024
+    path = backend.local_path(row.file_path)
+    if path is not None:
+        if not os.path.exists(path):
+            return None, None, "File not found in storage"
+        if os.path.getsize(path) > max_bytes:
+            return None, None, f"File is larger than {INGEST_MAX_MB} MB"
+        return path, None, None
+    info = backend.stat(row.file_path)
+    if info is None:
+        return None, None, "File not found in storage"
+    if info.size > max_bytes:
+        return None, None, f"File is larger than {INGEST_MAX_MB} MB"
+    fd, tmp_path = tempfile.mkstemp(prefix="ingest-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in backend.open(row.file_path):
+                out.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, tmp_path, None
+
+
+def _run_in_pool(path: str, content_type: str | None) -> dict:
+    pool = _get_pool()
+    future = pool.submit(extract.extract_file, path, content_type, INGEST_TIMEOUT_SECONDS)
+    try:
+        return future.result(timeout=INGEST_TIMEOUT_SECONDS + KILL_GRACE_SECONDS)
+    except FutureTimeout:
+        print(f"Ingestion: a worker ignored its timeout on {path}; replacing the process pool.")
+        _replace_pool(pool)
+        raise
+    except BrokenProcessPool as e:
+        # A worker died (killed above, or out of memory); the others' files are retried
+        _replace_pool(pool)
+        raise _Retry(f"Ingestion process pool broke: {e}")
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        # After a fork the parent's pool belongs to the parent
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn: forking a process that runs threads can copy a held lock into the child
+            _pool = ProcessPoolExecutor(
+                max_workers=INGEST_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=TASKS_PER_WORKER,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _replace_pool(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # The executor has no API to kill a busy worker
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        pool, _pool = (_pool, None) if _pool_pid == os.getpid() else (None, _pool)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _save(db: Session, row, result: dict | None, error: str | None):
+    """Writes one material's outcome; skipped if the material was deleted meanwhile."""
+    now = datetime.now(timezone.utc)
+    materials = models.CourseMaterial
+    if result is None:
+        values = {"ingest_status": "failed", "ingest_error": error, "ingested_at": now}
+    else:
+        values = {
+            "size_bytes": result["size_bytes"],
+            "checksum": result["checksum"],
+            "page_count": result["page_count"],
+            "ingest_status": "done",
+            "ingest_error": None,
+            "ingested_at": now,
+        }
+    updated = db.execute(
+        update(materials)
+        .where(materials.id == row.id, materials.deleted_at.is_(None))
+        .values(**values)
+        .returning(materials.id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if updated is None or result is None:
+        return
+    _store_text(db, row.id, row.course_id, result["text"])
+    events.publish_on_commit(db, "material.ingested", row.course_id, material_id=row.id,
+                             page_count=result["page_count"], size_bytes=result["size_bytes"])
+
+
+def _copy_text(db: Session, row, source_id: int) -> bool:
+    """Gives a cloned material its source's extraction results. False if the source has none (anymore)."""
+    source = db.execute(
+        select(models.CourseMaterial.ingest_status, models.MaterialText.content)
+        .outerjoin(models.MaterialText, models.MaterialText.material_id == models.CourseMaterial.id)
+        .where(models.CourseMaterial.id == source_id)
+    ).first()
+    if source is None or source.ingest_status != "done":
+        return False
+    db.execute(
+        update(models.CourseMaterial)
+        .where(models.CourseMaterial.id == row.id)
+        .values(ingest_status="done", ingest_error=None, ingested_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    _store_text(db, row.id, row.course_id, source.content or "")
+    ingestions.inc("copied")
+    return True
+
+
+def _store_text(db: Session, material_id: int, course_id: int, content: str):
+    texts = models.MaterialText.__table__
+    if not content:
+        db.execute(delete(texts).where(texts.c.material_id == material_id))
+        return
+    db.execute(
+        dialect_insert(db, texts)
+        .values(material_id=material_id, course_id=course_id, content=content)
+        .on_conflict_do_update(index_elements=[texts.c.material_id], set_={"content": content, "course_id": course_id})
+    )
+
+
+def _row(material: models.CourseMaterial) -> dict:
+    return {column.name: getattr(material, column.name) for column in models.CourseMaterial.__table__.columns}
+
+
+def _snippet(content: str, terms: list[str], width: int = 160) -> str:
+    lowered = content.lower()
+    positions = [p for p in (lowered.find(term) for term in terms) if p >= 0]
+    start = max(min(positions, default=0) - width // 3, 0)
+    excerpt = content[start:start + width]
+    for term in sorted(set(terms), key=len, reverse=True):
+        index = excerpt.lower().find(term)
+        if index >= 0:
+            excerpt = f"{excerpt[:index]}**{excerpt[index:index + len(term)]}**{excerpt[index + len(term):]}"
+    prefix = "..." if start else ""
+    suffix = "..." if start + width < len(content) else ""
+    return prefix + excerpt.strip() + suffix
+
+
+def _count(counts: dict[str, int], outcome: str):
+    counts[outcome] = counts.get(outcome, 0) + 1
@@ -0,0 +1,230 @@
+# app/jobs.py
+"""
+A database-backed background job queue.
+
+Jobs are rows in the `jobs` table. `enqueue` adds a job inside the caller's
+transaction, so a job only becomes visible if the change that produced it is
+committed. Worker threads claim due jobs, run the registered handler and either
+mark them done or reschedule them with exponential backoff. Jobs that keep
+failing end up as `failed` after `max_attempts`.
+
+Handlers must be idempotent: a job can run more than once if a worker dies
+after the handler finished but before the job was marked done.
+"""
+import os
+import random
+import socket
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal, dialect_insert
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "50"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+# A running job whose worker hasn't finished it within this time is handed to another worker
+JOB_LOCK_TIMEOUT = timedelta(minutes=10)
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+
+_handlers: dict[str, tuple] = {}
+_housekeeping: list = []
+
+
+def handler(kind: str, batch: bool = False):
+    """
+    Registers the decorated function as the handler for jobs of `kind`.
+    A batch handler receives the payloads of all claimed jobs of that kind at
+    once (and they succeed or fail together); otherwise it gets one payload.
+    """
+    def register(fn):
+        _handlers[kind] = (fn, batch)
+        return fn
+    return register
+
+
+def housekeeping(fn):
+    """Registers `fn(db)` to be run about once an hour by every worker, e.g. to purge old rows."""
+    _housekeeping.append(fn)
+    return fn
+
+
+def enqueue(db: Session, kind: str, payload: dict, dedupe_key: str | None = None,
+            delay: timedelta | None = None, max_attempts: int = 5):
+    """Queues a job in the caller's transaction. Doesn't commit."""
+    values = {
+        "kind": kind,
+        "payload": payload,
+        "status": models.JobStatus.pending,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "dedupe_key": dedupe_key,
+        "run_at": _now() + (delay or timedelta()),
+    }
+    db.execute(dialect_insert(db, models.Job.__table__).values(**values).on_conflict_do_nothing())
+
+
+def claim(db: Session, worker_id: str, limit: int = JOB_BATCH_SIZE) -> list[models.Job]:
+    """Marks up to `limit` due jobs as running for this worker and returns them."""
+    now = _now()
+    due = or_(
+        (models.Job.status == models.JobStatus.pending) & (models.Job.run_at <= now),
+        (models.Job.status == models.JobStatus.running) & (models.Job.locked_at < now - JOB_LOCK_TIMEOUT),
+    )
+    candidates = select(models.Job.id).where(due).order_by(models.Job.run_at, models.Job.id).limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        candidates = candidates.with_for_update(skip_locked=True)
+    ids = list(db.scalars(candidates))
+    if not ids:
+        db.rollback()
+        return []
+
+    # The conditional UPDATE makes the claim safe even without row locks (SQLite)
+    token = f"{worker_id}:{uuid.uuid4().hex[:8]}"
+    db.execute(
+        update(models.Job)
+        .where(models.Job.id.in_(ids), due)
+        .values(status=models.JobStatus.running, attempts=models.Job.attempts + 1, locked_by=token, locked_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return list(db.scalars(select(models.Job).where(models.Job.locked_by == token).order_by(models.Job.id)))
+
+
+def run_claimed(db: Session, claimed: list[models.Job]):
+    by_kind: dict[str, list[models.Job]] = {}
+    for job in claimed:
+        by_kind.setdefault(job.kind, []).append(job)
+
+    for kind, group in by_kind.items():
+        fn, batch = _handlers.get(kind, (None, False))
+        if fn is None:
+            _finish(db, group, error=f"No handler registered for job kind '{kind}'", retry=False)
+            continue
+        units = [group] if batch else [[job] for job in group]
+        for unit in units:
+            try:
+                if batch:
+                    fn([job.payload for job in unit])
+                else:
+                    fn(unit[0].payload)
+            except Exception:
+                _finish(db, unit, error=traceback.format_exc(limit=5))
+            else:
+                _finish(db, unit)
+
+
+def run_once(worker_id: str = "manual") -> int:
+    """Claims and runs one batch of due jobs. Returns how many jobs were claimed."""
+    db = SessionLocal()
+    try:
+        claimed = claim(db, worker_id)
+        run_claimed(db, claimed)
+        return len(claimed)
+    finally:
+        db.close()
+
+
+@housekeeping
+def purge_finished(db: Session, older_than: timedelta = timedelta(days=JOB_RETENTION_DAYS)) -> int:
+    result = db.execute(
+        delete(models.Job)
+        .where(models.Job.status == models.JobStatus.done, models.Job.finished_at < _now() - older_than)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def queue_stats(db: Session) -> dict:
+    counts = db.execute(
+        select(models.Job.kind, models.Job.status, func.count()).group_by(models.Job.kind, models.Job.status)
+    ).all()
+    stats: dict[str, dict[str, int]] = {}
+    for kind, job_status, count in counts:
+        stats.setdefault(kind, {})[job_status.value] = count
+    failures = db.scalars(
+        select(models.Job).where(models.Job.status == models.JobStatus.failed).order_by(models.Job.id.desc()).limit(20)
+    )
+    return {
+        "by_kind": stats,
+        "recent_failures": [
+            {"id": job.id, "kind": job.kind, "attempts": job.attempts, "error": (job.last_error or "").strip().splitlines()[-1:]}
+            for job in failures
+        ],
+    }
+
+
+class JobWorker(threading.Thread):
+    def __init__(self, name: str):
+        super().__init__(name=name, daemon=True)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{name}"
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last_purge = datetime.min.replace(tzinfo=timezone.utc)
+        while not self._stop_event.is_set():
+            try:
+                claimed = run_once(self.worker_id)
+                if _now() - last_purge > timedelta(hours=1):
+                    db = SessionLocal()
+                    try:
+                        for fn in _housekeeping:
+                            fn(db)
+                    finally:
+                        db.close()
+                    last_purge = _now()
+            except Exception as e:
+                print(f"Job worker {self.name} error: {e}")
+                claimed = 0
+            if not claimed:
+                self._stop_event.wait(JOB_POLL_INTERVAL)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_workers(count: int = JOB_WORKERS) -> list[JobWorker]:
+    workers = [JobWorker(f"job-worker-{i}") for i in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def stop_workers(workers: list[JobWorker], timeout: float = 10):
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join(timeout)
+
+
+def _finish(db: Session, unit: list[models.Job], error: str | None = None, retry: bool = True):
+    now = _now()
+    for job in unit:
+        if error is None:
+            job.status = models.JobStatus.done
+            job.finished_at = now
+            job.last_error = None
+        elif retry and job.attempts < job.max_attempts:
+            backoff = min(BACKOFF_BASE_SECONDS * 2 ** (job.attempts - 1), BACKOFF_MAX_SECONDS)
+            job.status = models.JobStatus.pending
+            job.run_at = now + timedelta(seconds=backoff * random.uniform(0.8, 1.2))
+            job.last_error = error
+        else:
+            job.status = models.JobStatus.failed
+            job.finished_at = now
+            job.last_error = error
+        job.locked_by = None
+        job.locked_at = None
+    db.commit()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
@@ -1,26 +1,50 @@
 # app/main.py
-import os
-import firebase_admin
-from firebase_admin import credentials
-from dotenv import load_dotenv
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from . import models
+from . import admission, audit, events, firebase, idempotency, ingestion, jobs, metrics, models, profiling, request_context, resilience, role_claims, storage, tasks, terms, traffic
 from .database import engine
-from .routers import auth, users, courses
+from .routers import admin, auth, users, courses, terms as terms_router
+from .routers import events as events_router
+from .routers import storage as storage_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Set JOB_WORKERS=0 when jobs are processed by `python -m app.manage run-worker` instead
+    workers = jobs.start_workers()
+    # Also inserts what crashed processes left in the spill directory
+    audit.start()
+    role_claims.load_recent_changes()
+    events.start(asyncio.get_running_loop())
+    yield
+    events.stop()
+    jobs.stop_workers(workers)
+    ingestion.shutdown()
+    audit.stop()
 
 
 app = FastAPI(
     title="Smart LMS - FastAPI Service",
     description="This service handles user management, course content, and enrollments.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 origins = [
     "http://localhost:5173",
     "https://smartlearning-300c0.web.app"
 ]
+app.add_middleware(idempotency.IdempotencyMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
+# Added before CORS so that shed requests still carry CORS headers
+app.add_middleware(admission.AdmissionControlMiddleware, **admission.middleware_options())
+# Outside admission control, so shed (503) and rate limited (429) requests are counted too
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -28,25 +52,34 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if traffic.TRAFFIC_CAPTURE_PATH:
+    # Outside admission control and CORS, so shed and preflight requests are part of the recorded mix
+    app.add_middleware(traffic.TrafficCaptureMiddleware)
+# Outermost, so everything below (including database hooks) can see the current request
+app.add_middleware(request_context.RequestContextMiddleware)
 
-load_dotenv()
-try:
-    cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH", "serviceAccountKey.json")
-    storage_bucket = os.getenv("FIREBASE_STORAGE_BUCKET")
-    if not storage_bucket:
-        raise ValueError("CRITICAL: FIREBASE_STORAGE_BUCKET environment variable is not set.")
-    cred = credentials.Certificate(cred_path)
-    if not firebase_admin._apps:
-        firebase_admin.initialize_app(cred, {'storageBucket': storage_bucket})
-except Exception as e:
-    print(f"CRITICAL: Error initializing Firebase Admin SDK: {e}")
-    raise e
+app.add_exception_handler(idempotency.IdempotentReplay, idempotency.replay_handler)
+app.add_exception_handler(resilience.DependencyUnavailable, resilience.unavailable_handler)
+
+firebase.init_app()
 
 models.Base.metadata.create_all(bind=engine)
 
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(users.router, prefix="/api/users", tags=["Users"])
 app.include_router(courses.router, prefix="/api/courses", tags=["Courses"])
+app.include_router(terms_router.router, prefix="/api/terms", tags=["Terms"])
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
+app.include_router(events_router.router, prefix="/api/events", tags=["Events"])
+if storage.STORAGE_BACKEND == "local":
+    app.include_router(storage_router.router, prefix="/api/storage", tags=["Storage"])
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics(authorization: str | None = Header(default=None)):
+    # Scrapers authenticate with a static token (if one is configured), not a Firebase user
+    if metrics.METRICS_TOKEN and authorization != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/", tags=["Root"])
 def read_root():
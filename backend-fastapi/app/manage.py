@@ -0,0 +1,481 @@
+# app/manage.py
+"""
+Maintenance commands for the LMS database.
+
+Usage: python -m app.manage <command> [options]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import event, inspect, text
+from sqlalchemy.sql.elements import ClauseElement, TextClause
+
+from . import crud, firebase, firebase_emulator, ingestion, jobs, models, role_claims, schemas, storage, tasks, terms, traffic, user_sync
+# Imported for the housekeeping they register with the job worker
+from . import idempotency, material_sync  # noqa: F401
+from .role_claims import Principal
+from .database import SessionLocal, engine
+
+
+def upgrade_schema(args) -> int:
+    """
+    Creates missing tables and indexes and adds columns that were added to the
+    models since the tables were created. Never drops or alters existing columns.
+    """
+    models.Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    changes = 0
+    with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    if isinstance(default, ClauseElement) and not isinstance(default, TextClause):
+                        # An expression such as now()
+                        expression = str(default.compile(dialect=engine.dialect))
+                        if engine.dialect.name == "sqlite":
+                            # SQLite only takes constant defaults here: add the column, then fill it
+                            print(ddl)
+                            conn.execute(text(ddl))
+                            conn.execute(text(f"UPDATE {table.name} SET {column.name} = {expression}"))
+                            changes += 1
+                            continue
+                        ddl += f" DEFAULT {expression}"
+                    else:
+                        ddl += f" DEFAULT {getattr(default, 'text', default)}"
+                elif not column.nullable:
+                    print(f"Can't add {table.name}.{column.name}: NOT NULL without a server default.")
+                    return 1
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                print(ddl)
+                conn.execute(text(ddl))
+                changes += 1
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    print(f"CREATE INDEX {index.name}")
+                    index.create(conn)
+                    changes += 1
+    print(f"Schema is up to date ({changes} change(s) applied).")
+    return 0
+
+
+def rebuild_course_stats(args) -> int:
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        drift = crud.rebuild_course_stats(db, fix=not args.check)
+    finally:
+        db.close()
+
+    for entry in drift:
+        if entry["missing"]:
+            print(f"course {entry['course_id']}: no stats row")
+            continue
+        for field in ("enrollment_count", "material_count"):
+            stored, actual = entry[field]
+            if stored != actual:
+                print(f"course {entry['course_id']}: {field} stored={stored} actual={actual}")
+
+    if not drift:
+        print("Course stats are consistent.")
+        return 0
+    if args.check:
+        print(f"{len(drift)} course(s) drifted. Run without --check to repair.")
+        return 1
+    print(f"Repaired stats for {len(drift)} course(s).")
+    return 0
+
+
+def sync_firebase_users(args) -> int:
+    models.Base.metadata.create_all(bind=engine)
+    if args.from_file:
+        source = user_sync.JsonFileUserSource(args.from_file, page_size=args.batch_size)
+    else:
+        firebase.init_app()
+        source = user_sync.FirebaseUserSource(page_size=args.batch_size)
+
+    db = SessionLocal()
+    try:
+        totals = user_sync.sync_users(
+            db, source, restart=args.restart,
+            progress=lambda t: print(f"  {t['pages']} page(s), {t['upserted']} upserted, {t['skipped']} skipped"),
+        )
+    finally:
+        db.close()
+    if totals["resumed_from"]:
+        print(f"Resumed after {totals['resumed_from']} previously processed account(s).")
+    print(f"Done: {totals['pages']} page(s), {totals['upserted']} upserted, {totals['skipped']} skipped.")
+    return 0
+
+
+def bench_storage(args) -> int:
+    if storage.STORAGE_BACKEND == "firebase":
+        firebase.init_app()
+    backend = storage.get_storage()
+    payload = os.urandom(args.size_kb * 1024)
+    paths = [f"bench/{uuid.uuid4()}.bin" for _ in range(args.files)]
+    total_mb = len(payload) * len(paths) / (1024 * 1024)
+
+    def timed(label, fn, mb=None):
+        started = time.perf_counter()
+        for path in paths:
+            fn(path)
+        elapsed = time.perf_counter() - started
+        rate = f", {mb / elapsed:.1f} MB/s" if mb else ""
+        print(f"{label:<12} {elapsed * 1000 / len(paths):8.2f} ms/op{rate}")
+
+    print(f"Backend: {type(backend).__name__}, {args.files} file(s) of {args.size_kb} KiB")
+    try:
+        timed("put", lambda p: backend.put(p, io.BytesIO(payload), "application/octet-stream"), total_mb)
+        timed("stat", backend.stat)
+        timed("get", lambda p: sum(len(c) for c in backend.open(p)), total_mb)
+        timed("get range", lambda p: sum(len(c) for c in backend.open(p, 0, 64 * 1024 - 1)))
+        timed("sign url", lambda p: backend.signed_url(p, timedelta(hours=1)))
+    finally:
+        started = time.perf_counter()
+        backend.delete_many(paths)
+        print(f"{'delete batch':<12} {(time.perf_counter() - started) * 1000:8.2f} ms total")
+    return 0
+
+
+def bench_writes(args) -> int:
+    """
+    Times the course write paths and counts database round trips (statements
+    plus commits) per operation, next to the fetch/commit/refresh pattern they
+    replaced. Point DATABASE_URL at a remote Postgres to see what each round trip costs.
+    """
+    models.Base.metadata.create_all(bind=engine)
+    round_trips = 0
+
+    def count_round_trip(*_):
+        nonlocal round_trips
+        round_trips += 1
+
+    tag = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    users = [
+        models.User(email=f"bench-{tag}-{i}@example.invalid", firebase_uid=f"bench-{tag}-{i}",
+                    role=models.UserRole.instructor if i < 2 else models.UserRole.student)
+        for i in range(2 + args.courses)
+    ]
+    db.add_all(users)
+    db.commit()
+    owner, other, students = users[0], users[1], users[2:]
+    actor = Principal(owner.id, owner.firebase_uid, owner.role, 0)
+    owner_id, other_id, student_ids = owner.id, other.id, [student.id for student in students]
+    db.close()
+
+    def timed(label, fn, items):
+        nonlocal round_trips
+        results = []
+        round_trips = 0
+        started = time.perf_counter()
+        for item in items:
+            # A fresh session per operation, like a request
+            with SessionLocal() as session:
+                results.append(fn(session, item))
+        elapsed = time.perf_counter() - started
+        print(f"{label:<22} {elapsed * 1000 / len(items):8.2f} ms/op {round_trips / len(items):6.1f} round trips/op")
+        return results
+
+    def legacy_create(session, i):
+        course = models.Course(title=f"bench {i}", owner_id=owner_id, stats=models.CourseStats(enrollment_count=0, material_count=0))
+        session.add(course)
+        session.flush()
+        session.commit()
+        session.refresh(course)
+        return course.id
+
+    def legacy_update(session, course_id):
+        crud.get_course(session, course_id)  # the router's existence/ownership check
+        course = crud.get_course(session, course_id)
+        course.title = "bench (legacy)"
+        session.commit()
+        session.refresh(course)
+
+    def legacy_assign(session, course_id):
+        course = crud.get_course(session, course_id)
+        session.query(models.User).filter(models.User.id == other_id).first()
+        course.owner_id = other_id
+        session.commit()
+        session.refresh(course)
+
+    def legacy_delete(session, course_id):
+        crud.get_course(session, course_id)
+        course = crud.get_course(session, course_id)
+        session.query(models.CourseMaterial.file_path).filter(models.CourseMaterial.course_id == course_id).all()
+        session.delete(course)
+        session.commit()
+
+    update = schemas.CourseCreate(title="bench")
+    n = args.courses
+    event.listen(engine, "before_cursor_execute", count_round_trip)
+    event.listen(engine, "commit", count_round_trip)
+    try:
+        print(f"{engine.dialect.name}, {n} course(s)")
+        legacy_ids = timed("create (legacy)", legacy_create, range(n))
+        course_ids = timed("create", lambda s, i: crud.create_course(s, schemas.CourseCreate(title=f"bench {i}"), owner_id)["id"], range(n))
+        timed("update (legacy)", legacy_update, legacy_ids)
+        timed("update", lambda s, c: crud.update_course(s, c, update, actor), course_ids)
+        timed("enroll", lambda s, pair: crud.create_enrollment(s, pair[0], pair[1]), list(zip(course_ids, student_ids)))
+        timed("assign (legacy)", legacy_assign, legacy_ids)
+        timed("assign", lambda s, c: crud.assign_instructor_to_course(s, c, other_id), course_ids)
+        timed("delete (legacy)", legacy_delete, legacy_ids)
+        timed("delete", lambda s, c: crud.delete_course(s, c), course_ids)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_round_trip)
+        event.remove(engine, "commit", count_round_trip)
+        with SessionLocal() as session:
+            session.query(models.User).filter(models.User.firebase_uid.like(f"bench-{tag}-%")).delete(synchronize_session=False)
+            session.commit()
+    return 0
+
+
+def run_worker(args) -> int:
+    models.Base.metadata.create_all(bind=engine)
+    firebase.init_app()
+    if args.once:
+        print(f"Processed {jobs.run_once()} job(s).")
+        return 0
+    workers = jobs.start_workers(args.threads)
+    print(f"Running {len(workers)} job worker thread(s). Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        jobs.stop_workers(workers)
+    return 0
+
+
+def ingest_materials(args) -> int:
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        material_ids = ingestion.backfill(db, course_id=args.course_id, retry_failed=args.retry_failed, force=args.force)
+        if not args.now:
+            for start in range(0, len(material_ids), args.batch_size):
+                ingestion.enqueue(db, material_ids[start:start + args.batch_size], force=args.force)
+                db.commit()
+            print(f"Queued {len(material_ids)} material(s) for ingestion. Run the job workers to process them.")
+            return 0
+    finally:
+        db.close()
+
+    firebase.init_app()
+    totals: dict[str, int] = {}
+    try:
+        for start in range(0, len(material_ids), args.batch_size):
+            chunk = material_ids[start:start + args.batch_size]
+            try:
+                counts = ingestion.ingest([{"material_id": material_id, "force": True} for material_id in chunk])
+            except Exception as e:
+                print(f"Materials {chunk[0]}..{chunk[-1]}: {e}")
+                counts = {"retry": 1}
+            for outcome, count in counts.items():
+                totals[outcome] = totals.get(outcome, 0) + count
+            print(f"{min(start + len(chunk), len(material_ids))}/{len(material_ids)} "
+                  + ", ".join(f"{outcome}={count}" for outcome, count in sorted(totals.items())))
+    finally:
+        ingestion.shutdown()
+    return 1 if totals.get("retry") else 0
+
+
+def archive_term(args) -> int:
+    db = SessionLocal()
+    try:
+        term = db.query(models.Term).filter(models.Term.code == args.code).first()
+        if term is None:
+            print(f"No term with code {args.code}.")
+            return 1
+        try:
+            terms.archive_term(db, term.id)
+        except HTTPException as e:
+            print(f"Term {args.code}: {e.detail}.")
+            return 1
+    finally:
+        db.close()
+    return 0
+
+
+def partition_enrollments(args) -> int:
+    if engine.dialect.name != "postgresql":
+        print("Only Postgres databases are partitioned; nothing to do.")
+        return 0
+    upgrade_schema(args)
+    db = SessionLocal()
+    try:
+        copied = terms.partition_enrollments(db)
+    finally:
+        db.close()
+    print(f"enrollments is partitioned by term ({copied} row(s) copied).")
+    return 0
+
+
+def set_role(args) -> int:
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == args.email).first()
+        if user is None:
+            print(f"No user with email {args.email}.")
+            return 1
+        crud.update_user_role(db, user.id, models.UserRole(args.role))
+    finally:
+        db.close()
+    print(f"{args.email} is now {args.role}. The Firebase claims are updated by the job workers.")
+    return 0
+
+
+def sync_role_claims(args) -> int:
+    db = SessionLocal()
+    try:
+        queued = crud.sync_role_claims(db)
+    finally:
+        db.close()
+    print(f"Queued a claims sync for {queued} user(s). Run the job workers to apply them.")
+    return 0
+
+
+def mint_token(args) -> int:
+    if not firebase.EMULATOR:
+        print("mint-token only works with FIREBASE_MODE=emulator.")
+        return 1
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == args.email).first()
+        if user is None:
+            print(f"No user with email {args.email}.")
+            return 1
+        # With the role claims, so role checks take the same path as with a real token
+        print(firebase_emulator.mint_id_token(user.firebase_uid, user.email, role_claims.claims_for(user)))
+    finally:
+        db.close()
+    return 0
+
+
+def replay_traffic(args) -> int:
+    records = traffic.load_trace(args.trace)
+    if args.limit:
+        records = records[:args.limit]
+    tokens = {}
+    for item in args.token:
+        principal_class, _, token = item.partition("=")
+        tokens[principal_class] = token
+    missing = sorted({record["pc"] for record in records} - set(tokens) - {"anonymous"})
+    if missing:
+        print(f"No --token for {', '.join(missing)}; those requests are sent without one.")
+    signer = traffic.local_storage_signer()
+    print(f"Replaying {len(records)} request(s) against {args.base_url} at {args.speed:g}x.")
+    report = asyncio.run(traffic.replay(
+        records, args.base_url, speed=args.speed, tokens=tokens, concurrency=args.concurrency, signer=signer,
+    ))
+    report.print()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report.as_dict(), f, indent=2)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    upgrade = commands.add_parser("upgrade-schema", help="Add tables, columns and indexes that are missing from the database.")
+    upgrade.set_defaults(func=upgrade_schema)
+
+    stats = commands.add_parser("rebuild-course-stats", help="Recompute the course_stats table and report drift.")
+    stats.add_argument("--check", action="store_true", help="Only report drift, don't repair it (exits 1 on drift).")
+    stats.set_defaults(func=rebuild_course_stats)
+
+    sync = commands.add_parser("sync-firebase-users", help="Upsert all Firebase Authentication accounts into the users table.")
+    sync.add_argument("--batch-size", type=int, default=1000, help="Accounts per page and per INSERT (max 1000 for Firebase).")
+    sync.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint and start from the first page.")
+    sync.add_argument("--from-file", help="Read accounts from a JSON file of {uid, email} objects instead of Firebase.")
+    sync.set_defaults(func=sync_firebase_users)
+
+    bench = commands.add_parser("bench-storage", help="Time put/stat/get/sign/delete against the configured STORAGE_BACKEND.")
+    bench.add_argument("--files", type=int, default=20)
+    bench.add_argument("--size-kb", type=int, default=1024)
+    bench.set_defaults(func=bench_storage)
+
+    writes = commands.add_parser("bench-writes", help="Time course writes and count round trips per operation (uses the configured database).")
+    writes.add_argument("--courses", type=int, default=50)
+    writes.set_defaults(func=bench_writes)
+
+    worker = commands.add_parser("run-worker", help="Process background jobs outside the web server.")
+    worker.add_argument("--threads", type=int, default=2)
+    worker.add_argument("--once", action="store_true", help="Run one batch of due jobs and exit.")
+    worker.set_defaults(func=run_worker)
+
+    ingest = commands.add_parser(
+        "ingest-materials",
+        help="Extract size, checksum, page count and searchable text of materials uploaded before ingestion existed.",
+    )
+    ingest.add_argument("--course-id", type=int, help="Only this course's materials.")
+    ingest.add_argument("--retry-failed", action="store_true", help="Also materials whose ingestion failed.")
+    ingest.add_argument("--force", action="store_true", help="Every material, even those already ingested.")
+    ingest.add_argument("--now", action="store_true",
+                        help="Ingest in this process (with INGEST_PROCESSES workers) instead of queueing jobs.")
+    ingest.add_argument("--batch-size", type=int, default=50)
+    ingest.set_defaults(func=ingest_materials)
+
+    archive = commands.add_parser("archive-term", help="Move a closed term's enrollments to the archive tables now.")
+    archive.add_argument("code", help="The term's code, e.g. 2026-spring.")
+    archive.set_defaults(func=archive_term)
+
+    partition = commands.add_parser(
+        "partition-enrollments",
+        help="Postgres: convert an enrollments table created before terms into one partitioned by term. "
+             "Blocks enrollments while it copies the table.",
+    )
+    partition.set_defaults(func=partition_enrollments)
+
+    role = commands.add_parser(
+        "set-role",
+        help="Change a user's role. Running API instances only learn about it through EVENTS_BROKER=postgres; "
+             "otherwise prefer PATCH /api/users/{id}/role.",
+    )
+    role.add_argument("email")
+    role.add_argument("role", choices=[r.value for r in models.UserRole])
+    role.set_defaults(func=set_role)
+
+    claims = commands.add_parser("sync-role-claims", help="Queue a Firebase custom claims update for every user.")
+    claims.set_defaults(func=sync_role_claims)
+
+    replay = commands.add_parser("replay-traffic", help="Replay a TRAFFIC_CAPTURE_PATH trace against a running instance and report latencies per route.")
+    replay.add_argument("trace")
+    replay.add_argument("--base-url", default="http://127.0.0.1:8000")
+    replay.add_argument("--speed", type=float, default=1.0, help="Time compression, e.g. 4 replays an hour of traffic in 15 minutes.")
+    replay.add_argument("--concurrency", type=int, default=500, help="Most requests in flight at once.")
+    replay.add_argument("--token", action="append", default=[], metavar="CLASS=TOKEN",
+                        help="ID token for a principal class (student, instructor, admin); repeatable.")
+    replay.add_argument("--limit", type=int, help="Replay only the first N requests.")
+    replay.add_argument("--json", help="Also write the report to this file.")
+    replay.set_defaults(func=replay_traffic)
+
+    token = commands.add_parser(
+        "mint-token",
+        help="Print an ID token for a user (FIREBASE_MODE=emulator only; needs the server's FIREBASE_EMULATOR_SECRET).",
+    )
+    token.add_argument("email")
+    token.set_defaults(func=mint_token)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
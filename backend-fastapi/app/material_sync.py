@@ -0,0 +1,97 @@
+# app/material_sync.py
+"""
+Delta sync of course materials: the materials created or deleted since a
+client-held cursor, so repeat visits only transfer (and sign URLs for) what
+changed.
+
+A cursor is an opaque encoding of the (updated_at, id) position of the last
+change the client has seen; changes are read in that order from the
+(course_id, updated_at) index. A row can become visible after rows with a
+later updated_at (its transaction committed later), so the last page's cursor
+never points past CHANGES_SETTLE_SECONDS ago: changes in that window are sent
+again on the next sync, and clients apply them idempotently.
+
+Tombstones are kept for MATERIAL_TOMBSTONE_DAYS. An older cursor could have
+missed deletions, so it is rejected with 410 and the client starts over.
+"""
+import base64
+import os
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.orm import Session
+
+from . import jobs, models
+
+MATERIAL_TOMBSTONE_DAYS = float(os.getenv("MATERIAL_TOMBSTONE_DAYS", "30"))
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", "10"))
+
+
+def encode_cursor(updated_at: datetime, material_id: int) -> str:
+    raw = f"{_aware(updated_at).isoformat()}|{material_id}"
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, material_id = raw.split("|")
+        return _aware(datetime.fromisoformat(timestamp)), int(material_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def changes_since(db: Session, course_id: int, cursor: str | None, limit: int) -> tuple[list[models.CourseMaterial], str, bool]:
+    """
+    Returns (changed materials in change order, next cursor, has_more). Without a
+    cursor, only live materials are returned: a client with nothing to delete
+    doesn't need tombstones.
+    """
+    now = datetime.now(timezone.utc)
+    materials = models.CourseMaterial
+    query = select(materials).where(materials.course_id == course_id)
+    position = None
+    if cursor:
+        position = decode_cursor(cursor)
+        if position[0] < now - timedelta(days=MATERIAL_TOMBSTONE_DAYS):
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="Cursor is too old; fetch the full material list without a cursor.",
+            )
+        query = query.where(tuple_(materials.updated_at, materials.id) > tuple_(_db_value(position[0]), position[1]))
+    else:
+        query = query.where(materials.deleted_at.is_(None))
+
+    rows = db.scalars(query.order_by(materials.updated_at, materials.id).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        position = (_aware(rows[-1].updated_at), rows[-1].id)
+    if not has_more:
+        horizon = now - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+        if position is None or position[0] > horizon:
+            position = (horizon, 0)
+    return rows, encode_cursor(*position), has_more
+
+
+@jobs.housekeeping
+def purge_tombstones(db: Session) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=MATERIAL_TOMBSTONE_DAYS)
+    result = db.execute(
+        delete(models.CourseMaterial)
+        .where(models.CourseMaterial.deleted_at < cutoff)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def _db_value(value: datetime) -> datetime:
+    # Stored timestamps are UTC; SQLite keeps them without an offset
+    return value.astimezone(timezone.utc)
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
@@ -0,0 +1,243 @@
+# app/metrics.py
+"""
+Prometheus metrics, served in the text exposition format at /metrics.
+
+Recording is lock-free on the hot path: each thread updates its own shard of
+every metric (a plain dict only that thread writes to), and a scrape sums the
+shards. A thread takes a lock only once, the first time it records.
+
+Exported:
+- http_requests_total / http_request_duration_seconds, per route template
+- db_pool_* gauges and db_pool_wait_seconds for the SQLAlchemy pool
+- firebase_calls_total / firebase_call_errors_total / firebase_call_duration_seconds
+  for every outbound Firebase call, labelled by call name
+"""
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from sqlalchemy.pool import QueuePool
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+
+class _Sharded:
+    """Base for metrics keeping one dict of label values -> state per recording thread."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._shards: list[dict] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshots(self) -> list[dict]:
+        with self._lock:
+            shards = list(self._shards)
+        # dict.copy() runs without releasing the GIL, so it can't see a half-applied update
+        return [shard.copy() for shard in shards]
+
+    def _label_text(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        totals: dict[tuple, float] = {}
+        for snapshot in self._snapshots():
+            for key, value in snapshot.items():
+                totals[key] = totals.get(key, 0) + value
+        return [f"{self.name}{self._label_text(key)} {_number(value)}" for key, value in sorted(totals.items())]
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...], buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values):
+        shard = self._shard()
+        state = shard.get(label_values)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, then sum and count
+            state = shard[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        else:
+            state[len(self.buckets)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self) -> list[str]:
+        totals: dict[tuple, list] = {}
+        for snapshot in self._snapshots():
+            for key, state in snapshot.items():
+                state = list(state)
+                total = totals.get(key)
+                totals[key] = state if total is None else [a + b for a, b in zip(total, state)]
+        lines = []
+        for key, state in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == "+Inf" else _number(bound))
+                lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_number(state[-2])}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {state[-1]}")
+        return lines
+
+
+class Gauge:
+    """A value read at scrape time from `read()`, which returns {label values: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...], read):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.read = read
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, value in sorted(self.read().items()):
+            labels = ",".join(f'{name}="{_escape(v)}"' for name, v in zip(self.labels, key))
+            lines.append(f"{self.name}{'{' + labels + '}' if labels else ''} {_number(value)}")
+        return lines
+
+
+_registry: list = []
+
+
+def render() -> str:
+    out = []
+    for metric in _registry:
+        out.append(f"# HELP {metric.name} {metric.help_text}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(metric.render())
+    return "\n".join(out) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# --- HTTP -----------------------------------------------------------------
+
+http_requests = Counter("http_requests_total", "HTTP requests by route template and status code.", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency until the response is complete.", ("method", "route"))
+
+
+class MetricsMiddleware:
+    """Times every HTTP request. Unrouted requests (404s, shed load) share one label to bound cardinality."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path_format", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method, route, str(status_code))
+            http_latency.observe(time.perf_counter() - started, method, route)
+
+
+# --- Database pool --------------------------------------------------------
+
+pool_wait = Histogram("db_pool_wait_seconds", "Time spent waiting to check a connection out of the pool.", (), POOL_WAIT_BUCKETS)
+_pools: "weakref.WeakSet[InstrumentedQueuePool]" = weakref.WeakSet()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times checkouts and registers itself for the db_pool_* gauges."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools.add(self)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.observe(time.perf_counter() - started)
+
+
+def _pool_reader(attribute: str):
+    def read():
+        return {(): sum(getattr(pool, attribute)() for pool in list(_pools))}
+    return read
+
+
+Gauge("db_pool_size", "Configured pool size.", (), _pool_reader("size"))
+Gauge("db_pool_checked_out", "Connections currently checked out.", (), _pool_reader("checkedout"))
+Gauge("db_pool_checked_in", "Idle connections in the pool.", (), _pool_reader("checkedin"))
+Gauge("db_pool_overflow", "Connections open beyond the pool size (negative while the pool isn't full yet).", (), _pool_reader("overflow"))
+
+
+# --- Firebase -------------------------------------------------------------
+
+firebase_calls = Counter("firebase_calls_total", "Outbound Firebase calls.", ("call",))
+firebase_errors = Counter("firebase_call_errors_total", "Outbound Firebase calls that raised, by exception type.", ("call", "error"))
+firebase_latency = Histogram("firebase_call_duration_seconds", "Outbound Firebase call latency.", ("call",))
+
+
+@contextmanager
+def firebase_call(call: str):
+    """Times the enclosed Firebase call and counts it (and its exception type, if it raises)."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        firebase_errors.inc(call, type(e).__name__)
+        raise
+    finally:
+        firebase_calls.inc(call)
+        firebase_latency.observe(time.perf_counter() - started, call)
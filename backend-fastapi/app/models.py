@@ -1,10 +1,10 @@
 # app/models.py
 import enum
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, Enum
+from sqlalchemy import Column, Date, Integer, String, Text, ForeignKey, Table, Enum, JSON, Index, UniqueConstraint, DDL, event
 from sqlalchemy.orm import relationship
-from .database import Base
+from .database import Base, engine
 from sqlalchemy import DateTime
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 
 # Define the Role enum
 class UserRole(str, enum.Enum):
@@ -12,12 +12,55 @@ class UserRole(str, enum.Enum):
     instructor = "instructor"
     admin = "admin"
 
-# Association table for the many-to-many relationship between users and courses (enrollments)
+# Association table for the many-to-many relationship between users and courses (enrollments).
+# term_id is the course's term (0 for courses without one), copied here so Postgres can
+# partition the table by term; see app/terms.py. Rows are only inserted by crud.create_enrollment.
 enrollment_table = Table('enrollments', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
-    Column('course_id', Integer, ForeignKey('courses.id'), primary_key=True)
+    Column('course_id', Integer, ForeignKey('courses.id'), primary_key=True),
+    Column('term_id', Integer, primary_key=True, nullable=False, default=0, server_default="0"),
+    # Roster lookups and counts filter by both, which also prunes Postgres to one partition
+    Index("ix_enrollments_term_id_course_id", "term_id", "course_id"),
+    postgresql_partition_by="LIST (term_id)",
 )
 
+# Enrollments of archived terms, moved out of `enrollments` by terms.archive_term.
+# Same columns, no foreign keys: in Postgres its partitions are the detached term
+# partitions of `enrollments`.
+enrollment_archive_table = Table('enrollments_archive', Base.metadata,
+    Column('user_id', Integer, primary_key=True),
+    Column('course_id', Integer, primary_key=True),
+    Column('term_id', Integer, primary_key=True),
+    Index("ix_enrollments_archive_term_id_course_id", "term_id", "course_id"),
+    postgresql_partition_by="LIST (term_id)",
+)
+
+# A partitioned table can't hold rows itself: terms get their own partition when they are
+# created (terms.create_term), everything else lands in the default one.
+if engine.dialect.name == "postgresql":
+    for _table in (enrollment_table, enrollment_archive_table):
+        event.listen(_table, "after_create", DDL(f"CREATE TABLE {_table.name}_default PARTITION OF {_table.name} DEFAULT"))
+
+class TermStatus(str, enum.Enum):
+    upcoming = "upcoming"
+    active = "active"
+    closed = "closed"
+    archived = "archived"
+
+class Term(Base):
+    """An academic term, e.g. 2026-fall. See app/terms.py."""
+    __tablename__ = "terms"
+
+    id = Column(Integer, primary_key=True)
+    code = Column(String(32), nullable=False, unique=True)
+    name = Column(String, nullable=False)
+    starts_on = Column(Date, nullable=True)
+    ends_on = Column(Date, nullable=True)
+    status = Column(Enum(TermStatus), nullable=False, default=TermStatus.upcoming)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    closed_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), nullable=True)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -25,6 +68,12 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     firebase_uid = Column(String, unique=True, index=True, nullable=False)
     role = Column(Enum(UserRole), nullable=False, default=UserRole.student)
+    # Bumped on every role change; mirrored into the Firebase custom claims (see app/role_claims.py)
+    role_version = Column(Integer, nullable=False, default=0, server_default="0")
+    role_changed_at = Column(DateTime(timezone=True), nullable=True, index=True)
+
+    # The user directory (crud.search_users) filters by role and pages in email order
+    __table_args__ = (Index("ix_users_role_email", "role", "email"),)
 
     # Relationship to courses this user has created (as an instructor/admin)
     owned_courses = relationship("Course", back_populates="owner")
@@ -32,6 +81,114 @@ class User(Base):
     # Many-to-many relationship for courses this user is enrolled in
     enrolled_courses = relationship("Course", secondary=enrollment_table, back_populates="enrolled_students")
 
+# Trigram index behind case-insensitive email search (ILIKE 'prefix%' and '%part%').
+# Postgres only; other databases fall back to scanning ix_users_role_email.
+if engine.dialect.name == "postgresql":
+    Index("ix_users_email_trgm", User.email, postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"})
+    event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+class JobStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+class Job(Base):
+    """A unit of background work, see app/jobs.py."""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.pending)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    # Jobs with the same dedupe_key are only queued once while one of them is pending or running
+    dedupe_key = Column(String, nullable=True)
+    run_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+        Index(
+            "uq_jobs_active_dedupe_key", "dedupe_key", unique=True,
+            postgresql_where=status.in_([JobStatus.pending, JobStatus.running]),
+            sqlite_where=status.in_([JobStatus.pending, JobStatus.running]),
+        ),
+    )
+
+class SyncCheckpoint(Base):
+    """Resume position of a long-running sync job, e.g. the Firebase user import."""
+    __tablename__ = "sync_checkpoints"
+
+    name = Column(String, primary_key=True)
+    cursor = Column(String, nullable=True)
+    processed = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class AuditEvent(Base):
+    """
+    Who changed what, written in batches by app/audit.py. No foreign keys: the
+    trail outlives the users and courses it mentions.
+    """
+    __tablename__ = "audit_events"
+
+    id = Column(Integer, primary_key=True)
+    # Assigned when the event is recorded; makes replaying a spill file idempotent
+    event_id = Column(String(32), nullable=False, unique=True)
+    occurred_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    action = Column(String, nullable=False)
+    # The acting user; None for manage commands and background jobs
+    actor_id = Column(Integer, nullable=True)
+    course_id = Column(Integer, nullable=True)
+    route = Column(String, nullable=True)
+    details = Column(JSON, nullable=False, default=dict)
+
+    __table_args__ = (
+        Index("ix_audit_events_actor_id_id", "actor_id", "id"),
+        Index("ix_audit_events_course_id_id", "course_id", "id"),
+        Index("ix_audit_events_action_id", "action", "id"),
+    )
+
+class IdempotencyStatus(str, enum.Enum):
+    in_progress = "in_progress"
+    completed = "completed"
+
+class IdempotencyKey(Base):
+    """The outcome of a request sent with an Idempotency-Key header, see app/idempotency.py."""
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String(255), nullable=False)
+    # "METHOD /path?query body-sha256" of the first request; reusing the key for another request is an error
+    request = Column(String, nullable=False)
+    status = Column(Enum(IdempotencyStatus), nullable=False, default=IdempotencyStatus.in_progress)
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    response_content_type = Column(String, nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
+
+class EmulatorAccount(Base):
+    """A Firebase account of FIREBASE_MODE=emulator, see app/firebase_emulator.py."""
+    __tablename__ = "firebase_emulator_accounts"
+
+    uid = Column(String(128), primary_key=True)
+    email = Column(String, nullable=True, unique=True)
+    password_hash = Column(String, nullable=True)
+    custom_claims = Column(JSON, nullable=False, default=dict)
+
 class CourseMaterial(Base):
     __tablename__ = "course_materials"
 
@@ -44,10 +201,45 @@ class CourseMaterial(Base):
     course_id = Column(Integer, ForeignKey("courses.id"), nullable=False)
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set on every change. Deleted materials stay behind as tombstones (deleted_at set)
+    # so clients syncing changes since a cursor learn about the deletion.
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Filled in by the ingestion job after upload (see app/ingestion.py). ingest_status is
+    # "pending", "done" or "failed"; NULL for materials uploaded before ingestion existed.
+    size_bytes = Column(Integer, nullable=True)
+    checksum = Column(String(64), nullable=True)
+    page_count = Column(Integer, nullable=True)
+    ingest_status = Column(String(16), nullable=True)
+    ingest_error = Column(String, nullable=True)
+    ingested_at = Column(DateTime(timezone=True), nullable=True)
 
     # Relationship back to the course it belongs to
     course = relationship("Course", back_populates="materials")
 
+    __table_args__ = (
+        Index("ix_course_materials_course_id_updated_at", "course_id", "updated_at"),
+    )
+
+class MaterialText(Base):
+    """Text extracted from a material, searched by GET /api/courses/{id}/materials/search."""
+    __tablename__ = "material_texts"
+
+    material_id = Column(Integer, ForeignKey("course_materials.id", ondelete="CASCADE"), primary_key=True)
+    # Denormalized so a course's search doesn't join course_materials to filter
+    course_id = Column(Integer, nullable=False, index=True)
+    content = Column(Text, nullable=False)
+
+# Full-text index matching ingestion.search_materials' to_tsvector('english', content).
+# Postgres only; other databases fall back to a LIKE scan of the course's texts.
+if engine.dialect.name == "postgresql":
+    Index(
+        "ix_material_texts_content_fts",
+        func.to_tsvector(text("'english'"), MaterialText.content),
+        postgresql_using="gin",
+    )
+
 class Course(Base):
     __tablename__ = "courses"
 
@@ -56,12 +248,39 @@ class Course(Base):
     description = Column(String, nullable=True)
     capacity = Column(Integer, nullable=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
-
-    
+    # NULL for courses outside the term calendar; catalog listings filter on it
+    term_id = Column(Integer, ForeignKey("terms.id"), nullable=True, index=True)
 
     # Relationship back to the user who owns the course
     owner = relationship("User", back_populates="owned_courses")
+    term = relationship("Term")
     
     # Many-to-many relationship for students enrolled in this course
     enrolled_students = relationship("User", secondary=enrollment_table, back_populates="enrolled_courses")
-    materials = relationship("CourseMaterial", back_populates="course", cascade="all, delete-orphan")
\ No newline at end of file
+    materials = relationship("CourseMaterial", back_populates="course", cascade="all, delete-orphan")
+    # Denormalized counters, loaded in the same query as the course itself
+    stats = relationship("CourseStats", back_populates="course", uselist=False, lazy="joined", cascade="all, delete-orphan")
+
+class CourseStats(Base):
+    """
+    Per-course summary counters, kept up to date by the crud write paths in the
+    same transaction as the change they describe. `python -m app.manage
+    rebuild-course-stats` recomputes them from the source tables.
+    """
+    __tablename__ = "course_stats"
+
+    course_id = Column(Integer, ForeignKey("courses.id"), primary_key=True)
+    enrollment_count = Column(Integer, nullable=False, default=0)
+    material_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    course = relationship("Course", back_populates="stats")
+
+    @property
+    def fill_ratio(self) -> float | None:
+        return fill_ratio(self.enrollment_count, self.course.capacity if self.course is not None else None)
+
+def fill_ratio(enrollment_count: int, capacity: int | None) -> float | None:
+    if not capacity:
+        return None
+    return enrollment_count / capacity
\ No newline at end of file
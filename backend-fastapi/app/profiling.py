@@ -0,0 +1,305 @@
+# app/profiling.py
+"""
+On-demand sampling profiler for single requests.
+
+A request is profiled when:
+- it carries an `X-Profile: 1` header (or `?__profile=1`) and its bearer token
+  passes `security.get_current_admin_user`. Other callers' requests run
+  normally and unprofiled; or
+- PROFILE_SAMPLE_EVERY=N is set, in which case every Nth request is profiled.
+
+While a request is profiled, a background thread snapshots the stacks of the
+threads working on it every PROFILE_INTERVAL_MS and counts identical stacks.
+The result is kept in a bounded in-memory store as folded stacks (the input
+format of flamegraph.pl and speedscope). It is listed at /api/admin/profiles.
+
+Sync endpoints and dependencies run on threadpool threads, so `ProfiledRoute`
+wraps them to record which thread is working for which profiled request.
+When no profile is active this costs one ContextVar lookup per call.
+"""
+import contextvars
+import functools
+import inspect
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from fastapi import HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from fastapi.security import HTTPAuthorizationCredentials
+
+from . import security
+from .database import SessionLocal
+
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", "50"))
+MAX_STACK_DEPTH = 128
+
+_active_profile: contextvars.ContextVar["RequestProfile | None"] = contextvars.ContextVar("active_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self, profile_id: int, method: str, path: str, trigger: str):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.duration_ms: float | None = None
+        self.status_code: int | None = None
+        self.samples: Counter[str] = Counter()
+        self.sample_count = 0
+        self.authorized = False
+        self._threads: Counter[int] = Counter()
+        self._lock = threading.Lock()
+
+    def enter_thread(self, ident: int):
+        with self._lock:
+            self._threads[ident] += 1
+
+    def exit_thread(self, ident: int):
+        with self._lock:
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def sample(self, frames: dict):
+        with self._lock:
+            idents = list(self._threads)
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is not None:
+                self.samples[_fold(frame)] += 1
+                self.sample_count += 1
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status_code": self.status_code,
+            "samples": self.sample_count,
+        }
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def top_functions(self, limit: int = 30) -> list[dict]:
+        """Functions by self samples (the frame on top of the stack)."""
+        own = Counter()
+        for stack, count in self.samples.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        total = self.sample_count or 1
+        return [{"function": fn, "samples": n, "percent": round(100 * n / total, 1)} for fn, n in own.most_common(limit)]
+
+
+class ProfileStore:
+    def __init__(self, size: int):
+        self.size = size
+        self._profiles: OrderedDict[int, RequestProfile] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.size:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: int) -> RequestProfile | None:
+        return self._profiles.get(profile_id)
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [p.summary() for p in reversed(profiles)]
+
+
+class _Sampler(threading.Thread):
+    """One thread samples all profiled requests; it idles when there are none."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.interval = interval
+        self._profiles: set[RequestProfile] = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.add(profile)
+        self._wakeup.set()
+
+    def remove(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def run(self):
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._wakeup.clear()
+            if not profiles:
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(self.interval)
+
+
+class _ThreadTagged:
+    """
+    Wraps a sync endpoint or dependency so that the thread running it is sampled
+    for the active profile. Compares and hashes like the wrapped function, so
+    dependency_overrides keyed by the original function keep working.
+    """
+
+    def __init__(self, fn):
+        functools.update_wrapper(self, fn)
+        self.fn = fn
+
+    def __call__(self, *args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None or not profile.authorized:
+            return self.fn(*args, **kwargs)
+        ident = threading.get_ident()
+        profile.enter_thread(ident)
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            profile.exit_thread(ident)
+
+    def __eq__(self, other):
+        return other is self or other is self.fn
+
+    def __hash__(self):
+        return hash(self.fn)
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose sync endpoint and dependencies can be sampled by the request profiler."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _tag_dependant(self.dependant, {})
+
+
+def _tag_dependant(dependant, wrapped: dict):
+    for sub_dependant in dependant.dependencies:
+        _tag_dependant(sub_dependant, wrapped)
+    call = dependant.call
+    if inspect.isfunction(call) and not (inspect.iscoroutinefunction(call) or inspect.isgeneratorfunction(call)):
+        if call not in wrapped:
+            wrapped[call] = _ThreadTagged(call)
+        dependant.call = wrapped[call]
+
+
+_TAGGED_CALL_CODE = _ThreadTagged.__call__.__code__
+
+
+def _fold(frame) -> str:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        if code is _TAGGED_CALL_CODE:
+            # Everything below the wrapper is threadpool plumbing
+            break
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+store = ProfileStore(PROFILE_STORE_SIZE)
+_sampler: _Sampler | None = None
+_sampler_lock = threading.Lock()
+_ids = itertools.count(1)
+_request_counter = itertools.count(1)
+
+
+def _start(profile: RequestProfile):
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = _Sampler(PROFILE_INTERVAL)
+            _sampler.start()
+    _sampler.add(profile)
+
+
+def _is_admin(authorization: str) -> bool:
+    scheme, _, credentials = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not credentials:
+        return False
+    db = SessionLocal()
+    try:
+        decoded_token = security.verify_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=credentials))
+        security.get_current_admin_user(security.get_current_principal(Response(), db=db, decoded_token=decoded_token))
+        return True
+    except HTTPException:
+        return False
+    finally:
+        db.close()
+
+
+def _wants_profile(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return value in (b"1", b"true")
+    return b"__profile=1" in scope.get("query_string", b"")
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, sample_every: int = PROFILE_SAMPLE_EVERY):
+        self.app = app
+        self.sample_every = sample_every
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trigger = None
+        if _wants_profile(scope):
+            trigger = "opt-in"
+        elif self.sample_every and next(_request_counter) % self.sample_every == 0:
+            trigger = "sampled"
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        if trigger == "opt-in":
+            authorization = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"authorization"), "")
+            if not await run_in_threadpool(_is_admin, authorization):
+                await self.app(scope, receive, send)
+                return
+
+        profile = RequestProfile(next(_ids), scope["method"], scope["path"], trigger)
+        profile.authorized = True
+        _start(profile)
+        token = _active_profile.set(profile)
+        started = time.perf_counter()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                if trigger == "opt-in":
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-profile-id", str(profile.id).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _active_profile.reset(token)
+            profile.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            _sampler.remove(profile)
+            store.add(profile)
@@ -0,0 +1,57 @@
+# app/request_context.py
+"""
+Makes the request currently being handled visible to code that isn't given it,
+such as SQLAlchemy event hooks. The ContextVar is copied into the threadpool
+threads that run sync endpoints, so it works there too.
+"""
+import contextvars
+
+_scope: contextvars.ContextVar[dict | None] = contextvars.ContextVar("request_scope", default=None)
+
+
+def current_route() -> str | None:
+    """
+    "METHOD /route/{template}" of the current request, the raw path if it hasn't
+    been routed yet, or None outside a request (jobs, manage commands).
+    """
+    scope = _scope.get()
+    if scope is None:
+        return None
+    route = scope.get("route")
+    path = getattr(route, "path_format", None) or scope["path"]
+    return f"{scope.get('method', 'WS')} {path}"
+
+
+def set_principal(user_id: int, role: str):
+    """Records whom the current request acts as, for the audit log and traffic capture."""
+    scope = _scope.get()
+    if scope is not None:
+        scope["lms.principal"] = (user_id, role)
+
+
+def current_principal_id() -> int | None:
+    scope = _scope.get()
+    principal = scope.get("lms.principal") if scope is not None else None
+    return principal[0] if principal else None
+
+
+def principal_class(scope: dict) -> str:
+    """The role the request acted as, or "anonymous"."""
+    principal = scope.get("lms.principal")
+    return principal[1] if principal else "anonymous"
+
+
+class RequestContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        # Routing adds "route" to this same dict, so current_route() sees the template later on
+        token = _scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _scope.reset(token)
@@ -0,0 +1,258 @@
+# app/resilience.py
+"""
+Deadlines, circuit breakers and bulkheads for outbound dependencies.
+
+Every call to a `Dependency` (see app/firebase.py) goes through `call()`:
+
+- Bulkhead: at most `max_concurrent` calls run at once, on the dependency's
+  own worker threads. A caller that can't get a slot within
+  BULKHEAD_WAIT_SECONDS is turned away, so a slow dependency ties up its own
+  workers instead of every request thread.
+- Deadline: the caller waits at most `timeout` seconds for the result. The
+  abandoned call keeps its slot until it really returns.
+- Circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive failures
+  (timeouts, connection errors, 5xx), calls fail immediately for
+  CIRCUIT_RESET_SECONDS. Then a single trial call decides whether to close it
+  again. Errors about the request itself (invalid token, missing blob, wrong
+  password) mean the dependency answered, and count as successes.
+
+Calls that are turned away, time out or hit an open circuit raise
+DependencyUnavailable. The API answers those with 503 and Retry-After unless
+the caller has a fallback.
+
+FAULT_INJECTION stands in for a misbehaving dependency when testing locally,
+e.g. '{"firebase_storage": {"latency": 2.5, "error_rate": 0.3}}'. With
+ALLOW_FAULT_INJECTION=true, faults can also be changed at runtime through
+/api/admin/dependencies.
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import requests
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+from firebase_admin import exceptions as firebase_exceptions
+from google.api_core import exceptions as google_exceptions
+
+from . import metrics
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+BULKHEAD_WAIT_SECONDS = float(os.getenv("BULKHEAD_WAIT_SECONDS", "0.5"))
+FAULT_INJECTION = json.loads(os.getenv("FAULT_INJECTION") or "{}")
+ALLOW_FAULT_INJECTION = os.getenv("ALLOW_FAULT_INJECTION", "false").lower() == "true"
+
+_DEFAULT = object()
+
+rejections = metrics.Counter(
+    "dependency_rejections_total",
+    "Outbound calls not made (circuit_open, bulkhead_full) or given up on (timeout).",
+    ("dependency", "reason"),
+)
+fallbacks = metrics.Counter("dependency_fallbacks_total", "Degraded responses served because a dependency was unavailable.", ("dependency", "fallback"))
+
+
+class DependencyUnavailable(Exception):
+    def __init__(self, dependency: str, reason: str, retry_after: float = 1):
+        super().__init__(f"{dependency} is unavailable ({reason})")
+        self.dependency = dependency
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class InjectedFault(ConnectionError):
+    """Raised by fault injection; counts as a failure like a dropped connection."""
+
+
+async def unavailable_handler(request: Request, exc: DependencyUnavailable):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": f"{exc}. Please try again later."},
+        headers={"Retry-After": str(max(int(exc.retry_after + 0.999), 1))},
+    )
+
+
+def is_failure(exc: BaseException) -> bool:
+    """Whether an error says the dependency is unhealthy, as opposed to rejecting this particular request."""
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code >= 500
+    return isinstance(exc, (
+        TimeoutError, ConnectionError, requests.ConnectionError, requests.Timeout,
+        google_exceptions.ServerError, google_exceptions.RetryError,
+        firebase_exceptions.UnavailableError, firebase_exceptions.InternalError,
+        firebase_exceptions.DeadlineExceededError, firebase_exceptions.UnknownError,
+    ))
+
+
+def is_unavailable(exc: BaseException) -> bool:
+    """Whether a caller with a fallback should use it."""
+    return isinstance(exc, DependencyUnavailable) or is_failure(exc)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_after: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_after:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        """Open and not yet due for a trial call."""
+        return self.state == self.OPEN and time.monotonic() - self._opened_at < self.reset_after
+
+    def record(self, healthy: bool):
+        with self._lock:
+            if healthy:
+                self.state = self.CLOSED
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                    self.state = self.OPEN
+                    self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def retry_after(self) -> float:
+        return max(self.reset_after - (time.monotonic() - self._opened_at), 1)
+
+
+class Fault:
+    """Injected latency (seconds) and error rate (0..1) applied before each call."""
+
+    def __init__(self, latency: float = 0, error_rate: float = 0):
+        self.latency = float(latency)
+        self.error_rate = float(error_rate)
+
+    def apply(self, dependency: str):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise InjectedFault(f"Injected fault in {dependency}")
+
+    def as_dict(self) -> dict:
+        return {"latency": self.latency, "error_rate": self.error_rate}
+
+
+class Dependency:
+    """
+    An outbound dependency with its own deadline, bulkhead and circuit breaker.
+    `timeout` and `max_concurrent` can be overridden with <NAME>_TIMEOUT_SECONDS
+    and <NAME>_MAX_CONCURRENT, e.g. FIREBASE_STORAGE_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, name: str, timeout: float, max_concurrent: int):
+        self.name = name
+        self.timeout = float(os.getenv(f"{name.upper()}_TIMEOUT_SECONDS", timeout))
+        self.max_concurrent = int(os.getenv(f"{name.upper()}_MAX_CONCURRENT", max_concurrent))
+        self.breaker = CircuitBreaker()
+        self.fault = Fault(**FAULT_INJECTION.get(name, {}))
+        self.in_flight = 0
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._in_flight_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self.max_concurrent, thread_name_prefix=name)
+        _dependencies[name] = self
+
+    def call(self, call_name: str, fn, *args, deadline=_DEFAULT, **kwargs):
+        """
+        Runs fn(*args, **kwargs) under this dependency's policies; `call_name`
+        labels the metrics. `deadline` defaults to the dependency's timeout;
+        `deadline=None` waits as long as it takes (e.g. large uploads), but the
+        bulkhead and circuit breaker still apply.
+        """
+        deadline = self.timeout if deadline is _DEFAULT else deadline
+        # Fail fast before queueing for a slot; the slots may all be held by calls that hung
+        if self.breaker.is_open():
+            rejections.inc(self.name, "circuit_open")
+            raise DependencyUnavailable(self.name, "circuit open", self.breaker.retry_after())
+        if not self._slots.acquire(timeout=BULKHEAD_WAIT_SECONDS):
+            rejections.inc(self.name, "bulkhead_full")
+            raise DependencyUnavailable(self.name, "too many concurrent calls")
+        if not self.breaker.allow():
+            self._slots.release()
+            rejections.inc(self.name, "circuit_open")
+            raise DependencyUnavailable(self.name, "circuit open", self.breaker.retry_after())
+        try:
+            future = self._executor.submit(self._run, call_name, fn, args, kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            result = future.result(timeout=deadline)
+        except FutureTimeout:
+            self.breaker.record(False)
+            rejections.inc(self.name, "timeout")
+            raise DependencyUnavailable(self.name, f"no response within {deadline:g}s")
+        except BaseException as e:
+            self.breaker.record(not is_failure(e))
+            raise
+        self.breaker.record(True)
+        return result
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "timeout_seconds": self.timeout,
+            "fault": self.fault.as_dict(),
+        }
+
+    def _run(self, call_name, fn, args, kwargs):
+        with self._in_flight_lock:
+            self.in_flight += 1
+        try:
+            with metrics.firebase_call(call_name):
+                self.fault.apply(self.name)
+                return fn(*args, **kwargs)
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+    def _release(self, future):
+        self._slots.release()
+
+
+_dependencies: dict[str, Dependency] = {}
+
+
+def get_dependency(name: str) -> Dependency | None:
+    return _dependencies.get(name)
+
+
+def all_dependencies() -> list[Dependency]:
+    return list(_dependencies.values())
+
+
+metrics.Gauge(
+    "dependency_circuit_open", "1 while the dependency's circuit breaker is open or half-open.", ("dependency",),
+    lambda: {(d.name,): int(d.breaker.state != CircuitBreaker.CLOSED) for d in all_dependencies()},
+)
+metrics.Gauge(
+    "dependency_in_flight", "Outbound calls currently running, including ones their caller gave up on.", ("dependency",),
+    lambda: {(d.name,): d.in_flight for d in all_dependencies()},
+)
@@ -0,0 +1,140 @@
+# app/role_claims.py
+"""
+Roles mirrored into Firebase custom claims, so role-only checks can authorize
+from the verified ID token without loading the user from the database.
+
+Each user has a `role_version` that is bumped on every role change. The claims
+carry the role, that version and our user id. A token is trusted only if its
+version is not older than the newest version this instance knows about. Those
+versions come from:
+- role changes committed by this instance,
+- "user.role_changed" events from other instances (through the events broker),
+- on startup, the changes of the last hour (an ID token lives at most an hour,
+  so an older change can't be newer than any token still in use),
+- unless EVENTS_BROKER=postgres, the database: the inprocess and unix brokers
+  don't reach other instances (or `python -m app.manage set-role`), so a uid's
+  role_version is re-read when it was last checked more than
+  ROLE_VERSION_RECHECK_SECONDS ago. That bounds how long another instance's
+  role change goes unnoticed, at one indexed lookup per user per interval.
+
+Tokens without claims (issued before the claims were set) or with a stale
+version fall back to the database user, and the response asks the client to
+refresh its token.
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import events, firebase, jobs, models
+from .database import SessionLocal, after_commit
+
+ROLE_CLAIM = "role"
+ROLE_VERSION_CLAIM = "rv"
+USER_ID_CLAIM = "lms_id"
+ROLE_CHANGED_EVENT = "user.role_changed"
+ID_TOKEN_LIFETIME = timedelta(hours=1)
+# Role changes reach every instance through the postgres broker; otherwise re-read them from the database
+ROLE_VERSION_RECHECK_SECONDS = (
+    0 if events.EVENTS_BROKER == "postgres" else float(os.getenv("ROLE_VERSION_RECHECK_SECONDS", "30"))
+)
+
+# firebase_uid -> newest role_version known to this instance. Only ever grows.
+_latest_versions: dict[str, int] = {}
+# firebase_uid -> time.monotonic() of the last database check (with ROLE_VERSION_RECHECK_SECONDS)
+_checked_at: dict[str, float] = {}
+
+
+class Principal(NamedTuple):
+    """The authenticated caller as far as role checks need to know."""
+    id: int
+    firebase_uid: str
+    role: models.UserRole
+    role_version: int
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(user.id, user.firebase_uid, user.role, user.role_version or 0)
+
+
+def claims_for(user: models.User) -> dict:
+    return {ROLE_CLAIM: user.role.value, ROLE_VERSION_CLAIM: user.role_version or 0, USER_ID_CLAIM: user.id}
+
+
+def principal_from_claims(decoded_token: dict) -> Principal | None:
+    """The principal described by the token's claims, or None if it has none or they are stale."""
+    try:
+        role = models.UserRole(decoded_token[ROLE_CLAIM])
+        version = int(decoded_token[ROLE_VERSION_CLAIM])
+        user_id = int(decoded_token[USER_ID_CLAIM])
+    except (KeyError, TypeError, ValueError):
+        return None
+    uid = decoded_token["uid"]
+    if ROLE_VERSION_RECHECK_SECONDS > 0:
+        _recheck(uid)
+    if _latest_versions.get(uid, -1) > version:
+        return None
+    return Principal(user_id, uid, role, version)
+
+
+def _recheck(uid: str):
+    now = time.monotonic()
+    if now - _checked_at.get(uid, float("-inf")) < ROLE_VERSION_RECHECK_SECONDS:
+        return
+    db = SessionLocal()
+    try:
+        version = db.scalar(select(models.User.role_version).where(models.User.firebase_uid == uid))
+    finally:
+        db.close()
+    if version is not None:
+        note_version(uid, version)
+    _checked_at[uid] = now
+
+
+def note_version(firebase_uid: str, role_version: int):
+    if role_version > _latest_versions.get(firebase_uid, -1):
+        _latest_versions[firebase_uid] = role_version
+
+
+def sync_later(db: Session, user_id: int):
+    """Queues a job (in the caller's transaction) that pushes the user's current claims to Firebase."""
+    jobs.enqueue(db, "sync_role_claims", {"user_id": user_id}, dedupe_key=f"role-claims:{user_id}")
+
+
+def on_role_changed(db: Session, user_id: int, uid: str, version: int):
+    """
+    Called in the transaction that changed a user's role: pushes the new claims to
+    Firebase and tells every instance to distrust older tokens once it commits.
+    """
+    sync_later(db, user_id)
+    # Locally right away; the broker event reaches this instance too, but asynchronously
+    after_commit(db, lambda: note_version(uid, version))
+    events.publish_system_on_commit(db, ROLE_CHANGED_EVENT, firebase_uid=uid, role_version=version)
+
+
+def load_recent_changes():
+    """Seeds the version map with the role changes that could still be in live tokens."""
+    db = SessionLocal()
+    try:
+        since = datetime.now(timezone.utc) - ID_TOKEN_LIFETIME
+        rows = db.execute(
+            select(models.User.firebase_uid, models.User.role_version).where(models.User.role_changed_at >= since)
+        )
+        for uid, version in rows:
+            note_version(uid, version)
+    finally:
+        db.close()
+    if ROLE_VERSION_RECHECK_SECONDS > 0:
+        print(f"WARNING: EVENTS_BROKER={events.EVENTS_BROKER} doesn't reach other instances; role changes made "
+              f"elsewhere are picked up from the database within {ROLE_VERSION_RECHECK_SECONDS:g}s. "
+              "Use EVENTS_BROKER=postgres when running more than one instance.")
+
+
+def set_claims(user: models.User):
+    firebase.set_custom_user_claims(user.firebase_uid, claims_for(user))
+
+
+events.add_listener(ROLE_CHANGED_EVENT, lambda event: note_version(event["firebase_uid"], event["role_version"]))
@@ -0,0 +1,154 @@
+# app/routers/admin.py
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.orm import Session
+
+from .. import admission, audit, events, jobs, models, profiling, resilience, schemas, security
+from ..database import get_db, slow_query_log, SLOW_QUERY_EXPLAIN, SLOW_QUERY_MS
+
+
+router = APIRouter(
+    tags=["Admin"],
+    route_class=profiling.ProfiledRoute
+)
+
+@router.get("/admission", summary="Admission control counters per route class")
+def read_admission_stats(current_admin: security.Principal = Depends(security.get_current_admin_user)):
+    """
+    In-flight, queued, admitted and shed request counts for each route class
+    in this instance. **Requires Admin privileges.**
+    """
+    return admission.snapshot()
+
+@router.get("/jobs", summary="Background job queue status")
+def read_job_stats(
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Job counts per kind and status, plus the most recent failures. **Requires Admin privileges.**
+    """
+    return jobs.queue_stats(db)
+
+@router.get("/events", summary="WebSocket fan-out statistics")
+def read_event_stats(current_admin: security.Principal = Depends(security.get_current_admin_user)):
+    """
+    Connected subscribers and delivered/dropped counts for this instance. **Requires Admin privileges.**
+    """
+    return {"broker": events.EVENTS_BROKER, **events.hub.stats()}
+
+@router.get("/profiles", summary="List recorded request profiles")
+def read_profiles(current_admin: security.Principal = Depends(security.get_current_admin_user)):
+    """
+    Requests profiled on this instance, newest first. Send a request with an
+    `X-Profile: 1` header as an admin to profile it; the response carries an
+    `X-Profile-Id` header. **Requires Admin privileges.**
+    """
+    return profiling.store.list()
+
+@router.get("/profiles/{profile_id}", summary="Get one request profile")
+def read_profile(
+    profile_id: int,
+    format: str = "summary",
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    `format=summary` returns the hottest functions; `format=folded` returns folded
+    stacks for flamegraph.pl or speedscope. **Requires Admin privileges.**
+    """
+    profile = profiling.store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return {**profile.summary(), "top_functions": profile.top_functions()}
+
+
+@router.get("/slow-queries", summary="Recent slow SQL statements")
+def read_slow_queries(
+    limit: int = Query(50, ge=1, le=1000),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Statements on this instance that took longer than SLOW_QUERY_MS, newest first,
+    with the route that ran them and (on Postgres, with SLOW_QUERY_EXPLAIN on)
+    the query plan. **Requires Admin privileges.**
+    """
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "explain": SLOW_QUERY_EXPLAIN,
+        "recorded": slow_query_log.recorded,
+        "queries": slow_query_log.entries(limit),
+    }
+
+@router.delete("/slow-queries", status_code=status.HTTP_204_NO_CONTENT, summary="Clear the slow query log")
+def clear_slow_queries(current_admin: security.Principal = Depends(security.get_current_admin_user)):
+    """
+    Empties the log and the captured plans, e.g. after deploying an index. **Requires Admin privileges.**
+    """
+    slow_query_log.clear()
+
+
+@router.get("/dependencies", summary="Circuit breaker and bulkhead state of outbound dependencies")
+def read_dependencies(current_admin: security.Principal = Depends(security.get_current_admin_user)):
+    """
+    Per dependency: circuit state, consecutive failures, calls in flight and
+    the configured limits. **Requires Admin privileges.**
+    """
+    return {
+        "fault_injection_allowed": resilience.ALLOW_FAULT_INJECTION,
+        "dependencies": [dependency.status() for dependency in resilience.all_dependencies()],
+    }
+
+@router.put("/dependencies/{name}/fault", summary="Inject latency / errors into a dependency (testing)")
+def inject_fault(
+    name: str,
+    fault: schemas.FaultInjection,
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Makes every call to the dependency wait `latency` seconds and fail with
+    probability `error_rate` (both 0 turns it off). Only available with
+    ALLOW_FAULT_INJECTION=true. **Requires Admin privileges.**
+    """
+    if not resilience.ALLOW_FAULT_INJECTION:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Fault injection is disabled (ALLOW_FAULT_INJECTION)")
+    dependency = resilience.get_dependency(name)
+    if dependency is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown dependency")
+    dependency.fault = resilience.Fault(fault.latency, fault.error_rate)
+    return dependency.status()
+
+@router.get("/audit", response_model=schemas.AuditEventPage, summary="Search the audit log")
+def read_audit_events(
+    actor_id: int | None = None,
+    course_id: int | None = None,
+    action: str | None = Query(None, description="e.g. enrollment.created, course.deleted, user.role_changed"),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    before_id: int | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Audited mutations, newest first, filtered by actor, course, action and
+    time range. Pass `next_before_id` back as `before_id` for older events.
+    Events are written in batches, so the last few seconds may be missing.
+    **Requires Admin privileges.**
+    """
+    rows, next_before_id = audit.query_events(
+        db, actor_id=actor_id, course_id=course_id, action=action, since=since, until=until,
+        before_id=before_id, limit=limit,
+    )
+    return {"events": rows, "next_before_id": next_before_id}
+
+@router.get("/audit/status", summary="Audit log buffer state")
+def read_audit_status(current_admin: security.Principal = Depends(security.get_current_admin_user)):
+    """
+    Events buffered in this instance, spill files waiting on disk and the last
+    flush error. **Requires Admin privileges.**
+    """
+    return audit.status()
@@ -4,18 +4,19 @@ import requests
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from firebase_admin import auth
 
-from .. import schemas, crud
+from .. import schemas, crud, firebase, jobs, profiling, resilience, role_claims
 from ..database import get_db
 
 
 router = APIRouter(
-    tags=["Authentication"]
+    tags=["Authentication"],
+    route_class=profiling.ProfiledRoute
 )
 
 FIREBASE_WEB_API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
-if not FIREBASE_WEB_API_KEY:
+# Not used in emulator mode, where sign-in is answered in process
+if not FIREBASE_WEB_API_KEY and not firebase.EMULATOR:
     raise ValueError("FIREBASE_WEB_API_KEY environment variable not set")
 
 @router.post("/signup", response_model=schemas.User, status_code=status.HTTP_201_CREATED)
@@ -25,17 +26,12 @@ def create_user_in_db(user_data: schemas.UserCreate, db: Session = Depends(get_d
     This endpoint is called AFTER the user has already been created in Firebase
     by the frontend. It syncs the user into our PostgreSQL database.
     """
-    # Check if a user with this email or Firebase UID already exists in our local DB
-    db_user_by_email = crud.get_user_by_email(db, email=user_data.email)
-    if db_user_by_email:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered in our database.")
-    
-    db_user_by_uid = crud.get_user_by_firebase_uid(db, firebase_uid=user_data.firebase_uid)
-    if db_user_by_uid:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Firebase UID already exists in our database.")
-
-    # If checks pass, create the user in our local database.
+    # A single INSERT ... ON CONFLICT DO NOTHING; no row back means the email or UID is taken.
     new_user = crud.create_db_user(db=db, firebase_uid=user_data.firebase_uid, email=user_data.email)
+    if new_user is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email or Firebase UID already registered in our database.")
+    role_claims.sync_later(db, new_user["id"])
+    db.commit()
     return new_user
 
 
@@ -47,19 +43,12 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     try:
         # Use Firebase Auth REST API to sign in with email and password
-        rest_api_url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_WEB_API_KEY}"
-        payload = {
-            "email": form_data.username,
-            "password": form_data.password,
-            "returnSecureToken": True
-        }
-        response = requests.post(rest_api_url, json=payload)
-        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-        
-        token_data = response.json()
+        token_data = firebase.sign_in_with_password(FIREBASE_WEB_API_KEY, form_data.username, form_data.password)
         return {"id_token": token_data["idToken"]}
 
     except requests.exceptions.HTTPError as e:
+        if resilience.is_failure(e):
+            raise resilience.DependencyUnavailable(firebase.IDENTITY_TOOLKIT.name, f"HTTP {e.response.status_code}")
         # Extract Firebase's error message
         error_json = e.response.json().get("error", {})
         error_message = error_json.get("message", "Invalid credentials")
@@ -70,23 +59,15 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
         )
 
 @router.post("/forgot-password", status_code=status.HTTP_200_OK)
-def forgot_password(request: schemas.PasswordResetRequest):
+def forgot_password(request: schemas.PasswordResetRequest, db: Session = Depends(get_db)):
     """
     Triggers the Firebase password reset email flow.
+    The link is generated by a background job, so the response doesn't wait on Firebase.
     """
-    try:
-        email = request.email
-        link = auth.generate_password_reset_link(email)
-        print(f"Password reset link generated for {email}: {link}") # For debugging ONLY.
-        return {"message": "If an account with this email exists, a password reset link has been sent."}
-    except auth.UserNotFoundError:
-        return {"message": "If an account with this email exists, a password reset link has been sent."}
-    except Exception as e:
-        print(f"An unexpected error occurred during password reset: {e}") # For debugging
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="An error occurred while processing the request."
-        )
+    # Repeated requests for the same address collapse into one pending job
+    jobs.enqueue(db, "send_password_reset", {"email": request.email}, dedupe_key=f"password-reset:{request.email.lower()}")
+    db.commit()
+    return {"message": "If an account with this email exists, a password reset link has been sent."}
     
 
 
@@ -105,8 +86,6 @@ def forgot_password(request: schemas.PasswordResetRequest):
 
 
 
-
-
 
 
 # # app/routers/auth.py
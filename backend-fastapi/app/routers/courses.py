@@ -1,23 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
 
-from .. import schemas, crud, models, security
+from .. import schemas, crud, models, security, storage, blob_cache, course_import, events, exports, idempotency, ingestion, material_sync, profiling, resilience, terms
+from ..singleflight import SingleFlight
 from ..database import get_db
 
-from firebase_admin import storage
+import csv
 import uuid
 from datetime import timedelta
 
 router = APIRouter(
-    tags=["Courses & Enrollments"]
+    tags=["Courses & Enrollments"],
+    route_class=profiling.ProfiledRoute
 )
 
-@router.post("/", response_model=schemas.Course, status_code=status.HTTP_201_CREATED)
+# Concurrent identical reads share one computation (see app/singleflight.py).
+# Reused results are dropped when a change event arrives from any instance.
+course_list_reads = SingleFlight("course_list")
+material_list_reads = SingleFlight("course_materials")
+
+for _event_type in ("course.created", "course.updated", "course.deleted", "course.instructor_changed", "term.created", "term.updated"):
+    events.add_listener(_event_type, lambda event: course_list_reads.clear())
+for _event_type in ("material.created", "material.deleted", "material.ingested", "course.deleted"):
+    events.add_listener(_event_type, lambda event: material_list_reads.forget(event["course_id"]))
+
+@router.post("/", response_model=schemas.Course, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(idempotency.idempotent)])
 def create_new_course(
     course: schemas.CourseCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_course_creator)
+    current_user: security.Principal = Depends(security.get_current_course_creator)
 ):
     """
     Create a new course. **Requires Admin or Instructor privileges.**
@@ -26,10 +40,70 @@ def create_new_course(
 
 
 @router.get("/", response_model=List[schemas.Course])
-def read_all_courses(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Retrieve a list of all courses. This is a public endpoint."""
-    courses = crud.get_courses(db, skip=skip, limit=limit)
-    return courses
+def read_all_courses(
+    skip: int = 0,
+    limit: int = 100,
+    term_id: int | None = Query(None, description="Only this term's courses (also closed and archived terms)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve a list of courses. This is a public endpoint.
+    - By default: the courses of upcoming and active terms, and courses without a term.
+    """
+    return course_list_reads.do(
+        (skip, limit, term_id),
+        lambda: [schemas.Course.model_validate(course) for course in crud.get_courses(db, skip=skip, limit=limit, term_id=term_id)]
+    )
+
+@router.post("/import", response_model=schemas.CourseImportReport, summary="Bulk-import courses (CSV / JSON)")
+def import_courses(
+    file: UploadFile = File(..., description="A JSON array of courses, or a CSV file with a header row."),
+    import_format: str | None = Query(None, alias="format", pattern="^(csv|json)$"),
+    dry_run: bool = False,
+    batch_size: int = Query(course_import.IMPORT_BATCH_SIZE, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Create many courses at once, e.g. for a new term. **Requires Admin privileges.**
+    - Columns: `title` (required), `description`, `capacity`, `owner_id` or `owner_email`
+      (defaults to you), `term_id` or `term` (a term code) and `clone_from` (a course id
+      whose materials are copied).
+    - The format is taken from the file name unless `format` is given.
+    - With `dry_run` the rows are only validated.
+    - Returns one report entry per row; invalid rows don't stop the others.
+    """
+    import_format = import_format or ("json" if (file.filename or "").lower().endswith(".json") else "csv")
+    data = file.file.read(course_import.MAX_IMPORT_BYTES + 1)
+    if len(data) > course_import.MAX_IMPORT_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Import file is too large")
+    try:
+        return course_import.import_courses(db, data, import_format, current_admin.id, batch_size=batch_size, dry_run=dry_run)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Could not read the import file: {e}")
+
+@router.get("/export/enrollments", summary="Export all enrollments (CSV / NDJSON)")
+def export_all_enrollments(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    term_id: int | None = Query(None, description="Only this term's enrollments; required for archived terms"),
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Stream the enrollments of every term that isn't archived (or of one term) as CSV or NDJSON.
+    - **Requires Admin privileges.**
+    """
+    archived = False
+    if term_id is not None:
+        term = db.get(models.Term, term_id)
+        if term is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Term not found")
+        archived = term.status == models.TermStatus.archived
+    return StreamingResponse(
+        exports.enrollment_export(None, export_format, term_id=term_id, archived=archived),
+        media_type=exports.MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="enrollments.{export_format}"'},
+    )
 
 @router.get("/{course_id}", response_model=schemas.Course)
 def read_single_course(course_id: int, db: Session = Depends(get_db)):
@@ -44,50 +118,34 @@ def update_existing_course(
     course_id: int,
     course_update: schemas.CourseCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user)
+    current_user: security.Principal = Depends(security.get_current_principal)
 ):
-    
-    db_course = crud.get_course(db, course_id)
-    if db_course is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
-
-    is_admin = current_user.role == models.UserRole.admin
-    is_owner = db_course.owner_id == current_user.id
-
-    if not (is_admin or is_owner):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to update this course")
-
-    return crud.update_course(db, course_id=course_id, course_update=course_update)
+    """
+    Update a course.
+    - **Admins** can update any course.
+    - **Instructors** can only update courses they own.
+    """
+    return crud.update_course(db, course_id=course_id, course_update=course_update, actor=current_user)
 
 @router.delete("/{course_id}", response_model=schemas.Course)
 def delete_existing_course(
     course_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user)
+    current_user: security.Principal = Depends(security.get_current_principal)
 ):
     """
     Delete a course.
     - **Admins** can delete any course.
     - **Instructors** can only delete courses they own.
     """
-    db_course = crud.get_course(db, course_id)
-    if db_course is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
-
-    is_admin = current_user.role == models.UserRole.admin
-    is_owner = db_course.owner_id == current_user.id
-
-    if not (is_admin or is_owner):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this course")
-
-    crud.delete_course(db, course_id=course_id)
-    return db_course
+    return crud.delete_course(db, course_id=course_id, actor=current_user)
 
 @router.post(
     "/{course_id}/materials",
     response_model=schemas.CourseMaterial,
     status_code=status.HTTP_201_CREATED,
-    summary="Upload a new course material"
+    summary="Upload a new course material",
+    dependencies=[Depends(idempotency.idempotent)]
 )
 def upload_course_material(
     course_id: int,
@@ -101,11 +159,9 @@ def upload_course_material(
     - **Requires Admin or Instructor (owner) privileges.**
     """
     try:
-        bucket = storage.bucket()
         file_extension = file.filename.split('.')[-1]
         file_path = f"courses/{course_id}/materials/{uuid.uuid4()}.{file_extension}"
-        blob = bucket.blob(file_path)
-        blob.upload_from_file(file.file, content_type=file.content_type)
+        storage.get_storage().put(file_path, file.file, file.content_type)
         db_material = crud.create_course_material(
             db=db,
             course_id=course_id,
@@ -114,6 +170,8 @@ def upload_course_material(
             content_type=file.content_type
         )
         return db_material
+    except resilience.DependencyUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to upload file: {e}")
 
@@ -132,27 +190,225 @@ def view_course_materials(
     - **Requires Admin, Instructor (owner), or enrolled Student privileges.**
     - Returns temporary, secure download URLs for each file.
     """
+    # Access was checked per caller by get_course_viewer; the listing and URL signing are shared
+    return material_list_reads.do(course_id, lambda: _materials_with_urls(db, course_id))
+
+def _url_signer():
+    """
+    Returns sign(file_path) -> download URL. If the storage backend can't sign,
+    it returns None instead, and stops trying for the rest of the response:
+    materials are still listed, just without links.
+    """
+    backend = storage.get_storage()
+    can_sign = True
+
+    def sign(file_path: str) -> str | None:
+        nonlocal can_sign
+        if not can_sign:
+            return None
+        try:
+            return backend.signed_url(file_path, timedelta(hours=1))
+        except Exception as e:
+            if not resilience.is_unavailable(e):
+                raise
+            can_sign = False
+            resilience.fallbacks.inc("storage", "materials_without_urls")
+            return None
+    return sign
+
+def _materials_with_urls(db: Session, course_id: int) -> list[schemas.CourseMaterialWithUrl]:
     db_materials = crud.get_materials_for_course(db, course_id=course_id)
     response_materials = []
-    bucket = storage.bucket()
+    sign = _url_signer()
     for material in db_materials:
-        blob = bucket.blob(material.file_path)
-        download_url = blob.generate_signed_url(version="v4", expiration=timedelta(hours=1))
+        download_url = sign(material.file_path)
         material_with_url = schemas.CourseMaterialWithUrl(
             id=material.id,
             title=material.title,
             content_type=material.content_type,
             created_at=material.created_at,
+            size_bytes=material.size_bytes,
+            page_count=material.page_count,
+            checksum=material.checksum,
+            ingest_status=material.ingest_status,
             download_url=download_url
         )
         response_materials.append(material_with_url)
     return response_materials
 
-@router.post("/{course_id}/enroll", status_code=status.HTTP_201_CREATED)
+@router.get(
+    "/{course_id}/materials/changes",
+    response_model=schemas.MaterialChanges,
+    summary="Materials created or deleted since a cursor"
+)
+def view_course_material_changes(
+    course_id: int,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_course_viewer)
+):
+    """
+    Delta sync for a course's materials.
+    - **Requires Admin, Instructor (owner), or enrolled Student privileges.**
+    - Without `cursor`: the current materials. With it: only the materials created
+      or deleted since (deleted ones have `deleted: true`).
+    - Keep requesting with the returned `cursor` while `has_more` is true, then
+      store it for the next visit. Changes may be repeated; apply them by `id`.
+    - `410 Gone` means the cursor is too old; start over without one.
+    """
+    rows, next_cursor, has_more = material_sync.changes_since(db, course_id, cursor, limit)
+    sign = _url_signer()
+    changes = [
+        schemas.MaterialChange(
+            id=material.id,
+            title=material.title,
+            content_type=material.content_type,
+            created_at=material.created_at,
+            size_bytes=material.size_bytes,
+            page_count=material.page_count,
+            checksum=material.checksum,
+            ingest_status=material.ingest_status,
+            updated_at=material.updated_at,
+            deleted=material.deleted_at is not None,
+            download_url=None if material.deleted_at is not None else sign(material.file_path),
+        )
+        for material in rows
+    ]
+    return {"changes": changes, "cursor": next_cursor, "has_more": has_more}
+
+@router.get(
+    "/{course_id}/materials/search",
+    response_model=List[schemas.MaterialSearchHit],
+    summary="Search inside a course's materials"
+)
+def search_course_materials(
+    course_id: int,
+    q: str = Query(..., min_length=2, max_length=200, description="Words to look for in the materials' text."),
+    limit: int = Query(20, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_course_viewer)
+):
+    """
+    Full-text search over the text extracted from the course's materials (PDFs,
+    slides, documents, text files), best matches first.
+    - **Requires Admin, Instructor (owner), or enrolled Student privileges.**
+    - Materials are searchable once ingested, usually seconds after upload.
+    - Each hit has a `snippet` with the matching words wrapped in `**`.
+    """
+    sign = _url_signer()
+    return [
+        schemas.MaterialSearchHit(**hit, download_url=sign(hit["file_path"]))
+        for hit in ingestion.search_materials(db, course_id, q, limit)
+    ]
+
+@router.delete(
+    "/{course_id}/materials/{material_id}",
+    response_model=schemas.CourseMaterial,
+    summary="Delete a course material"
+)
+def delete_course_material(
+    course_id: int,
+    material_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.Course = Depends(security.get_course_owner_or_admin)
+):
+    """
+    Delete a material and its file.
+    - **Requires Admin or Instructor (owner) privileges.**
+    """
+    db_material = crud.get_material(db, material_id)
+    if db_material is None or db_material.course_id != course_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Material not found")
+    deleted = crud.delete_material(db, material_id)
+    if deleted is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Material not found")
+    return deleted
+
+@router.get(
+    "/{course_id}/materials/{material_id}/download",
+    summary="Download a course material",
+    responses={206: {"description": "Partial content"}, 304: {"description": "Not modified"}},
+)
+def download_course_material(
+    course_id: int,
+    material_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_course_viewer)
+):
+    """
+    Stream a material's file through the API.
+    - **Requires Admin, Instructor (owner), or enrolled Student privileges.**
+    - Supports `Range` requests (resumable downloads, video seeking) and `If-None-Match`.
+    - Files are served from a local LRU cache; cold files are fetched from storage once.
+    """
+    db_material = crud.get_material(db, material_id)
+    if db_material is None or db_material.course_id != course_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Material not found")
+
+    backend = storage.get_storage()
+    local_path = backend.local_path(db_material.file_path)
+    file, info = None, None
+    try:
+        if local_path is not None:
+            info = backend.stat(db_material.file_path)
+            if info is not None:
+                file = open(local_path, "rb")
+        else:
+            file, info = blob_cache.get_cache().open(backend, db_material.file_path)
+    except FileNotFoundError:
+        info = None
+    except blob_cache.BlobTooLarge as e:
+        info = e.info
+    if info is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Material file not found in storage")
+
+    etag = f'"{info.etag}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "private, max-age=3600"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        if file is not None:
+            file.close()
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # A Range is only honoured if the client's copy (If-Range) is still current
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        range_header = None
+    try:
+        byte_range = storage.parse_byte_range(range_header, info.size)
+    except ValueError:
+        if file is not None:
+            file.close()
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{info.size}"},
+        )
+
+    start, end = byte_range if byte_range else (0, info.size - 1)
+    status_code = status.HTTP_200_OK
+    if byte_range:
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+
+    media_type = db_material.content_type or info.content_type
+    if file is not None:
+        return storage.SendfileResponse(file, offset=start, count=end - start + 1, status_code=status_code,
+                                        headers=headers, media_type=media_type)
+    # Too big for the cache: stream straight from storage
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(backend.open(db_material.file_path, start, end), status_code=status_code,
+                             headers=headers, media_type=media_type)
+
+@router.post("/{course_id}/enroll", status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(idempotency.idempotent)])
 def enroll_in_course(
     course_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user)
+    current_user: security.Principal = Depends(security.get_current_principal)
 ):
     """
     Enroll the current authenticated user (student) in a course.
@@ -166,7 +422,7 @@ def assign_instructor(
     course_id: int,
     request: schemas.AssignInstructorRequest,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(security.get_current_admin_user)
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
 ):
     """
     Assign a new instructor to a course. **Requires Admin privileges.**
@@ -175,11 +431,44 @@ def assign_instructor(
         db=db, course_id=course_id, instructor_id=request.instructor_id
     )
 
+@router.post("/{course_id}/clone", response_model=schemas.CourseCloneResult, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(idempotency.idempotent)])
+def clone_existing_course(
+    course_id: int,
+    request: schemas.CourseClone,
+    db: Session = Depends(get_db),
+    source: models.Course = Depends(security.get_course_owner_or_admin),
+    current_user: security.Principal = Depends(security.get_current_principal)
+):
+    """
+    Copy a course and its materials into a new course (without enrollments).
+    - **Requires Admin or Instructor (owner) privileges.**
+    - Only admins can give the copy a different owner.
+    - `term_id` puts the copy in another open term (by default the source's term).
+    """
+    owner_id = request.owner_id or current_user.id
+    if owner_id != current_user.id:
+        if current_user.role != models.UserRole.admin:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can assign the copy to someone else")
+        owner = db.get(models.User, owner_id)
+        if owner is None or owner.role not in course_import.COURSE_CREATORS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The new owner must be an instructor or admin")
+    result = course_import.clone_course(
+        db, source, owner_id, title=request.title, include_materials=request.include_materials, term_id=request.term_id,
+    )
+    if result["status"] != "created":
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=result["error"])
+    return {
+        "course": crud.get_course(db, course_id=result["course_id"]),
+        "materials_copied": result["materials_copied"],
+        "materials_failed": result["materials_failed"],
+    }
+
 @router.get("/{course_id}/students", response_model=List[schemas.Student])
 def view_enrolled_students(
     course_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(security.get_current_user)
+    current_user: security.Principal = Depends(security.get_current_principal)
 ):
     """
     View a list of students enrolled in a specific course.
@@ -198,6 +487,35 @@ def view_enrolled_students(
     students = crud.get_students_for_course(db, course_id=course_id)
     return students
 
+@router.get("/{course_id}/students/export", summary="Export a course roster (CSV / NDJSON)")
+def export_enrolled_students(
+    course_id: int,
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    db: Session = Depends(get_db),
+    current_user: security.Principal = Depends(security.get_current_principal)
+):
+    """
+    Stream the roster of a course as CSV or NDJSON, without loading it into memory.
+    - **Requires Admin or Instructor privileges.**
+    """
+    db_course = crud.get_course(db, course_id)
+    if db_course is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Course not found")
+
+    allowed_roles = [models.UserRole.admin, models.UserRole.instructor]
+    if current_user.role not in allowed_roles:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only Admins and Instructors can view enrolled students."
+        )
+    return StreamingResponse(
+        exports.enrollment_export(
+            course_id, export_format, term_id=terms.partition_key(db_course.term_id), archived=terms.is_archived(db_course),
+        ),
+        media_type=exports.MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="course-{course_id}-roster.{export_format}"'},
+    )
+
 
 
 
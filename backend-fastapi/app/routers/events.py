@@ -0,0 +1,112 @@
+# app/routers/events.py
+import asyncio
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+
+from .. import crud, events, firebase, models, role_claims, security
+from ..database import SessionLocal
+
+
+router = APIRouter(
+    tags=["Events"]
+)
+
+MAX_SUBSCRIPTIONS = 200
+
+@router.websocket("/ws")
+async def course_events(websocket: WebSocket, token: str):
+    """
+    Push channel for course changes. Connect with `?token=<Firebase ID token>`, then send
+    `{"action": "subscribe", "course_ids": [1, 2]}` and
+    `{"action": "unsubscribe", "course_ids": [...]}`. Events look like
+    `{"type": "enrollment.created", "course_id": 1, "enrollment_count": 12, ...}`.
+    A `{"type": "resync"}` event means some events were dropped and the client should refetch.
+    - Users can subscribe to the courses they may view (owned or enrolled in); admins
+      to any course, or to `"*"` for the whole catalog. Other ids are answered with an error.
+    - Messages that aren't JSON objects close the connection (1003).
+    """
+    try:
+        principal = await run_in_threadpool(_principal, token)
+    except Exception:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid Firebase ID token")
+        return
+    if principal is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="User not found in our database")
+        return
+    await websocket.accept()
+
+    subscriber = events.Subscriber()
+    sender = asyncio.create_task(_send_events(websocket, subscriber))
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if not isinstance(message, dict):
+                await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Messages must be JSON objects")
+                return
+            course_ids = message.get("course_ids") or []
+            if not isinstance(course_ids, list):
+                course_ids = [course_ids]
+            course_ids = [c for c in course_ids if c == events.ALL_COURSES or (isinstance(c, int) and not isinstance(c, bool))]
+            if message.get("action") == "subscribe":
+                if len(subscriber.course_ids) + len(course_ids) > MAX_SUBSCRIPTIONS:
+                    await websocket.send_json({"type": "error", "detail": f"At most {MAX_SUBSCRIPTIONS} subscriptions per connection"})
+                    continue
+                allowed = await run_in_threadpool(_allowed, principal, course_ids)
+                denied = [c for c in course_ids if c not in allowed]
+                if denied:
+                    await websocket.send_json({"type": "error", "detail": "Not allowed to subscribe to these courses", "course_ids": denied})
+                events.hub.subscribe(subscriber, [c for c in course_ids if c in allowed])
+            elif message.get("action") == "unsubscribe":
+                events.hub.unsubscribe(subscriber, course_ids)
+            await websocket.send_json({"type": "subscriptions", "course_ids": sorted(subscriber.course_ids, key=str)})
+    except WebSocketDisconnect:
+        pass
+    except ValueError:
+        await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Messages must be JSON objects")
+    finally:
+        events.hub.unsubscribe(subscriber)
+        sender.cancel()
+
+
+def _principal(token: str) -> role_claims.Principal | None:
+    decoded_token = firebase.verify_id_token(token)
+    principal = role_claims.principal_from_claims(decoded_token)
+    if principal is not None:
+        return principal
+    db = SessionLocal()
+    try:
+        user = crud.get_user_by_firebase_uid(db, firebase_uid=decoded_token["uid"])
+        return role_claims.Principal.from_user(user) if user else None
+    finally:
+        db.close()
+
+
+def _allowed(principal: role_claims.Principal, course_ids: list) -> set:
+    """The requested ids the principal may subscribe to; the whole catalog is for admins only."""
+    allowed = set()
+    if events.ALL_COURSES in course_ids and principal.role == models.UserRole.admin:
+        allowed.add(events.ALL_COURSES)
+    db = SessionLocal()
+    try:
+        return allowed | security.viewable_course_ids(db, principal, [c for c in course_ids if c != events.ALL_COURSES])
+    finally:
+        db.close()
+
+
+async def _send_events(websocket: WebSocket, subscriber: events.Subscriber):
+    disconnect = asyncio.create_task(subscriber.disconnect.wait())
+    try:
+        while True:
+            next_event = asyncio.create_task(subscriber.queue.get())
+            done, _ = await asyncio.wait({next_event, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                next_event.cancel()
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Client is too slow")
+                return
+            await websocket.send_json(next_event.result())
+            subscriber.delivered()
+    except Exception:
+        pass
+    finally:
+        disconnect.cancel()
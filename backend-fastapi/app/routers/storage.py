@@ -0,0 +1,24 @@
+# app/routers/storage.py
+from fastapi import APIRouter, HTTPException, status
+
+from .. import profiling, storage
+
+
+router = APIRouter(
+    tags=["Storage"],
+    route_class=profiling.ProfiledRoute
+)
+
+@router.get("/{path:path}", summary="Download a blob through a signed URL (local storage backend only)")
+def read_signed_blob(path: str, expires: int, signature: str):
+    """
+    Serves a file from the local storage backend. The `expires` and `signature`
+    query parameters come from a URL produced by `LocalStorage.signed_url`.
+    """
+    backend = storage.get_storage()
+    if not backend.verify_signature(path, expires, signature):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired signature")
+    info = backend.stat(path)
+    if info is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    return storage.SendfileResponse(backend.local_path(path), media_type=info.content_type, headers={"ETag": f'"{info.etag}"'})
@@ -0,0 +1,57 @@
+# app/routers/terms.py
+from typing import List
+
+from fastapi import APIRouter, Depends, status
+from sqlalchemy.orm import Session
+
+from .. import models, profiling, schemas, security, terms
+from ..database import get_db
+
+
+router = APIRouter(
+    tags=["Terms"],
+    route_class=profiling.ProfiledRoute
+)
+
+@router.get("/", response_model=List[schemas.Term])
+def read_terms(include_archived: bool = False, db: Session = Depends(get_db)):
+    """List the terms, latest first. This is a public endpoint."""
+    return terms.get_terms(db, include_archived=include_archived)
+
+@router.post("/", response_model=schemas.Term, status_code=status.HTTP_201_CREATED)
+def create_new_term(
+    term: schemas.TermCreate,
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Create a term (upcoming or active). **Requires Admin privileges.**
+    """
+    return terms.create_term(db, term)
+
+@router.patch("/{term_id}", response_model=schemas.Term)
+def update_existing_term(
+    term_id: int,
+    changes: schemas.TermUpdate,
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Rename, reschedule, open or close a term. **Requires Admin privileges.**
+    - Closing a term stops enrollments and hides its courses from the default catalog listing.
+    - Closed terms are archived TERM_ARCHIVE_AFTER_DAYS later; until then they can be reopened.
+    """
+    return terms.update_term(db, term_id, changes)
+
+@router.post("/{term_id}/archive", response_model=schemas.TermArchiveResult)
+def archive_existing_term(
+    term_id: int,
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Archive a closed term now: its enrollments move to the archive tables,
+    where rosters and exports still find them. **Requires Admin privileges.**
+    """
+    moved = terms.archive_term(db, term_id)
+    return {"term": db.get(models.Term, term_id), "enrollments_archived": moved}
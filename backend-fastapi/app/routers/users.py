@@ -1,27 +1,64 @@
 # app/routers/users.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from typing import List
-from .. import schemas, models, security, crud
+from .. import schemas, models, security, crud, profiling
 from ..database import get_db
 
 
 router = APIRouter(
-    tags=["Users"]
+    tags=["Users"],
+    route_class=profiling.ProfiledRoute
 )
 
 @router.get("/", response_model=List[schemas.User], summary="Get all users (for Admins)")
 def read_all_users(
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(security.get_current_admin_user)
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
 ):
     """
     Retrieve a list of all users. **Requires Admin privileges.**
-    This is used to populate the 'Assign Instructor' dropdown.
+    Returns the first 100 users; use /users/directory to search and page
+    through the directory.
     """
     users = crud.get_users(db=db)
     return users
 
+@router.get("/directory", response_model=schemas.UserDirectoryPage, summary="Search users by role and email (for Admins)")
+def search_user_directory(
+    role: models.UserRole | None = None,
+    email_prefix: str | None = Query(None, max_length=254),
+    cursor: str | None = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Search users by role and (case-insensitive) email prefix, in email order.
+    Returns at most `limit` users; pass `next_cursor` back as `cursor` for the
+    next page. This is what the 'Assign Instructor' search uses.
+    **Requires Admin privileges.**
+    """
+    rows, next_cursor = crud.search_users(db, role=role, email_prefix=email_prefix, cursor=cursor, limit=limit)
+    return {"users": rows, "next_cursor": next_cursor}
+
+@router.patch("/{user_id}/role", response_model=schemas.User, summary="Change a user's role (for Admins)")
+def change_user_role(
+    user_id: int,
+    request: schemas.RoleUpdate,
+    db: Session = Depends(get_db),
+    current_admin: security.Principal = Depends(security.get_current_admin_user)
+):
+    """
+    Change a user's role. The role is mirrored into the user's Firebase custom
+    claims; tokens issued before the change are no longer trusted for role
+    checks. **Requires Admin privileges.**
+    """
+    db_user = crud.update_user_role(db=db, user_id=user_id, role=request.role)
+    if db_user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return db_user
+
 @router.get("/me", response_model=schemas.UserWithEnrollments, summary="Get current user's profile with enrollments")
 def see_profile(current_user: models.User = Depends(security.get_current_user)):
     """
@@ -1,8 +1,8 @@
 # app/schemas.py
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import List
-from .models import UserRole
-from datetime import datetime
+from .models import TermStatus, UserRole
+from datetime import date, datetime
 
 # --- User Schemas ---
 class UserBase(BaseModel):
@@ -19,22 +19,108 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class RoleUpdate(BaseModel):
+    role: UserRole
+
+class UserDirectoryEntry(BaseModel):
+    id: int
+    email: str
+    role: UserRole
+
+    class Config:
+        from_attributes = True
+
+class UserDirectoryPage(BaseModel):
+    users: List[UserDirectoryEntry]
+    # Pass back as `cursor` for the next page; None on the last page
+    next_cursor: str | None = None
+
 # --- Course Schemas ---
 class CourseBase(BaseModel):
     title: str
     description: str | None = None
     capacity: int | None = None
+    # None for courses outside the term calendar
+    term_id: int | None = None
 
 class CourseCreate(CourseBase):
     pass
 
+class CourseStats(BaseModel):
+    enrollment_count: int = 0
+    material_count: int = 0
+    fill_ratio: float | None = None
+
+    class Config:
+        from_attributes = True
+
 class Course(CourseBase):
     id: int
     owner_id: int
+    stats: CourseStats | None = None
 
     class Config:
         from_attributes = True
 
+class CourseClone(BaseModel):
+    title: str | None = None
+    # Admins only; defaults to the caller
+    owner_id: int | None = None
+    include_materials: bool = True
+    # Defaults to the source course's term, e.g. pass next term's id to roll a course over
+    term_id: int | None = None
+
+class CourseImportRow(BaseModel):
+    row: int
+    status: str
+    course_id: int | None = None
+    materials_copied: int = 0
+    # Ids of source materials whose file could not be copied
+    materials_failed: List[int] = []
+    error: str | None = None
+
+class CourseImportReport(BaseModel):
+    dry_run: bool = False
+    created: int
+    failed: int
+    rows: List[CourseImportRow]
+
+class CourseCloneResult(BaseModel):
+    course: Course
+    materials_copied: int
+    materials_failed: List[int] = []
+
+# --- Term Schemas ---
+class TermBase(BaseModel):
+    name: str
+    starts_on: date | None = None
+    ends_on: date | None = None
+
+class TermCreate(TermBase):
+    code: str = Field(min_length=1, max_length=32)
+    status: TermStatus = TermStatus.upcoming
+
+class TermUpdate(BaseModel):
+    name: str | None = None
+    starts_on: date | None = None
+    ends_on: date | None = None
+    # upcoming, active or closed; terms are archived by the archival job
+    status: TermStatus | None = None
+
+class Term(TermBase):
+    id: int
+    code: str
+    status: TermStatus
+    closed_at: datetime | None = None
+    archived_at: datetime | None = None
+
+    class Config:
+        from_attributes = True
+
+class TermArchiveResult(BaseModel):
+    term: Term
+    enrollments_archived: int
+
 # --- Auth Schemas ---
 class Token(BaseModel):
     id_token: str
@@ -63,6 +149,11 @@ class CourseMaterial(CourseMaterialBase):
     id: int
     content_type: str
     created_at: datetime
+    # Filled in shortly after upload by the ingestion job; None until then
+    size_bytes: int | None = None
+    page_count: int | None = None
+    checksum: str | None = None
+    ingest_status: str | None = None
     
     class Config:
         from_attributes = True
@@ -70,7 +161,47 @@ class CourseMaterial(CourseMaterialBase):
 # This special schema will be used for the "View Materials" response.
 # It includes the temporary, secure download URL we will generate.
 class CourseMaterialWithUrl(CourseMaterial):
-    download_url: str
+    # None while the storage backend can't sign URLs; the file is still available through .../download
+    download_url: str | None = None
+
+class MaterialChange(CourseMaterial):
+    updated_at: datetime
+    deleted: bool = False
+    # None for deleted materials (and while URLs can't be signed)
+    download_url: str | None = None
+
+class MaterialSearchHit(CourseMaterialWithUrl):
+    # An excerpt of the material's text with the matches wrapped in **
+    snippet: str
+    # Relevance (Postgres full-text rank); None where results are newest first
+    rank: float | None = None
+
+class MaterialChanges(BaseModel):
+    changes: List[MaterialChange]
+    # Pass back as ?cursor= to get the changes after these
+    cursor: str
+    has_more: bool
 
 class UserWithEnrollments(User): # It inherits all fields from the User schema
-    enrolled_course_ids: List[int] = []
\ No newline at end of file
+    enrolled_course_ids: List[int] = []
+
+class FaultInjection(BaseModel):
+    latency: float = Field(0, ge=0, le=120)
+    error_rate: float = Field(0, ge=0, le=1)
+
+class AuditEvent(BaseModel):
+    id: int
+    occurred_at: datetime
+    action: str
+    actor_id: int | None = None
+    course_id: int | None = None
+    route: str | None = None
+    details: dict
+
+    class Config:
+        from_attributes = True
+
+class AuditEventPage(BaseModel):
+    events: List[AuditEvent]
+    # Pass back as `before_id` for the next (older) page; None on the last page
+    next_before_id: int | None = None
@@ -1,38 +1,64 @@
 # app/security.py
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import exists, or_, select
 from sqlalchemy.orm import Session
 import firebase_admin
 from firebase_admin import auth
 
-from . import crud, models
+from . import crud, firebase, models, request_context, resilience, role_claims, terms
 from .database import get_db
+from .role_claims import Principal
 
 reusable_oauth2 = HTTPBearer(scheme_name="Firebase Token")
 
-def get_current_user(
-    db: Session = Depends(get_db), token: HTTPAuthorizationCredentials = Depends(reusable_oauth2)
-) -> models.User:
+# Set on responses authorized from the database because the token's role claims are outdated
+TOKEN_REFRESH_HEADER = "X-Token-Refresh"
+
+def verify_token(token: HTTPAuthorizationCredentials = Depends(reusable_oauth2)) -> dict:
+    """Verifies the Firebase ID token and returns its decoded claims."""
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Bearer token not provided")
     try:
-        decoded_token = auth.verify_id_token(token.credentials)
-        firebase_uid = decoded_token["uid"]
-        user = crud.get_user_by_firebase_uid(db, firebase_uid=firebase_uid)
-        if not user:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found in our database")
-        return user
+        return firebase.verify_id_token(token.credentials)
     except auth.InvalidIdTokenError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Firebase ID token")
+    except resilience.DependencyUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {e}")
 
-def get_current_admin_user(current_user: models.User = Depends(get_current_user)) -> models.User:
+def get_current_user(db: Session = Depends(get_db), decoded_token: dict = Depends(verify_token)) -> models.User:
+    user = crud.get_user_by_firebase_uid(db, firebase_uid=decoded_token["uid"])
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found in our database")
+    request_context.set_principal(user.id, user.role.value)
+    return user
+
+def get_current_principal(
+    response: Response, db: Session = Depends(get_db), decoded_token: dict = Depends(verify_token)
+) -> Principal:
+    """
+    The caller's id and role, taken from the token's custom claims when they are
+    current, so role checks don't need a database round trip. Falls back to
+    loading the user when the token has no claims or they are outdated.
+    """
+    principal = role_claims.principal_from_claims(decoded_token)
+    if principal is not None:
+        request_context.set_principal(principal.id, principal.role.value)
+        return principal
+    user = get_current_user(db=db, decoded_token=decoded_token)
+    if role_claims.ROLE_VERSION_CLAIM in decoded_token:
+        # The client should call getIdToken(true) to pick up the new claims
+        response.headers[TOKEN_REFRESH_HEADER] = "true"
+    return Principal.from_user(user)
+
+def get_current_admin_user(current_user: Principal = Depends(get_current_principal)) -> Principal:
     if current_user.role != models.UserRole.admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="The user does not have admin privileges")
     return current_user
 
-def get_current_course_creator(current_user: models.User = Depends(get_current_user)) -> models.User:
+def get_current_course_creator(current_user: Principal = Depends(get_current_principal)) -> Principal:
     if current_user.role not in [models.UserRole.admin, models.UserRole.instructor]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User must be an Admin or Instructor to perform this action")
     return current_user
@@ -40,7 +66,7 @@ def get_current_course_creator(current_user: models.User = Depends(get_current_u
 def get_course_owner_or_admin(
     course_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ) -> models.Course:
     """
     Dependency that verifies if the current user is the owner of a course or an admin.
@@ -62,6 +88,26 @@ def get_course_owner_or_admin(
     return db_course
 
 
+def viewable_course_ids(db: Session, principal: Principal, course_ids) -> set[int]:
+    """
+    The courses among `course_ids` whose content the principal may see, by the
+    same rules as get_course_viewer: admins see every course, others the
+    courses they own or are (or, in archived terms, were) enrolled in.
+    """
+    course_ids = set(course_ids)
+    if not course_ids:
+        return set()
+    query = select(models.Course.id).where(models.Course.id.in_(course_ids))
+    if principal.role != models.UserRole.admin:
+        hot, cold = models.enrollment_table, models.enrollment_archive_table
+        query = query.where(or_(
+            models.Course.owner_id == principal.id,
+            exists().where(hot.c.course_id == models.Course.id, hot.c.user_id == principal.id),
+            exists().where(cold.c.course_id == models.Course.id, cold.c.user_id == principal.id),
+        ))
+    return set(db.scalars(query))
+
+
 def get_course_viewer(
     course_id: int,
     db: Session = Depends(get_db),
@@ -78,7 +124,7 @@ def get_course_viewer(
     is_admin = current_user.role == models.UserRole.admin
     is_owner = db_course.owner_id == current_user.id
     # This check works because of the many-to-many relationship we defined in models.py
-    is_enrolled = db_course in current_user.enrolled_courses
+    is_enrolled = db_course in current_user.enrolled_courses or terms.was_enrolled(db, db_course, current_user.id)
 
     if not (is_admin or is_owner or is_enrolled):
         raise HTTPException(
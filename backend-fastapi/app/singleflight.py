@@ -0,0 +1,105 @@
+# app/singleflight.py
+"""
+Request coalescing for hot, identical reads.
+
+`SingleFlight.do(key, fn)` runs `fn()` once for all callers asking for the
+same key at the same time: the first caller computes, the others wait for
+its result (or exception) and share it. With a TTL above zero the result is
+also handed to callers that arrive up to TTL seconds after it was computed;
+with SINGLEFLIGHT_TTL_SECONDS=0 only overlapping requests share work.
+
+Only the shared computation goes through here; authorization stays in the
+endpoints' dependencies and runs for every caller. Results are shared
+between threads, so `fn` must return data nobody mutates afterwards
+(pydantic models, not session-bound ORM objects).
+"""
+import os
+import threading
+import time
+from typing import Callable, Hashable, TypeVar
+
+from . import metrics
+
+SINGLEFLIGHT_TTL_SECONDS = float(os.getenv("SINGLEFLIGHT_TTL_SECONDS", "1"))
+SINGLEFLIGHT_MAX_ENTRIES = int(os.getenv("SINGLEFLIGHT_MAX_ENTRIES", "10000"))
+
+T = TypeVar("T")
+
+flight_requests = metrics.Counter(
+    "singleflight_requests_total",
+    "Reads through a single-flight group by outcome: computed, coalesced (waited for an "
+    "in-flight computation) or cached (reused a result younger than the TTL).",
+    ("group", "outcome"),
+)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "expires_at")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+        # Set once the result may be reused; None while in flight
+        self.expires_at: float | None = None
+
+
+class SingleFlight:
+    def __init__(self, name: str, ttl: float = SINGLEFLIGHT_TTL_SECONDS, max_entries: int = SINGLEFLIGHT_MAX_ENTRIES):
+        self.name = name
+        self.ttl = max(ttl, 0.0)
+        self.max_entries = max_entries
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.expires_at is not None and call.expires_at <= time.monotonic():
+                del self._calls[key]
+                call = None
+            leader = call is None
+            if leader:
+                self._trim()
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            flight_requests.inc(self.name, "cached" if call.done.is_set() else "coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        flight_requests.inc(self.name, "computed")
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                # forget() may have dropped the call meanwhile; its result is then already stale
+                if self._calls.get(key) is call:
+                    if call.error is None and self.ttl > 0:
+                        call.expires_at = time.monotonic() + self.ttl
+                    else:
+                        del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def forget(self, key: Hashable):
+        """Makes the next caller for `key` compute afresh (callers already waiting still get the current result)."""
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._calls.clear()
+
+    def _trim(self):
+        if len(self._calls) < self.max_entries:
+            return
+        now = time.monotonic()
+        for key, call in list(self._calls.items()):
+            if call.expires_at is not None and (call.expires_at <= now or len(self._calls) >= self.max_entries):
+                del self._calls[key]
@@ -0,0 +1,314 @@
+# app/storage.py
+"""
+Storage backends for course material files.
+
+The backend is chosen with STORAGE_BACKEND:
+- "firebase" (default): the Firebase Storage bucket from FIREBASE_STORAGE_BUCKET.
+- "local": a directory on local disk (LOCAL_STORAGE_ROOT). Signed URLs point at
+  /api/storage/... on this service and are streamed from disk by
+  SendfileResponse. This is the default with FIREBASE_MODE=emulator.
+"""
+import base64
+import hashlib
+import hmac
+import mimetypes
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import BinaryIO, Iterator, NamedTuple
+from urllib.parse import quote
+
+import anyio
+from firebase_admin import storage as firebase_storage
+from google.api_core.exceptions import NotFound
+from starlette.responses import Response
+
+from . import firebase
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local" if os.getenv("FIREBASE_MODE") == "emulator" else "firebase")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", "storage_data")
+LOCAL_STORAGE_PUBLIC_URL = os.getenv("LOCAL_STORAGE_PUBLIC_URL", "http://127.0.0.1:8000")
+CHUNK_SIZE = 256 * 1024
+
+
+class BlobInfo(NamedTuple):
+    path: str
+    size: int
+    content_type: str
+    etag: str
+    updated: datetime | None
+
+
+class StorageBackend(ABC):
+    """Interface shared by all storage backends. Paths are bucket-relative, e.g. "courses/1/materials/x.pdf"."""
+
+    @abstractmethod
+    def put(self, path: str, fileobj: BinaryIO, content_type: str) -> BlobInfo:
+        """Streams `fileobj` into the blob at `path`, replacing any existing blob."""
+
+    @abstractmethod
+    def open(self, path: str, start: int = 0, end: int | None = None) -> Iterator[bytes]:
+        """Yields the bytes of the blob from `start` to `end` (inclusive) in chunks."""
+
+    @abstractmethod
+    def delete_many(self, paths: list[str]) -> None:
+        """Deletes the given blobs. Paths that don't exist are ignored."""
+
+    @abstractmethod
+    def copy(self, src: str, dst: str) -> BlobInfo:
+        """Copies a blob within the backend, without passing its bytes through this process. Raises FileNotFoundError."""
+
+    @abstractmethod
+    def signed_url(self, path: str, expires: timedelta) -> str:
+        """A URL that grants read access to the blob until `expires` from now."""
+
+    @abstractmethod
+    def stat(self, path: str) -> BlobInfo | None:
+        """Metadata of the blob, or None if it doesn't exist."""
+
+    def local_path(self, path: str) -> str | None:
+        """Filesystem path of the blob if this backend keeps blobs on local disk."""
+        return None
+
+
+class FirebaseStorage(StorageBackend):
+    def __init__(self, bucket_name: str | None = None):
+        self.bucket_name = bucket_name
+
+    @property
+    def bucket(self):
+        return firebase_storage.bucket(self.bucket_name)
+
+    def put(self, path, fileobj, content_type):
+        blob = self.bucket.blob(path)
+        # No overall deadline (large files take a while); each HTTP request still times out
+        firebase.STORAGE.call("upload_from_file", blob.upload_from_file, fileobj, content_type=content_type,
+                              deadline=None, **self._http_timeout())
+        return self._info(blob)
+
+    def open(self, path, start=0, end=None):
+        blob = firebase.STORAGE.call("get_blob", self.bucket.get_blob, path, **self._http_timeout())
+        if blob is None:
+            raise FileNotFoundError(path)
+        last = blob.size - 1 if end is None else min(end, blob.size - 1)
+        position = start
+        while position <= last:
+            chunk_end = min(position + CHUNK_SIZE, last + 1) - 1
+            chunk = firebase.STORAGE.call("download_as_bytes", blob.download_as_bytes, start=position, end=chunk_end,
+                                          checksum=None, **self._http_timeout())
+            yield chunk
+            position = chunk_end + 1
+
+    def delete_many(self, paths):
+        bucket = self.bucket
+        # One batched HTTP request per 100 deletes; missing blobs (404s) are ignored
+        for i in range(0, len(paths), 100):
+            firebase.STORAGE.call("delete_batch", self._delete_batch, bucket, paths[i:i + 100])
+
+    def copy(self, src, dst):
+        bucket = self.bucket
+        try:
+            # A server-side rewrite; the bytes never leave Cloud Storage
+            blob = firebase.STORAGE.call("copy_blob", bucket.copy_blob, bucket.blob(src), bucket, dst, **self._http_timeout())
+        except NotFound:
+            raise FileNotFoundError(src)
+        return self._info(blob)
+
+    def signed_url(self, path, expires):
+        return firebase.STORAGE.call("generate_signed_url", self.bucket.blob(path).generate_signed_url, version="v4", expiration=expires)
+
+    def stat(self, path):
+        blob = firebase.STORAGE.call("get_blob", self.bucket.get_blob, path, **self._http_timeout())
+        return self._info(blob) if blob is not None else None
+
+    @staticmethod
+    def _delete_batch(bucket, paths):
+        with bucket.client.batch(raise_exception=False):
+            for path in paths:
+                bucket.blob(path).delete()
+
+    @staticmethod
+    def _http_timeout() -> dict:
+        """Timeout for the client library's own HTTP requests, so abandoned calls don't hang forever."""
+        return {"timeout": firebase.STORAGE.timeout}
+
+    @staticmethod
+    def _info(blob) -> BlobInfo:
+        return BlobInfo(
+            path=blob.name,
+            size=blob.size or 0,
+            content_type=blob.content_type or "application/octet-stream",
+            etag=blob.md5_hash or blob.etag or "",
+            updated=blob.updated,
+        )
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str, public_url: str, signing_key: bytes | None = None):
+        self.root = os.path.realpath(root)
+        self.public_url = public_url.rstrip("/")
+        if signing_key is None:
+            print("WARNING: LOCAL_STORAGE_SIGNING_KEY is not set; signed URLs won't survive a restart.")
+            signing_key = secrets.token_bytes(32)
+        self.signing_key = signing_key
+        os.makedirs(self.root, exist_ok=True)
+
+    def local_path(self, path):
+        full_path = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([full_path, self.root]) != self.root:
+            raise ValueError(f"Blob path escapes the storage root: {path}")
+        return full_path
+
+    def put(self, path, fileobj, content_type):
+        full_path = self.local_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(fileobj, out, CHUNK_SIZE)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return self.stat(path)
+
+    def open(self, path, start=0, end=None):
+        with open(self.local_path(path), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete_many(self, paths):
+        for path in paths:
+            try:
+                os.remove(self.local_path(path))
+            except FileNotFoundError:
+                pass
+
+    def copy(self, src, dst):
+        src_path, dst_path = self.local_path(src), self.local_path(dst)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        try:
+            # Blobs are only ever replaced (put() renames a new file over them), never
+            # rewritten in place, so both paths can share one inode
+            os.link(src_path, dst_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(src_path, dst_path)
+        return self.stat(dst)
+
+    def signed_url(self, path, expires):
+        expires_at = int(time.time() + expires.total_seconds())
+        signature = self._signature(path, expires_at)
+        return f"{self.public_url}/api/storage/{quote(path)}?expires={expires_at}&signature={signature}"
+
+    def verify_signature(self, path: str, expires_at: int, signature: str) -> bool:
+        if expires_at < time.time():
+            return False
+        return hmac.compare_digest(self._signature(path, expires_at), signature)
+
+    def stat(self, path):
+        try:
+            st = os.stat(self.local_path(path))
+        except FileNotFoundError:
+            return None
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return BlobInfo(
+            path=path,
+            size=st.st_size,
+            content_type=content_type,
+            etag=f"{st.st_size:x}-{st.st_mtime_ns:x}",
+            updated=datetime.fromtimestamp(st.st_mtime, tz=timezone.utc),
+        )
+
+    def _signature(self, path: str, expires_at: int) -> str:
+        digest = hmac.new(self.signing_key, f"{path}\n{expires_at}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+class SendfileResponse(Response):
+    """
+    Sends `count` bytes of a local file starting at `offset`, in CHUNK_SIZE
+    reads on a worker thread, so memory use doesn't depend on the file size.
+    `file` is a path or an already open binary file, which is closed when done.
+
+    This is not zero-copy under the servers we run: an ASGI app never sees the
+    client socket, so it can't call os.sendfile itself, and neither uvicorn
+    nor gunicorn's uvicorn workers offer the "http.response.zerocopy"
+    extension. A server that does offer it is handed the open file to send
+    with sendfile; under uvicorn every chunk is copied through user space.
+    """
+
+    def __init__(self, file: str | BinaryIO, offset: int = 0, count: int | None = None, status_code: int = 200,
+                 headers: dict | None = None, media_type: str | None = None):
+        self.file = open(file, "rb") if isinstance(file, str) else file
+        self.offset = offset
+        self.count = os.fstat(self.file.fileno()).st_size - offset if count is None else count
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        with self.file as f:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"] == "HEAD":
+                await send({"type": "http.response.body", "body": b""})
+                return
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopy", "file": f.fileno(), "offset": self.offset, "count": self.count})
+                return
+            await anyio.to_thread.run_sync(f.seek, self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+
+def parse_byte_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Parses a single-range "Range: bytes=..." header into an inclusive (start, end).
+    Returns None when the whole body should be sent (no header, or a form we
+    don't serve partially, like multiple ranges). Raises ValueError when the
+    range can't be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # "bytes=-N" means the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+@lru_cache(maxsize=None)
+def get_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "firebase":
+        return FirebaseStorage()
+    if STORAGE_BACKEND == "local":
+        signing_key = os.getenv("LOCAL_STORAGE_SIGNING_KEY")
+        return LocalStorage(LOCAL_STORAGE_ROOT, LOCAL_STORAGE_PUBLIC_URL, signing_key.encode() if signing_key else None)
+    raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'; expected 'firebase' or 'local'.")
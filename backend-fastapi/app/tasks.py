@@ -0,0 +1,53 @@
+# app/tasks.py
+"""Handlers for the background job kinds. See app/jobs.py for the queue itself."""
+import os
+
+import requests
+from firebase_admin import auth
+
+from . import firebase, jobs, models, role_claims, storage
+from .database import SessionLocal
+
+FIREBASE_WEB_API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
+
+
+@jobs.handler("delete_blobs", batch=True)
+def delete_blobs(payloads: list[dict]):
+    """Deletes the files of removed materials/courses, all claimed jobs in one batch."""
+    paths = sorted({path for payload in payloads for path in payload["paths"]})
+    storage.get_storage().delete_many(paths)
+
+
+@jobs.handler("send_password_reset")
+def send_password_reset(payload: dict):
+    """Has Firebase send the reset email. Other failures than an unknown email are retried."""
+    email = payload["email"]
+    try:
+        firebase.send_password_reset_email(FIREBASE_WEB_API_KEY, email)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 400 and "EMAIL_NOT_FOUND" in e.response.text:
+            return
+        raise
+    print(f"Password reset email sent to {email}.")
+
+
+@jobs.handler("sync_role_claims")
+def sync_role_claims(payload: dict):
+    """Sets the user's Firebase custom claims from their current role."""
+    db = SessionLocal()
+    try:
+        synced_version = None
+        # Repeat if the role changed again meanwhile (that change's job was deduplicated into this one)
+        while True:
+            user = db.get(models.User, payload["user_id"])
+            if user is None or user.role_version == synced_version:
+                return
+            try:
+                role_claims.set_claims(user)
+            except auth.UserNotFoundError:
+                print(f"Role claims of user {user.id} not set: no Firebase account {user.firebase_uid}.")
+                return
+            synced_version = user.role_version
+            db.rollback()
+    finally:
+        db.close()
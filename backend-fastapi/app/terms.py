@@ -0,0 +1,264 @@
+# app/terms.py
+"""
+Academic terms, and keeping the enrollments of past terms out of the way of
+current ones.
+
+A course may belong to a term (courses.term_id; NULL for courses outside the
+term calendar). A term is upcoming, active, closed or archived:
+
+- Catalog listings (GET /api/courses/) show the courses of upcoming and active
+  terms and those without a term, read through the courses.term_id index, so
+  they don't slow down as past terms pile up. `term_id=` lists one term.
+- Students can only enroll in courses of upcoming and active terms (or without
+  a term).
+- enrollments carries the course's term (0 for none). In Postgres the table is
+  list-partitioned by it: every term gets its own partition
+  (enrollments_term_<id>) when it is created, enrollments_default holds the
+  rest. Roster lookups and counts filter by term as well as course, so they
+  only touch that term's partition. SQLite keeps one table, indexed on
+  (term_id, course_id).
+- Archiving a closed term moves its enrollments to enrollments_archive. In
+  Postgres that only changes catalog metadata: the term's partition is
+  detached from enrollments and attached to enrollments_archive. Elsewhere the
+  rows are copied and deleted in one transaction. The courses stay where they
+  are (materials and stats reference them); rosters, exports and course access
+  read archived enrollments from enrollments_archive.
+- Housekeeping queues an archive_term job for every term closed more than
+  TERM_ARCHIVE_AFTER_DAYS ago (0: only archive with `python -m app.manage
+  archive-term`).
+
+Postgres databases whose enrollments table predates partitioning are
+converted with `python -m app.manage partition-enrollments`.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, exists, func, insert, or_, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import audit, events, jobs, models, schemas
+from .database import SessionLocal
+
+TERM_ARCHIVE_AFTER_DAYS = float(os.getenv("TERM_ARCHIVE_AFTER_DAYS", "30"))
+
+OPEN_STATUSES = (models.TermStatus.upcoming, models.TermStatus.active)
+# Changes an admin can make; archived is only set by archive_term
+TRANSITIONS = {
+    models.TermStatus.upcoming: {models.TermStatus.active, models.TermStatus.closed},
+    models.TermStatus.active: {models.TermStatus.closed},
+    models.TermStatus.closed: {models.TermStatus.active},
+    models.TermStatus.archived: set(),
+}
+
+
+def partition_key(term_id: int | None) -> int:
+    """The enrollments.term_id of a course with this term_id."""
+    return term_id or 0
+
+
+def partition_name(term_id: int) -> str:
+    return f"enrollments_term_{int(term_id)}"
+
+
+def listed(term_id: int | None = None):
+    """Filter for catalog listings: one term's courses, or those of open terms and courses without a term."""
+    if term_id is not None:
+        return models.Course.term_id == term_id
+    open_terms = select(models.Term.id).where(models.Term.status.in_(OPEN_STATUSES))
+    return or_(models.Course.term_id.is_(None), models.Course.term_id.in_(open_terms))
+
+
+def enrollable(course_id: int):
+    """True (as SQL) if students can enroll in the course: it has no term, or an open one."""
+    return exists().where(models.Course.id == course_id, listed())
+
+
+def is_archived(course: models.Course) -> bool:
+    return course.term_id is not None and course.term.status == models.TermStatus.archived
+
+
+def enrollments_for(course: models.Course):
+    """The table holding the course's enrollments."""
+    return models.enrollment_archive_table if is_archived(course) else models.enrollment_table
+
+
+def was_enrolled(db: Session, course: models.Course, user_id: int) -> bool:
+    """Whether the user was enrolled in a course of an archived term."""
+    if not is_archived(course):
+        return False
+    table = models.enrollment_archive_table
+    return db.scalar(select(exists().where(
+        table.c.term_id == course.term_id, table.c.course_id == course.id, table.c.user_id == user_id,
+    )))
+
+
+def check_open(db: Session, term_id: int | None):
+    """Raises unless courses can be added to (or moved into) the term."""
+    if term_id is None:
+        return
+    term_status = db.scalar(select(models.Term.status).where(models.Term.id == term_id))
+    if term_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Term not found")
+    if term_status not in OPEN_STATUSES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Term {term_id} is {term_status.value}")
+
+
+def get_terms(db: Session, include_archived: bool = False) -> list[models.Term]:
+    query = select(models.Term).order_by(models.Term.starts_on.desc(), models.Term.id.desc())
+    if not include_archived:
+        query = query.where(models.Term.status != models.TermStatus.archived)
+    return db.scalars(query).all()
+
+
+def create_term(db: Session, term: schemas.TermCreate) -> models.Term:
+    """Inserts the term and, in a partitioned Postgres database, its enrollments partition."""
+    if term.status not in OPEN_STATUSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="New terms are upcoming or active")
+    db_term = models.Term(**term.model_dump())
+    db.add(db_term)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Term {term.code} already exists")
+    if _partitioned(db):
+        _create_partition(db, db_term.id)
+    events.publish_system_on_commit(db, "term.created", term_id=db_term.id)
+    audit.record_on_commit(db, "term.created", term_id=db_term.id, code=db_term.code)
+    db.commit()
+    db.refresh(db_term)
+    return db_term
+
+
+def update_term(db: Session, term_id: int, changes: schemas.TermUpdate) -> models.Term:
+    db_term = db.get(models.Term, term_id)
+    if db_term is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Term not found")
+    values = changes.model_dump(exclude_unset=True, exclude_none=True)
+    new_status = values.pop("status", db_term.status)
+    if new_status != db_term.status:
+        if new_status not in TRANSITIONS[db_term.status]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"A {db_term.status.value} term can't become {new_status.value}",
+            )
+        values["status"] = new_status
+        values["closed_at"] = datetime.now(timezone.utc) if new_status == models.TermStatus.closed else None
+    for field, value in values.items():
+        setattr(db_term, field, value)
+    events.publish_system_on_commit(db, "term.updated", term_id=term_id)
+    audit.record_on_commit(db, "term.updated", term_id=term_id, changes=changes.model_dump(mode="json", exclude_unset=True))
+    db.commit()
+    db.refresh(db_term)
+    return db_term
+
+
+def archive_term(db: Session, term_id: int) -> int:
+    """
+    Moves the enrollments of a closed term to enrollments_archive and marks the
+    term archived, in one transaction. Returns the number of enrollments moved
+    (0 if the term was already archived).
+    """
+    db_term = db.get(models.Term, term_id, with_for_update=True)
+    if db_term is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Term not found")
+    if db_term.status == models.TermStatus.archived:
+        db.rollback()
+        return 0
+    if db_term.status != models.TermStatus.closed:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Only closed terms can be archived")
+
+    hot, cold = models.enrollment_table, models.enrollment_archive_table
+    moved = db.scalar(select(func.count()).select_from(hot).where(hot.c.term_id == term_id))
+    if _attached_partition(db, term_id):
+        # Takes a short exclusive lock on both tables; no rows are copied
+        name = partition_name(term_id)
+        db.execute(text(f"ALTER TABLE enrollments DETACH PARTITION {name}"))
+        db.execute(text(f"ALTER TABLE enrollments_archive ATTACH PARTITION {name} FOR VALUES IN ({int(term_id)})"))
+    elif moved:
+        db.execute(insert(cold).from_select(
+            ["user_id", "course_id", "term_id"],
+            select(hot.c.user_id, hot.c.course_id, hot.c.term_id).where(hot.c.term_id == term_id),
+        ))
+        db.execute(delete(hot).where(hot.c.term_id == term_id))
+    db_term.status = models.TermStatus.archived
+    db_term.archived_at = datetime.now(timezone.utc)
+    events.publish_system_on_commit(db, "term.updated", term_id=term_id)
+    audit.record_on_commit(db, "term.archived", term_id=term_id, enrollments=moved)
+    db.commit()
+    print(f"Term {db_term.code}: archived {moved} enrollment(s).")
+    return moved
+
+
+@jobs.handler("archive_term")
+def archive_term_job(payload: dict):
+    db = SessionLocal()
+    try:
+        try:
+            archive_term(db, payload["term_id"])
+        except HTTPException as e:
+            # Reopened or deleted since the job was queued
+            print(f"Not archiving term {payload['term_id']}: {e.detail}")
+    finally:
+        db.close()
+
+
+@jobs.housekeeping
+def queue_archival(db: Session) -> int:
+    if TERM_ARCHIVE_AFTER_DAYS <= 0:
+        return 0
+    cutoff = datetime.now(timezone.utc) - timedelta(days=TERM_ARCHIVE_AFTER_DAYS)
+    term_ids = db.scalars(
+        select(models.Term.id).where(models.Term.status == models.TermStatus.closed, models.Term.closed_at < cutoff)
+    ).all()
+    for term_id in term_ids:
+        jobs.enqueue(db, "archive_term", {"term_id": term_id}, dedupe_key=f"archive-term:{term_id}")
+    db.commit()
+    return len(term_ids)
+
+
+def partition_enrollments(db: Session) -> int:
+    """
+    Converts a Postgres enrollments table created before partitioning: renames
+    it, creates the partitioned table with a partition per unarchived term,
+    copies the rows over and drops the old table, in one transaction (which
+    blocks enrollments while it runs). Returns the number of rows copied.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        raise ValueError("Only Postgres databases are partitioned")
+    if _partitioned(db):
+        return 0
+    db.execute(text("ALTER TABLE enrollments RENAME TO enrollments_unpartitioned"))
+    db.execute(text("ALTER INDEX enrollments_pkey RENAME TO enrollments_unpartitioned_pkey"))
+    db.execute(text("ALTER INDEX IF EXISTS ix_enrollments_term_id_course_id RENAME TO ix_enrollments_unpartitioned_term_id_course_id"))
+    models.enrollment_table.create(bind=db.connection())
+    for term_id in db.scalars(select(models.Term.id).where(models.Term.status != models.TermStatus.archived)):
+        _create_partition(db, term_id)
+    copied = db.execute(text(
+        "INSERT INTO enrollments (user_id, course_id, term_id) "
+        "SELECT user_id, course_id, term_id FROM enrollments_unpartitioned"
+    )).rowcount
+    db.execute(text("DROP TABLE enrollments_unpartitioned"))
+    db.commit()
+    return copied
+
+
+def _partitioned(db: Session) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return db.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('enrollments')")) == "p"
+
+
+def _attached_partition(db: Session, term_id: int) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return db.scalar(
+        text("SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:name) AND inhparent = to_regclass('enrollments')"),
+        {"name": partition_name(term_id)},
+    ) is not None
+
+
+def _create_partition(db: Session, term_id: int):
+    db.execute(text(f"CREATE TABLE IF NOT EXISTS {partition_name(term_id)} PARTITION OF enrollments FOR VALUES IN ({int(term_id)})"))
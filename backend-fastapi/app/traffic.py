@@ -0,0 +1,332 @@
+# app/traffic.py
+"""
+Traffic capture and replay, for capacity tests with the real request mix.
+
+Capture (opt-in: set TRAFFIC_CAPTURE_PATH) appends one compact JSON line per
+HTTP request to that file:
+
+    {"t": 1718000000.123, "m": "POST", "r": "/api/courses/{course_id}/enroll",
+     "p": {"course_id": "7"}, "q": {}, "b": null, "ik": true, "pc": "student", "s": 201, "d": 0.0123}
+
+t is the wall-clock start, r the route template, p the path parameters,
+q the query, b the body, pc the caller's principal class (its role, or
+"anonymous"), ik whether it carried an Idempotency-Key, s the status and d
+the duration in seconds. Requests are
+anonymized: no headers or tokens are kept, letters and digits in query and
+body strings are masked ("ann@uni.edu" becomes "xxx@xxx.xxx"), and signatures
+and cursors are dropped. Numbers, booleans and a few enumerated parameters
+(role, format, ...) are kept. Multipart uploads only keep their size. Lines
+are written in batches by a background thread with O_APPEND, so several
+worker processes can share one file. TRAFFIC_CAPTURE_SAMPLE records only a
+fraction of requests.
+
+Replay (`python -m app.manage replay-traffic capture.ndjson`) sends the
+recorded requests to a running instance at their original pace (or N times
+faster) and reports latency percentiles per route. Tokens per principal class
+come from --token student=<ID token>; with FIREBASE_MODE=emulator, masked
+logins succeed through auto sign-up. Local storage downloads are re-signed when
+LOCAL_STORAGE_SIGNING_KEY is set.
+"""
+import asyncio
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import timedelta
+from urllib.parse import parse_qsl
+
+from . import request_context
+
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH")
+TRAFFIC_CAPTURE_SAMPLE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1"))
+MAX_CAPTURED_BODY = 64 * 1024
+FLUSH_SECONDS = 1.0
+
+# Kept verbatim: enumerations whose masked value would be rejected on replay
+KEPT_FIELDS = {"role", "format", "dry_run", "include_materials", "action"}
+# Never recorded: secrets, and opaque values that can't be replayed
+DROPPED_FIELDS = {"signature", "expires", "token", "cursor", "password_reset_code"}
+UNMATCHED_ROUTE = "unmatched"
+
+
+# --- Capture --------------------------------------------------------------
+
+def mask(value):
+    """Masks the letters and digits of strings, recursively; keeps numbers, booleans and structure."""
+    if isinstance(value, str):
+        return re.sub(r"[0-9]", "0", re.sub(r"[^\W\d_]", "x", value))
+    if isinstance(value, dict):
+        return {key: _field(key, item) for key, item in value.items() if key not in DROPPED_FIELDS}
+    if isinstance(value, list):
+        return [mask(item) for item in value]
+    return value
+
+
+def _field(key: str, value):
+    if key in KEPT_FIELDS or isinstance(value, (int, float, bool)) or value is None:
+        return value
+    if isinstance(value, str) and re.fullmatch(r"-?\d+(\.\d+)?|true|false", value):
+        return value
+    return mask(value)
+
+
+def _body(content_type: str, body: bytes, size: int):
+    if not size:
+        return None
+    if content_type.startswith("multipart/"):
+        return {"multipart": size}
+    if size > MAX_CAPTURED_BODY:
+        return {"size": size}
+    try:
+        if content_type.startswith("application/json"):
+            return {"json": mask(json.loads(body))}
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {"form": mask(dict(parse_qsl(body.decode())))}
+    except ValueError:
+        pass
+    return {"size": size}
+
+
+class _Writer:
+    """Batches captured lines and appends them from a background thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lines: queue.SimpleQueue[str] = queue.SimpleQueue()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        self.lines.put(json.dumps(record, separators=(",", ":")))
+        if self._pid != os.getpid():
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            # Also after a fork: the parent's thread doesn't exist in the child
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="traffic-capture", daemon=True).start()
+
+    def _run(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        while True:
+            batch = [self.lines.get()]
+            deadline = time.monotonic() + FLUSH_SECONDS
+            while len(batch) < 1000 and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.lines.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                # One write per batch; O_APPEND keeps batches from different processes whole
+                os.write(fd, ("\n".join(batch) + "\n").encode())
+            except OSError as e:
+                print(f"Traffic capture: could not write to {self.path}: {e}")
+
+
+class TrafficCaptureMiddleware:
+    """Records the shape of every HTTP request (see the module docstring). Added in main.py when TRAFFIC_CAPTURE_PATH is set."""
+
+    def __init__(self, app, path: str | None = None, sample: float | None = None):
+        self.app = app
+        self.writer = _Writer(path or TRAFFIC_CAPTURE_PATH)
+        self.sample = TRAFFIC_CAPTURE_SAMPLE if sample is None else sample
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.sample < 1 and random.random() >= self.sample):
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.time()
+        started = time.perf_counter()
+        status_code = 500
+        body = bytearray()
+        size = 0
+
+        async def receive_and_keep():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if len(body) <= MAX_CAPTURED_BODY:
+                    body.extend(chunk[:MAX_CAPTURED_BODY + 1 - len(body)])
+            return message
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_keep, send_with_status)
+        finally:
+            headers = dict(scope.get("headers") or [])
+            route = getattr(scope.get("route"), "path_format", None)
+            self.writer.write({
+                "t": round(started_at, 3),
+                "m": scope["method"],
+                "r": route or UNMATCHED_ROUTE,
+                # Path parameters are ids, names and blob keys chosen by the service, so they are kept
+                "p": {key: str(value) for key, value in (scope.get("path_params") or {}).items()},
+                "q": mask(dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))),
+                "b": _body(headers.get(b"content-type", b"").decode("latin-1"), bytes(body), size),
+                "ik": b"idempotency-key" in headers,
+                "pc": request_context.principal_class(scope),
+                "s": status_code,
+                "d": round(time.perf_counter() - started, 6),
+            })
+
+
+# --- Replay ---------------------------------------------------------------
+
+def load_trace(path: str) -> list[dict]:
+    """The captured requests in start order. Requests that never matched a route are left out."""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted((record for record in records if record["r"] != UNMATCHED_ROUTE), key=lambda record: record["t"])
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class ReplayReport:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.statuses: dict[str, dict[str, int]] = {}
+        self.lag: list[float] = []
+        self.started = time.monotonic()
+        self.finished = None
+
+    def add(self, route: str, status: str, latency: float, lag: float):
+        self.latencies.setdefault(route, []).append(latency)
+        counts = self.statuses.setdefault(route, {})
+        counts[status] = counts.get(status, 0) + 1
+        self.lag.append(lag)
+
+    def as_dict(self) -> dict:
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            routes[route] = {
+                "count": len(latencies),
+                "statuses": self.statuses[route],
+                "p50": _percentile(latencies, 0.50),
+                "p90": _percentile(latencies, 0.90),
+                "p99": _percentile(latencies, 0.99),
+                "max": latencies[-1],
+            }
+        lag = sorted(self.lag)
+        return {
+            "requests": len(lag),
+            "duration_seconds": (self.finished or time.monotonic()) - self.started,
+            # How far behind schedule requests were sent (client-side saturation)
+            "schedule_lag_p99": _percentile(lag, 0.99),
+            "routes": routes,
+        }
+
+    def print(self):
+        summary = self.as_dict()
+        print(f"{'route':<62} {'count':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+        for route, stats in summary["routes"].items():
+            statuses = " ".join(f"{code}:{count}" for code, count in sorted(stats["statuses"].items()))
+            print(f"{route[:62]:<62} {stats['count']:>7} {stats['p50'] * 1000:>8.1f} {stats['p90'] * 1000:>8.1f} "
+                  f"{stats['p99'] * 1000:>8.1f} {stats['max'] * 1000:>8.1f}  {statuses}")
+        print(f"{summary['requests']} request(s) in {summary['duration_seconds']:.1f}s; "
+              f"p99 schedule lag {summary['schedule_lag_p99'] * 1000:.1f} ms.")
+
+
+def _request_args(record: dict, tokens: dict[str, str], signer) -> dict:
+    path = record["r"]
+    for key, value in record["p"].items():
+        path = path.replace("{" + key + "}", str(value))
+    params = dict(record["q"])
+    headers = {}
+    token = tokens.get(record["pc"])
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    if record.get("ik"):
+        headers["Idempotency-Key"] = str(uuid.uuid4())
+    if signer is not None and record["r"] == "/api/storage/{path}":
+        params.update(signer(record["p"]["path"]))
+
+    args = {"method": record["m"], "url": path, "params": params, "headers": headers}
+    body = record.get("b") or {}
+    if "json" in body:
+        args["json"] = body["json"]
+    elif "form" in body:
+        args["data"] = body["form"]
+    elif "multipart" in body:
+        args["data"] = {"title": "replay", "format": "json"}
+        args["files"] = {"file": ("replay.bin", os.urandom(body["multipart"]), "application/octet-stream")}
+    elif "size" in body:
+        args["content"] = b"\0" * body["size"]
+    return args
+
+
+async def replay(records: list[dict], base_url: str, speed: float = 1.0, tokens: dict[str, str] | None = None,
+                 concurrency: int = 500, timeout: float = 30.0, signer=None) -> ReplayReport:
+    """
+    Sends `records` (from load_trace) to `base_url`, keeping their relative
+    start times divided by `speed`. At most `concurrency` requests are in flight;
+    beyond that, requests start late and the lag is reported.
+    """
+    import httpx  # Only the replay tool needs it
+
+    report = ReplayReport()
+    if not records:
+        return report
+    tokens = tokens or {}
+    slots = asyncio.Semaphore(concurrency)
+    first = records[0]["t"]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        # The schedule starts once the client is ready (creating it takes a while)
+        report.started = time.monotonic()
+
+        async def send(record, due):
+            async with slots:
+                sent = time.monotonic()
+                try:
+                    response = await client.request(**_request_args(record, tokens, signer))
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                report.add(f"{record['m']} {record['r']}", status, time.monotonic() - sent, max(sent - due, 0.0))
+
+        tasks = []
+        for record in records:
+            due = report.started + (record["t"] - first) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(record, due)))
+        await asyncio.gather(*tasks)
+    report.finished = time.monotonic()
+    return report
+
+
+def local_storage_signer():
+    """Signs replayed /api/storage downloads when the local backend's key is shared with the target, else None."""
+    from . import storage
+
+    if storage.STORAGE_BACKEND != "local" or not os.getenv("LOCAL_STORAGE_SIGNING_KEY"):
+        return None
+    backend = storage.get_storage()
+
+    def sign(path: str) -> dict:
+        url = backend.signed_url(path, timedelta(hours=1))
+        return dict(parse_qsl(url.split("?", 1)[1]))
+
+    return sign
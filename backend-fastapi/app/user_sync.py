@@ -0,0 +1,84 @@
+# app/user_sync.py
+"""
+Bulk import of Firebase Authentication accounts into the local `users` table.
+
+A user source yields pages of (firebase_uid, email) pairs together with the
+cursor of the next page. Each page is upserted in one batched statement and the
+cursor is saved in the same transaction, so an interrupted run resumes from the
+last committed page.
+"""
+import json
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from . import crud, firebase, models
+
+CHECKPOINT_NAME = "firebase_users"
+
+
+class FirebaseUserSource:
+    """Pages through `auth.list_users` (at most 1000 accounts per page)."""
+
+    def __init__(self, page_size: int = 1000):
+        self.page_size = min(page_size, 1000)
+
+    def fetch_page(self, cursor: str | None) -> tuple[list[tuple[str, str]], str | None]:
+        page = firebase.list_users(cursor, self.page_size)
+        accounts = [(user.uid, user.email) for user in page.users]
+        return accounts, page.next_page_token or None
+
+
+class JsonFileUserSource:
+    """
+    A local stand-in for Firebase, reading accounts from a JSON file:
+    [{"uid": "...", "email": "..."}, ...]. Cursors are list offsets.
+    """
+
+    def __init__(self, path: str, page_size: int = 1000):
+        with open(path) as f:
+            self.accounts = [(item["uid"], item.get("email")) for item in json.load(f)]
+        self.page_size = page_size
+
+    def fetch_page(self, cursor: str | None) -> tuple[list[tuple[str, str]], str | None]:
+        start = int(cursor or 0)
+        end = start + self.page_size
+        next_cursor = str(end) if end < len(self.accounts) else None
+        return self.accounts[start:end], next_cursor
+
+
+def sync_users(db: Session, source, restart: bool = False, checkpoint_name: str = CHECKPOINT_NAME, progress=None) -> dict:
+    """
+    Copies every account from `source` into `users`, one committed batch per page.
+    The checkpoint is removed once the source is exhausted, so the next run starts over.
+    """
+    checkpoint = db.get(models.SyncCheckpoint, checkpoint_name)
+    if checkpoint is None:
+        # Only saved once there is a next page to resume from
+        checkpoint = models.SyncCheckpoint(name=checkpoint_name, cursor=None, processed=0)
+    elif restart:
+        checkpoint.cursor = None
+        checkpoint.processed = 0
+    totals = {"pages": 0, "upserted": 0, "skipped": 0, "resumed_from": checkpoint.processed}
+
+    cursor = checkpoint.cursor
+    while True:
+        accounts, next_cursor = source.fetch_page(cursor)
+        result = crud.upsert_users(db, accounts)
+        totals["pages"] += 1
+        totals["upserted"] += result["upserted"]
+        totals["skipped"] += result["skipped"]
+
+        if next_cursor is None:
+            if inspect(checkpoint).persistent:
+                db.delete(checkpoint)
+            db.commit()
+            break
+        db.add(checkpoint)
+        checkpoint.cursor = next_cursor
+        checkpoint.processed += len(accounts)
+        db.commit()
+        cursor = next_cursor
+        if progress:
+            progress(totals)
+    return totals
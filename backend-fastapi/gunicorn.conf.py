@@ -0,0 +1,63 @@
+# gunicorn.conf.py
+"""
+Multi-process serving: `gunicorn app.main:app` from this directory (gunicorn
+reads this file from the working directory), one uvicorn event loop per worker.
+
+The app is imported once in the master (preload_app) and the workers are
+forked from it, so they start fast and share the imported code's memory.
+What can't be shared is re-created in every worker right after the fork, by
+os.register_at_fork hooks next to the code that owns it: the database
+connection pool (app/database.py), the Firebase Admin app and its HTTP clients
+(app/firebase.py) and the events broker (app/events.py). Everything that runs
+threads (job workers, the audit flush, the events listener, the ingestion
+pool) is started by the app's lifespan, which runs in each worker after the
+fork. Importing the app starts no threads, so the fork never copies a lock
+that one of them holds.
+
+Per-process caches (the single-flight results, the role versions behind token
+checks) are kept consistent through the events broker. With more than one
+worker and EVENTS_BROKER unset, this file selects the "unix" broker, which
+delivers every event to all workers of this server. Use EVENTS_BROKER=postgres
+when several instances share the database.
+
+Settings: WEB_CONCURRENCY (workers, default: the CPUs this process may use),
+PORT, GUNICORN_PRELOAD, GUNICORN_TIMEOUT, GUNICORN_MAX_REQUESTS.
+"""
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY", len(os.sched_getaffinity(0))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+# Seconds a worker may go without checking in before the master restarts it
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+# Restart workers after this many requests (0: never), staggered so they don't all restart at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+# Read by the app at import, so this has to happen before preloading it
+_socket_dir = None
+if workers > 1 and "EVENTS_BROKER" not in os.environ:
+    os.environ["EVENTS_BROKER"] = "unix"
+if os.environ.get("EVENTS_BROKER") == "unix" and "EVENTS_SOCKET_DIR" not in os.environ:
+    # One directory per server, so two servers on a host don't receive each other's events
+    _socket_dir = os.environ["EVENTS_SOCKET_DIR"] = tempfile.mkdtemp(prefix="lms-events-")
+
+
+def on_starting(server):
+    broker = os.environ.get("EVENTS_BROKER", "inprocess")
+    server.log.info("Serving with %d worker(s), events broker %s, preload %s", workers, broker, preload_app)
+    if workers > 1 and broker == "inprocess":
+        server.log.warning(
+            "EVENTS_BROKER=inprocess with %d workers: cache invalidations, role changes and "
+            "WebSocket events only reach the worker that produced them.", workers,
+        )
+
+
+def on_exit(server):
+    if _socket_dir is not None:
+        shutil.rmtree(_socket_dir, ignore_errors=True)
@@ -0,0 +1,38 @@
+# tests/conftest.py
+"""
+Shared test setup. The app reads its configuration at import time, so the
+environment is set here before anything imports it: a throwaway SQLite
+database, the in-process Firebase emulator and local file storage.
+
+Run from backend-fastapi/: python -m pytest
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="lms-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault("FIREBASE_MODE", "emulator")
+os.environ.setdefault("FIREBASE_EMULATOR_SECRET", "test-secret")
+os.environ.setdefault("STORAGE_BACKEND", "local")
+os.environ.setdefault("LOCAL_STORAGE_ROOT", os.path.join(_tmp, "storage"))
+os.environ.setdefault("BLOB_CACHE_DIR", os.path.join(_tmp, "blob_cache"))
+os.environ.setdefault("AUDIT_SPILL_DIR", os.path.join(_tmp, "audit_spill"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from app import models  # noqa: E402
+from app.database import SessionLocal, engine  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """A session on empty tables."""
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,82 @@
+# tests/test_admission.py
+import asyncio
+
+from app import admission
+
+
+def scope(path, method="GET", headers=(), client=("10.0.0.1", 1234)):
+    return {"type": "http", "method": method, "path": path, "headers": list(headers), "client": client}
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def call(middleware, request_scope) -> int:
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    await middleware(request_scope, receive, send)
+    return messages[0]["status"]
+
+
+def test_spoofed_forwarded_for_is_still_rate_limited():
+    middleware = admission.AdmissionControlMiddleware(ok_app, auth_rate_per_minute=1, auth_burst=2)
+
+    async def logins():
+        statuses = []
+        for i in range(4):
+            # The client makes up the first hop; App Engine appends the address it saw
+            headers = [(b"x-forwarded-for", f"198.51.100.{i}, 203.0.113.7".encode())]
+            statuses.append(await call(middleware, scope("/api/auth/login", "POST", headers)))
+        return statuses
+
+    assert asyncio.run(logins()) == [200, 200, 429, 429]
+
+
+def test_client_ip_uses_the_trusted_hops():
+    headers = [(b"x-forwarded-for", b"1.1.1.1, 2.2.2.2"), (b"x-forwarded-for", b"3.3.3.3")]
+    assert admission.client_ip(scope("/", headers=headers), trusted_hops=1) == "3.3.3.3"
+    assert admission.client_ip(scope("/", headers=headers), trusted_hops=2) == "2.2.2.2"
+    assert admission.client_ip(scope("/", headers=headers), trusted_hops=5) == "1.1.1.1"
+    assert admission.client_ip(scope("/", headers=headers), trusted_hops=0) == "10.0.0.1"
+
+
+def test_downloads_and_exports_have_their_own_class():
+    auth = [(b"authorization", b"Bearer t")]
+    assert admission.classify(scope("/api/courses/1/materials/2/download", headers=auth)) == admission.DOWNLOAD
+    assert admission.classify(scope("/api/courses/1/students/export", headers=auth)) == admission.DOWNLOAD
+    assert admission.classify(scope("/api/courses/export/enrollments", headers=auth)) == admission.DOWNLOAD
+    assert admission.classify(scope("/api/storage/materials/a.pdf")) == admission.DOWNLOAD
+    assert admission.classify(scope("/api/courses/1/materials", headers=auth)) == admission.AUTH_READ
+
+
+def test_slow_downloads_dont_block_authenticated_reads():
+    async def run():
+        finish = asyncio.Event()
+
+        async def app(request_scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            if request_scope["path"].endswith("/download"):
+                await finish.wait()
+            await send({"type": "http.response.body", "body": b""})
+
+        limits = {**admission.DEFAULT_LIMITS, admission.DOWNLOAD: (1, 0), admission.AUTH_READ: (1, 0)}
+        middleware = admission.AdmissionControlMiddleware(app, limits=limits, queue_timeout=0.1)
+        auth = [(b"authorization", b"Bearer t")]
+        download = asyncio.create_task(call(middleware, scope("/api/courses/1/materials/2/download", headers=auth)))
+        await asyncio.sleep(0)
+        statuses = [
+            await call(middleware, scope("/api/courses/1/materials/3/download", headers=auth)),
+            await call(middleware, scope("/api/courses/1/materials", headers=auth)),
+        ]
+        finish.set()
+        return statuses + [await download]
+
+    assert asyncio.run(run()) == [503, 200, 200]
@@ -0,0 +1,67 @@
+# tests/test_blob_cache.py
+import os
+import time
+from datetime import datetime, timezone
+
+from app.blob_cache import BlobCache
+from app.storage import BlobInfo
+
+
+class MemoryBackend:
+    def __init__(self, blobs: dict[str, bytes]):
+        self.blobs = blobs
+        self.downloads = 0
+
+    def stat(self, path):
+        data = self.blobs.get(path)
+        if data is None:
+            return None
+        return BlobInfo(path=path, size=len(data), content_type="application/pdf", etag=str(len(data)),
+                        updated=datetime.now(timezone.utc))
+
+    def open(self, path):
+        self.downloads += 1
+        yield self.blobs[path]
+
+
+def read(cache, backend, path):
+    f, entry = cache.open(backend, path)
+    with f:
+        return f.read()
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+               if not name.endswith(".json") and not name.startswith("."))
+
+
+def test_caches_sharing_a_directory_stay_within_max_bytes(tmp_path):
+    backend = MemoryBackend({f"m/{i}.pdf": bytes([i]) * 40 for i in range(6)})
+    # Two processes' caches on one directory
+    first, second = BlobCache(str(tmp_path), 100), BlobCache(str(tmp_path), 100)
+
+    for i in range(3):
+        read(first, backend, f"m/{i}.pdf")
+        read(second, backend, f"m/{i + 3}.pdf")
+        assert directory_bytes(tmp_path) <= 100
+    assert first.stats()["bytes"] <= 100 and second.stats()["bytes"] <= 100
+
+
+def test_eviction_follows_hits_in_other_processes(tmp_path):
+    backend = MemoryBackend({f"m/{i}.pdf": bytes([i]) * 40 for i in range(3)})
+    first, second = BlobCache(str(tmp_path), 100), BlobCache(str(tmp_path), 100)
+    read(first, backend, "m/0.pdf")
+    read(first, backend, "m/1.pdf")
+    time.sleep(0.01)
+    # Only the second process uses m/0 again; m/1 is now the least recently used
+    second._trim()
+    assert read(second, backend, "m/0.pdf") == bytes([0]) * 40
+    time.sleep(0.01)
+    read(first, backend, "m/2.pdf")
+
+    downloads = backend.downloads
+    assert read(second, backend, "m/0.pdf") == bytes([0]) * 40
+    assert backend.downloads == downloads
+    # The first process still indexed m/1; it notices the file is gone and fetches it again
+    assert read(first, backend, "m/1.pdf") == bytes([1]) * 40
+    assert backend.downloads == downloads + 1
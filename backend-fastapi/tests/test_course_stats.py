@@ -0,0 +1,29 @@
+# tests/test_course_stats.py
+from datetime import date
+
+from sqlalchemy import delete, insert
+
+from app import crud, models, terms
+
+
+def test_lazily_seeded_stats_match_rebuild_after_archiving(db):
+    term = models.Term(code="2025-FA", name="Fall 2025", starts_on=date(2025, 9, 1), ends_on=date(2025, 12, 20),
+                       status=models.TermStatus.closed)
+    owner = models.User(email="owner@example.com", firebase_uid="owner")
+    db.add_all([term, owner])
+    db.flush()
+    course = models.Course(title="Archived", capacity=10, owner_id=owner.id, term_id=term.id)
+    students = [models.User(email=f"s{i}@example.com", firebase_uid=f"s{i}") for i in range(3)]
+    db.add_all([course, *students])
+    db.flush()
+    db.execute(insert(models.enrollment_table), [
+        {"user_id": s.id, "course_id": course.id, "term_id": term.id} for s in students
+    ])
+    db.commit()
+    assert terms.archive_term(db, term.id) == 3
+
+    # A course whose stats row predates the summary table (or was lost)
+    db.execute(delete(models.CourseStats))
+    assert crud._bump_course_stats(db, course.id) == (3, 0)
+    db.commit()
+    assert crud.rebuild_course_stats(db, fix=False) == []
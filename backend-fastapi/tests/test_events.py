@@ -0,0 +1,21 @@
+# tests/test_events.py
+import pytest
+
+from app import events
+
+
+def test_incomplete_brokers_fail_when_instantiated():
+    class SendOnlyBroker(events.Broker):
+        def publish(self, event):
+            pass
+
+    with pytest.raises(TypeError, match="start"):
+        SendOnlyBroker()
+
+
+def test_in_process_broker_delivers_to_itself():
+    delivered = []
+    broker = events.InProcessBroker()
+    broker.start(delivered.append)
+    broker.publish({"type": "course.updated", "course_id": 1})
+    assert delivered == [{"type": "course.updated", "course_id": 1}]
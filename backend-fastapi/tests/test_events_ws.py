@@ -0,0 +1,59 @@
+# tests/test_events_ws.py
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from starlette.websockets import WebSocketDisconnect
+
+from app import firebase_emulator, models, role_claims
+
+
+@pytest.fixture
+def client(db):
+    from app.main import app
+    return TestClient(app)
+
+
+def token_for(db, email: str, role: models.UserRole) -> tuple[models.User, str]:
+    user = models.User(email=email, firebase_uid=f"uid-{email}", role=role)
+    db.add(user)
+    db.commit()
+    return user, firebase_emulator.mint_id_token(user.firebase_uid, user.email, role_claims.claims_for(user))
+
+
+@pytest.fixture
+def courses(db):
+    owner, _ = token_for(db, "owner@example.com", models.UserRole.instructor)
+    mine, other = models.Course(title="Mine", owner_id=owner.id), models.Course(title="Other", owner_id=owner.id)
+    db.add_all([mine, other])
+    db.commit()
+    return mine.id, other.id
+
+
+def test_students_can_only_subscribe_to_their_courses(client, db, courses):
+    mine, other = courses
+    student, token = token_for(db, "student@example.com", models.UserRole.student)
+    db.execute(insert(models.enrollment_table).values(user_id=student.id, course_id=mine, term_id=0))
+    db.commit()
+
+    with client.websocket_connect(f"/api/events/ws?token={token}") as ws:
+        ws.send_json({"action": "subscribe", "course_ids": [mine, other, "*"]})
+        assert ws.receive_json() == {"type": "error", "detail": "Not allowed to subscribe to these courses",
+                                     "course_ids": [other, "*"]}
+        assert ws.receive_json() == {"type": "subscriptions", "course_ids": [mine]}
+
+
+def test_admins_can_subscribe_to_everything(client, db, courses):
+    _, token = token_for(db, "admin@example.com", models.UserRole.admin)
+    with client.websocket_connect(f"/api/events/ws?token={token}") as ws:
+        ws.send_json({"action": "subscribe", "course_ids": ["*", courses[1]]})
+        assert ws.receive_json() == {"type": "subscriptions", "course_ids": sorted(["*", courses[1]], key=str)}
+
+
+@pytest.mark.parametrize("message", ['[1, 2]', '"subscribe"', '3', 'not json'])
+def test_messages_that_are_not_objects_close_the_connection(client, db, message):
+    _, token = token_for(db, "student@example.com", models.UserRole.student)
+    with client.websocket_connect(f"/api/events/ws?token={token}") as ws:
+        ws.send_text(message)
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+        assert closed.value.code == 1003
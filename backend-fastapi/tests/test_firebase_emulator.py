@@ -0,0 +1,51 @@
+# tests/test_firebase_emulator.py
+import pytest
+from firebase_admin import auth
+
+from app import firebase_emulator, models
+
+
+def claims_of(email, password):
+    token = firebase_emulator.sign_in_with_password(email, password)["idToken"]
+    return firebase_emulator.verify_id_token(token)
+
+
+def test_accounts_and_claims_are_stored_in_the_database(db):
+    uid = firebase_emulator.sign_in_with_password("Ada@example.com", "pw")["localId"]
+    assert uid == firebase_emulator.uid_for_email("ada@example.com")
+
+    # What another process (e.g. run-worker syncing role claims) sees
+    firebase_emulator.set_custom_user_claims(uid, {"role": "instructor"})
+    row = db.get(models.EmulatorAccount, uid)
+    assert row.email == "Ada@example.com" and row.custom_claims == {"role": "instructor"}
+
+    token = claims_of("ada@example.com", "pw")
+    assert token["uid"] == uid and token["role"] == "instructor"
+    firebase_emulator.generate_password_reset_link("ADA@example.com")
+
+
+def test_wrong_password_and_unknown_accounts_are_rejected(db):
+    firebase_emulator.create_account("bob@example.com", "right")
+    with pytest.raises(Exception) as error:
+        firebase_emulator.sign_in_with_password("bob@example.com", "wrong")
+    assert error.value.response.status_code == 400
+    with pytest.raises(auth.UserNotFoundError):
+        firebase_emulator.set_custom_user_claims("no-such-uid", {"role": "admin"})
+    with pytest.raises(auth.UserNotFoundError):
+        firebase_emulator.generate_password_reset_link("nobody@example.com")
+
+
+def test_loading_accounts_keeps_claims_and_list_users_pages(db, tmp_path):
+    firebase_emulator.create_account("c1@example.com", "old", uid="c1")
+    firebase_emulator.set_custom_user_claims("c1", {"role": "admin"})
+    accounts = tmp_path / "accounts.json"
+    accounts.write_text('[{"email": "c1@example.com", "password": "new", "uid": "c1"},'
+                        ' {"email": "c2@example.com", "password": "pw", "uid": "c2"},'
+                        ' {"email": "c3@example.com", "password": "pw", "uid": "c3"}]')
+    firebase_emulator.load_accounts(str(accounts))
+
+    assert claims_of("c1@example.com", "new")["role"] == "admin"
+    first = firebase_emulator.list_users(max_results=2)
+    assert [u.uid for u in first.users] == ["c1", "c2"] and first.next_page_token == "c2"
+    last = firebase_emulator.list_users(first.next_page_token, max_results=2)
+    assert [u.uid for u in last.users] == ["c3"] and last.next_page_token is None
@@ -0,0 +1,51 @@
+# tests/test_idempotency.py
+import pytest
+from fastapi.testclient import TestClient
+
+from app import firebase_emulator, models, role_claims
+
+
+@pytest.fixture
+def client(db):
+    from app.main import app
+    return TestClient(app)
+
+
+def headers_for(db, role: models.UserRole, key: str) -> dict:
+    user = models.User(email=f"{role.value}@example.com", firebase_uid=f"uid-{role.value}", role=role)
+    db.add(user)
+    db.commit()
+    token = firebase_emulator.mint_id_token(user.firebase_uid, user.email, role_claims.claims_for(user))
+    return {"Authorization": f"Bearer {token}", "Idempotency-Key": key}
+
+
+def test_same_key_and_body_replays(client, db):
+    headers = headers_for(db, models.UserRole.admin, "create-1")
+    first = client.post("/api/courses/", json={"title": "Algebra"}, headers=headers)
+    again = client.post("/api/courses/", json={"title": "Algebra"}, headers=headers)
+    assert first.status_code == again.status_code == 201
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert again.json()["id"] == first.json()["id"]
+
+
+def test_same_key_with_another_body_is_rejected(client, db):
+    headers = headers_for(db, models.UserRole.admin, "create-2")
+    assert client.post("/api/courses/", json={"title": "Algebra"}, headers=headers).status_code == 201
+    reused = client.post("/api/courses/", json={"title": "Geometry"}, headers=headers)
+    assert reused.status_code == 422
+    assert db.query(models.Course).count() == 1
+
+
+def test_uploads_are_compared_by_file_contents(client, db):
+    headers = headers_for(db, models.UserRole.admin, "upload-1")
+    course_id = client.post("/api/courses/", json={"title": "Algebra"},
+                            headers={"Authorization": headers["Authorization"]}).json()["id"]
+
+    def upload(content: bytes):
+        return client.post(f"/api/courses/{course_id}/materials", headers=headers, data={"title": "Notes"},
+                           files={"file": ("notes.pdf", content, "application/pdf")})
+
+    first = upload(b"%PDF-1.4 first")
+    assert first.status_code == 201
+    assert upload(b"%PDF-1.4 first").headers["Idempotent-Replayed"] == "true"
+    assert upload(b"%PDF-1.4 second").status_code == 422
@@ -0,0 +1,100 @@
+# tests/test_resilience.py
+import threading
+import time
+import uuid
+
+import pytest
+
+from app import resilience
+from app.resilience import CircuitBreaker, Dependency, DependencyUnavailable, Fault, InjectedFault
+
+
+@pytest.fixture
+def make_dependency():
+    created = []
+
+    def make(timeout: float = 1, max_concurrent: int = 2, fault: Fault | None = None, **breaker) -> Dependency:
+        dependency = Dependency(f"test_{uuid.uuid4().hex[:8]}", timeout=timeout, max_concurrent=max_concurrent)
+        if breaker:
+            dependency.breaker = CircuitBreaker(**breaker)
+        dependency.fault = fault or Fault()
+        created.append(dependency)
+        return dependency
+
+    yield make
+    for dependency in created:
+        resilience._dependencies.pop(dependency.name, None)
+        dependency._executor.shutdown(wait=True)
+
+
+def test_breaker_opens_after_failures_and_half_opens_after_cooldown(make_dependency):
+    dependency = make_dependency(fault=Fault(error_rate=1), failure_threshold=3, reset_after=0.2)
+    calls = []
+
+    for _ in range(3):
+        with pytest.raises(InjectedFault):
+            dependency.call("op", calls.append, 1)
+    assert dependency.breaker.state == CircuitBreaker.OPEN
+
+    # Open: rejected without running the call
+    with pytest.raises(DependencyUnavailable) as rejected:
+        dependency.call("op", calls.append, 1)
+    assert rejected.value.reason == "circuit open"
+    assert calls == []
+
+    time.sleep(0.25)
+    # Half-open: one trial call goes through; a healthy answer closes the circuit
+    dependency.fault = Fault()
+    assert dependency.call("op", lambda: "ok") == "ok"
+    assert dependency.breaker.state == CircuitBreaker.CLOSED
+    assert dependency.breaker.failures == 0
+
+
+def test_failed_trial_call_reopens_the_circuit(make_dependency):
+    dependency = make_dependency(fault=Fault(error_rate=1), failure_threshold=1, reset_after=0.1)
+    with pytest.raises(InjectedFault):
+        dependency.call("op", lambda: None)
+    time.sleep(0.15)
+
+    assert dependency.breaker.allow()
+    assert dependency.breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one trial at a time
+    assert not dependency.breaker.allow()
+    dependency.breaker.record(False)
+    assert dependency.breaker.state == CircuitBreaker.OPEN
+
+
+def test_bulkhead_rejects_calls_once_all_slots_are_taken(make_dependency, monkeypatch):
+    monkeypatch.setattr(resilience, "BULKHEAD_WAIT_SECONDS", 0.05)
+    dependency = make_dependency(max_concurrent=1, fault=Fault(latency=0.5))
+
+    slow = threading.Thread(target=dependency.call, args=("op", lambda: None), kwargs={"deadline": None})
+    slow.start()
+    time.sleep(0.1)
+    try:
+        with pytest.raises(DependencyUnavailable) as rejected:
+            dependency.call("op", lambda: None)
+        assert rejected.value.reason == "too many concurrent calls"
+    finally:
+        slow.join()
+
+    # The slot is given back once the slow call returns
+    dependency.fault = Fault()
+    assert dependency.call("op", lambda: "ok") == "ok"
+
+
+def test_deadline_raises_while_the_call_keeps_its_slot(make_dependency, monkeypatch):
+    monkeypatch.setattr(resilience, "BULKHEAD_WAIT_SECONDS", 0.05)
+    dependency = make_dependency(timeout=0.05, max_concurrent=1, fault=Fault(latency=0.3))
+
+    started = time.monotonic()
+    with pytest.raises(DependencyUnavailable) as timed_out:
+        dependency.call("op", lambda: None)
+    assert time.monotonic() - started < 0.25
+    assert "no response within 0.05s" in timed_out.value.reason
+    assert dependency.breaker.failures == 1
+
+    # The abandoned call still runs and holds the only slot
+    with pytest.raises(DependencyUnavailable) as rejected:
+        dependency.call("op", lambda: None)
+    assert rejected.value.reason == "too many concurrent calls"
@@ -0,0 +1,33 @@
+# tests/test_role_claims.py
+from sqlalchemy import update
+
+from app import models, role_claims
+
+
+def test_role_changes_made_elsewhere_are_noticed_within_the_recheck_interval(db, monkeypatch):
+    monkeypatch.setattr(role_claims, "ROLE_VERSION_RECHECK_SECONDS", 30)
+    monkeypatch.setattr(role_claims, "_checked_at", {})
+    monkeypatch.setattr(role_claims, "_latest_versions", {})
+    clock = [1000.0]
+    monkeypatch.setattr(role_claims.time, "monotonic", lambda: clock[0])
+    user = models.User(email="ada@example.com", firebase_uid="uid-ada", role=models.UserRole.admin, role_version=0)
+    db.add(user)
+    db.commit()
+    token = {"uid": "uid-ada", **role_claims.claims_for(user)}
+    assert role_claims.principal_from_claims(token).role == models.UserRole.admin
+
+    # Demoted by another instance, whose role change event never reaches this one
+    db.execute(update(models.User).where(models.User.id == user.id)
+               .values(role=models.UserRole.student, role_version=1))
+    db.commit()
+    clock[0] += 10
+    assert role_claims.principal_from_claims(token) is not None
+    clock[0] += 25
+    assert role_claims.principal_from_claims(token) is None
+
+
+def test_no_database_checks_with_the_postgres_broker(db, monkeypatch):
+    monkeypatch.setattr(role_claims, "ROLE_VERSION_RECHECK_SECONDS", 0)
+    monkeypatch.setattr(role_claims, "SessionLocal", None)
+    token = {"uid": "uid-x", role_claims.ROLE_CLAIM: "student", role_claims.ROLE_VERSION_CLAIM: 3, role_claims.USER_ID_CLAIM: 7}
+    assert role_claims.principal_from_claims(token) == role_claims.Principal(7, "uid-x", models.UserRole.student, 3)
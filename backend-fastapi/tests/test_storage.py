@@ -0,0 +1,18 @@
+# tests/test_storage.py
+import pytest
+
+from app import storage
+
+
+def test_incomplete_backends_fail_when_instantiated():
+    class ReadOnlyStorage(storage.StorageBackend):
+        def open(self, path, start=0, end=None):
+            yield b""
+
+    with pytest.raises(TypeError, match="put"):
+        ReadOnlyStorage()
+
+
+def test_local_storage_implements_the_interface(tmp_path):
+    backend = storage.LocalStorage(str(tmp_path), "http://testserver", signing_key=b"k")
+    assert isinstance(backend, storage.StorageBackend)
@@ -0,0 +1,55 @@
+# tests/test_tasks.py
+import json
+
+import pytest
+import requests
+
+from app import firebase, tasks
+
+
+class FakeResponse(requests.Response):
+    def __init__(self, status_code: int, body: dict):
+        super().__init__()
+        self.status_code = status_code
+        self._content = json.dumps(body).encode()
+
+
+@pytest.fixture
+def identity_toolkit(monkeypatch):
+    """Live (non-emulator) mode, with the Identity Toolkit REST calls recorded instead of sent."""
+    calls = []
+    responses = []
+
+    def post(url, params=None, json=None, timeout=None):
+        calls.append({"url": url, "params": params, "json": json})
+        return responses.pop(0) if responses else FakeResponse(200, {"email": json["email"]})
+
+    monkeypatch.setattr(firebase, "EMULATOR", False)
+    monkeypatch.setattr(firebase.requests, "post", post)
+    monkeypatch.setattr(tasks, "FIREBASE_WEB_API_KEY", "web-key")
+    return calls, responses
+
+
+def test_send_password_reset_has_firebase_send_the_email(identity_toolkit):
+    calls, _ = identity_toolkit
+    tasks.send_password_reset({"email": "ada@example.com"})
+
+    assert calls == [{
+        "url": "https://identitytoolkit.googleapis.com/v1/accounts:sendOobCode",
+        "params": {"key": "web-key"},
+        "json": {"requestType": "PASSWORD_RESET", "email": "ada@example.com"},
+    }]
+
+
+def test_send_password_reset_ignores_unknown_emails(identity_toolkit):
+    calls, responses = identity_toolkit
+    responses.append(FakeResponse(400, {"error": {"code": 400, "message": "EMAIL_NOT_FOUND"}}))
+    tasks.send_password_reset({"email": "nobody@example.com"})
+    assert len(calls) == 1
+
+
+def test_send_password_reset_fails_for_retry_on_other_errors(identity_toolkit):
+    _, responses = identity_toolkit
+    responses.append(FakeResponse(400, {"error": {"code": 400, "message": "INVALID_API_KEY"}}))
+    with pytest.raises(requests.HTTPError):
+        tasks.send_password_reset({"email": "ada@example.com"})
@@ -0,0 +1,105 @@
+# tests/test_user_sync.py
+from sqlalchemy import event, select
+
+from app import manage, models, user_sync
+from app.database import engine
+
+
+class MemoryUserSource:
+    """An in-memory stand-in for Firebase; cursors are list offsets."""
+
+    pages_served = 0
+
+    def __init__(self, page_size: int = 1000):
+        self.page_size = page_size
+
+    def fetch_page(self, cursor):
+        MemoryUserSource.pages_served += 1
+        start = int(cursor or 0)
+        end = start + self.page_size
+        return ACCOUNTS[start:end], (str(end) if end < len(ACCOUNTS) else None)
+
+
+ACCOUNTS = [
+    ("uid-new-1", "new1@example.com"),
+    ("uid-new-2", "new2@example.com"),
+    ("uid-existing", "changed@example.com"),
+    ("uid-other", "taken@example.com"),
+    ("uid-new-3", "new3@example.com"),
+]
+
+
+def test_sync_firebase_users_creates_updates_and_skips(db, monkeypatch):
+    db.add_all([
+        models.User(firebase_uid="uid-existing", email="old@example.com", role=models.UserRole.instructor),
+        models.User(firebase_uid="uid-owner", email="taken@example.com", role=models.UserRole.student),
+    ])
+    db.commit()
+    monkeypatch.setattr(user_sync, "FirebaseUserSource", MemoryUserSource)
+    monkeypatch.setattr(manage.firebase, "init_app", lambda: None)
+    MemoryUserSource.pages_served = 0
+
+    user_inserts = []
+
+    def count_inserts(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("INSERT INTO USERS"):
+            user_inserts.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_inserts)
+    try:
+        assert manage.main(["sync-firebase-users", "--batch-size", "2"]) == 0
+    finally:
+        event.remove(engine, "before_cursor_execute", count_inserts)
+
+    db.expire_all()
+    users = {user.firebase_uid: user for user in db.scalars(select(models.User))}
+    # Created as students
+    for uid, email in ACCOUNTS[:2] + ACCOUNTS[4:]:
+        assert users[uid].email == email
+        assert users[uid].role == models.UserRole.student
+    # Updated: new email, role kept
+    assert users["uid-existing"].email == "changed@example.com"
+    assert users["uid-existing"].role == models.UserRole.instructor
+    # Skipped: the email belongs to another account
+    assert "uid-other" not in users
+    assert users["uid-owner"].email == "taken@example.com"
+
+    # Batched: one multi-row INSERT per page of 2 accounts, 3 pages
+    assert MemoryUserSource.pages_served == 3
+    assert len(user_inserts) == 3
+    # Finished runs leave no checkpoint behind
+    assert db.get(models.SyncCheckpoint, user_sync.CHECKPOINT_NAME) is None
+
+
+def test_sync_users_resumes_from_checkpoint(db):
+    db.add(models.SyncCheckpoint(name=user_sync.CHECKPOINT_NAME, cursor="4", processed=4))
+    db.commit()
+
+    totals = user_sync.sync_users(db, MemoryUserSource(page_size=2))
+
+    assert totals == {"pages": 1, "upserted": 1, "skipped": 0, "resumed_from": 4}
+    assert db.scalars(select(models.User.firebase_uid)).all() == ["uid-new-3"]
+
+
+class FixedUserSource:
+    def __init__(self, accounts):
+        self.accounts = accounts
+
+    def fetch_page(self, cursor):
+        return self.accounts, None
+
+
+def test_sync_users_single_page(db):
+    totals = user_sync.sync_users(db, FixedUserSource([("u1", "a@example.com")]))
+
+    assert totals == {"pages": 1, "upserted": 1, "skipped": 0, "resumed_from": 0}
+    assert db.scalars(select(models.User.email)).all() == ["a@example.com"]
+    assert db.get(models.SyncCheckpoint, user_sync.CHECKPOINT_NAME) is None
+
+
+def test_sync_users_empty_source(db):
+    totals = user_sync.sync_users(db, FixedUserSource([]))
+
+    assert totals == {"pages": 1, "upserted": 0, "skipped": 0, "resumed_from": 0}
+    assert db.scalars(select(models.User)).all() == []
+    assert db.get(models.SyncCheckpoint, user_sync.CHECKPOINT_NAME) is None
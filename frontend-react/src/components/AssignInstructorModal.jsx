@@ -1,46 +1,71 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import { useDispatch, useSelector } from 'react-redux';
 import { assignInstructor } from '../redux/courseSlice';
 import { apiFastAPI } from '../api/axios'; // We'll use this for our direct API call
 
+const SEARCH_DEBOUNCE_MS = 250;
+const PAGE_SIZE = 50;
+
 const AssignInstructorModal = ({ isOpen, onClose, course }) => {
   // State now holds the *selected* ID from the dropdown
   const [selectedInstructorId, setSelectedInstructorId] = useState('');
   
-  // State to hold the list of potential instructors fetched from the API
+  // One page at a time of instructors matching the search, from the server-side directory
+  const [search, setSearch] = useState('');
   const [instructorList, setInstructorList] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
 
   const dispatch = useDispatch();
   const { token } = useSelector((state) => state.auth); // Get token for the API call
   const { status: assignmentStatus } = useSelector((state) => state.courses);
 
-  // --- NEW: Fetch the list of instructors when the modal opens ---
+  const fetchInstructors = useCallback((emailPrefix, cursor) => {
+    setIsLoading(true);
+    return apiFastAPI.get('/users/directory', {
+      headers: { Authorization: `Bearer ${token}` },
+      params: {
+        role: 'instructor',
+        email_prefix: emailPrefix || undefined,
+        cursor: cursor || undefined,
+        limit: PAGE_SIZE,
+      },
+    })
+    .then(response => response.data)
+    .catch(error => {
+      console.error("Failed to fetch users", error);
+      alert("Could not load the instructor list. Please check permissions.");
+      return null;
+    })
+    .finally(() => {
+      setIsLoading(false);
+    });
+  }, [token]);
+
+  // Search (debounced) whenever the modal is open and the search text changes
   useEffect(() => {
-    // Only fetch if the modal is open and we haven't already fetched the list
-    if (isOpen && instructorList.length === 0) {
-      setIsLoading(true);
-      // Make a direct API call to the new /users endpoint
-      apiFastAPI.get('/users', {
-        headers: { Authorization: `Bearer ${token}` },
-      })
-      .then(response => {
-        // Filter the full user list to only include potential instructors
-        const potentialInstructors = response.data.filter(
-          user => user.role === 'instructor' 
-        );
-        setInstructorList(potentialInstructors);
-      })
-      .catch(error => {
-        console.error("Failed to fetch users", error);
-        alert("Could not load the instructor list. Please check permissions.");
-      })
-      .finally(() => {
-        setIsLoading(false);
+    if (!isOpen) return undefined;
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      fetchInstructors(search.trim()).then(page => {
+        if (cancelled || !page) return;
+        setInstructorList(page.users);
+        setNextCursor(page.next_cursor);
       });
-    }
-  }, [isOpen, token, instructorList.length]);
+    }, SEARCH_DEBOUNCE_MS);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [isOpen, search, fetchInstructors]);
 
+  const handleLoadMore = () => {
+    fetchInstructors(search.trim(), nextCursor).then(page => {
+      if (!page) return;
+      setInstructorList(list => [...list, ...page.users]);
+      setNextCursor(page.next_cursor);
+    });
+  };
 
   const handleSubmit = (e) => {
     e.preventDefault();
@@ -70,17 +95,22 @@ const AssignInstructorModal = ({ isOpen, onClose, course }) => {
             <label htmlFor="instructor-select" className="block text-gray-700 font-bold mb-2">
               Select Instructor
             </label>
-            {/* --- THE UI CHANGE: From <input> to <select> --- */}
+            <input
+              type="search"
+              value={search}
+              onChange={(e) => setSearch(e.target.value)}
+              placeholder="Search by email..."
+              className="w-full px-3 py-2 border rounded mb-2"
+            />
             <select
               id="instructor-select"
               value={selectedInstructorId}
               onChange={(e) => setSelectedInstructorId(e.target.value)}
               className="w-full px-3 py-2 border rounded bg-white"
               required
-              disabled={isLoading}
             >
               <option value="" disabled>
-                {isLoading ? 'Loading instructors...' : '-- Please choose an instructor --'}
+                {isLoading && instructorList.length === 0 ? 'Loading instructors...' : '-- Please choose an instructor --'}
               </option>
               {instructorList.map(instructor => (
                 <option key={instructor.id} value={instructor.id}>
@@ -88,6 +118,16 @@ const AssignInstructorModal = ({ isOpen, onClose, course }) => {
                 </option>
               ))}
             </select>
+            {nextCursor && (
+              <button
+                type="button"
+                onClick={handleLoadMore}
+                disabled={isLoading}
+                className="mt-2 text-sm text-purple-600 hover:underline disabled:text-gray-400"
+              >
+                {isLoading ? 'Loading...' : 'Load more instructors'}
+              </button>
+            )}
           </div>
           <div className="flex justify-end space-x-4">
             <button type="button" onClick={onClose} className="bg-gray-500 hover:bg-gray-600 text-white font-bold py-2 px-4 rounded">
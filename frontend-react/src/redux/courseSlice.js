@@ -79,15 +79,49 @@ export const enrollInCourse = createAsyncThunk(
   }
 );
 
+// Download URLs are signed for an hour; resync from scratch before the cached ones expire
+const MATERIAL_CACHE_MAX_AGE_MS = 50 * 60 * 1000;
+
 export const fetchCourseMaterials = createAsyncThunk(
   'courses/fetchCourseMaterials',
   async (courseId, { getState, rejectWithValue }) => {
+    const { token } = getState().auth;
+    let cached = getState().courses.materialSync[courseId];
+    if (cached && Date.now() - cached.fullSyncAt > MATERIAL_CACHE_MAX_AGE_MS) {
+      cached = undefined;
+    }
+    // Delta sync: only materials created or deleted since the cursor of the last visit
+    const sync = async (start) => {
+      const byId = { ...(start?.byId || {}) };
+      let cursor = start?.cursor;
+      let hasMore = true;
+      while (hasMore) {
+        const response = await apiFastAPI.get(`/courses/${courseId}/materials/changes`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params: cursor ? { cursor } : {},
+        });
+        for (const change of response.data.changes) {
+          if (change.deleted) {
+            delete byId[change.id];
+          } else {
+            byId[change.id] = change;
+          }
+        }
+        cursor = response.data.cursor;
+        hasMore = response.data.has_more;
+      }
+      return { courseId, cursor, byId, fullSyncAt: start?.fullSyncAt ?? Date.now() };
+    };
     try {
-      const { token } = getState().auth;
-      const response = await apiFastAPI.get(`/courses/${courseId}/materials`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      return response.data;
+      try {
+        return await sync(cached);
+      } catch (error) {
+        // 410: the cursor is older than the server keeps deletions for
+        if (cached && error.response?.status === 410) {
+          return await sync(undefined);
+        }
+        throw error;
+      }
     } catch (error) {
       return rejectWithValue(error.response?.data?.detail || error.message);
     }
@@ -191,6 +225,8 @@ const initialState = {
     students: [],
     status: 'idle',
   },
+  // courseId -> { cursor, byId, fullSyncAt } for delta syncs of the material list
+  materialSync: {},
 };
 
 const courseSlice = createSlice({
@@ -231,8 +267,10 @@ const courseSlice = createSlice({
       
       .addCase(fetchCourseMaterials.pending, (state) => { state.selectedCourse.status = 'loading'; })
       .addCase(fetchCourseMaterials.fulfilled, (state, action) => {
+        const { courseId, ...sync } = action.payload;
+        state.materialSync[courseId] = sync;
         state.selectedCourse.status = 'succeeded';
-        state.selectedCourse.materials = action.payload;
+        state.selectedCourse.materials = Object.values(sync.byId).sort((a, b) => a.id - b.id);
       })
       .addCase(fetchCourseMaterials.rejected, (state, action) => { state.selectedCourse.status = 'failed'; state.error = action.payload; })
       